@@ -0,0 +1,102 @@
+"""
+Measure what registering the plugin costs at pcbnew startup.
+
+Imports the plugin package the way KiCad does in a fresh interpreter with
+-X importtime, with pcbnew already imported so only the plugin's own cost is
+counted. Then imports what the first Run() needs. Run with KiCad's python:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --compare HEAD~1
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+repo = Path(__file__).resolve().parent.parent
+
+heavy_modules = ("wx", "wx.aui", "wx.lib.buttons", "numpy", "pandas", "kicad_testpoints_")
+
+script = """
+import sys
+import pcbnew
+sys.path.insert(0, {root!r})
+import src
+sys.stderr.write("--- run ---\\n")
+try:
+    import dialog
+except ImportError:
+    # Older versions load everything at registration
+    pass
+"""
+
+
+def measure(root: Path) -> dict:
+    """
+    Cumulative import time in ms of the package and of the first Run, with
+    the heavy modules each stage pulled in.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script.format(root=str(root))],
+        capture_output=True,
+        text=True,
+        cwd=root,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    stages = {"registration": {"time": 0.0, "modules": []}, "run": {"time": 0.0, "modules": []}}
+    stage = stages["registration"]
+    for line in result.stderr.splitlines():
+        if line.startswith("--- run ---"):
+            stage = stages["run"]
+            continue
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        if name.strip() in heavy_modules:
+            stage["modules"].append(name.strip())
+        # Top level imports aren't indented
+        if name in ("src", "dialog"):
+            stage["time"] += int(cumulative) / 1000
+    return stages
+
+
+def extract(rev: str, directory: Path) -> Path:
+    archive = subprocess.run(
+        ["git", "archive", rev, "src"], cwd=repo, capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    # The report library is a submodule, link the checked out copy
+    if (repo / "libs").exists():
+        (directory / "libs").symlink_to(repo / "libs", target_is_directory=True)
+    return directory
+
+
+def print_stages(label: str, stages: dict):
+    for name, stage in stages.items():
+        modules = ", ".join(stage["modules"]) or "-"
+        print(f"{label:>10} {name:<13} {stage['time']:8.1f} ms   {modules}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", metavar="REV", help="Also measure the plugin at this git revision")
+    args = parser.parse_args()
+
+    print_stages("current", measure(repo))
+    if args.compare:
+        with tempfile.TemporaryDirectory() as d:
+            print_stages(args.compare, measure(extract(args.compare, Path(d))))
+
+
+if __name__ == "__main__":
+    main()
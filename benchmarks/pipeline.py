@@ -0,0 +1,219 @@
+"""
+Time each stage of report generation on synthetic boards.
+
+Boards from synthetic_board are run through the same code the plugin and the
+batch command use, timing every stage:
+
+    discovery   one pass over the pads picking the test points
+    vias        one pass over the tracks, as many as pads, picking via targets
+    lookup      resolving the test points by (ref des, pad) through PadIndex
+    transform   pad centers to report positions
+    report      the columnar report table
+    distance    nearest probe of every probe
+    coverage    net coverage
+    write       CSV, JSON Lines and packed binary in one pass
+
+When pcbnew can be imported the board is also saved as a .kicad_pcb file,
+loaded with pcbnew and timed through both report paths:
+
+    library     get_pads_by_property and build_test_point_report
+    pcbnew      the snapshot and report table from the loaded board
+
+Each stage runs --repeat times and the fastest is kept. Results are written
+as JSON and can be compared against a stored baseline:
+
+    python benchmarks/pipeline.py --sizes 100 10000 --save results.json
+    python benchmarks/pipeline.py --baseline results.json
+
+Exits with 1 when a stage is slower than the baseline by more than the
+tolerance.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+repo = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from net_coverage import net_coverage  # noqa: E402
+from pad_index import PadIndex  # noqa: E402
+from pad_snapshot import (  # noqa: E402
+    TEST_POINT_PROPERTY, Settings, pad_positions, resolve_origin, take_snapshot,
+)
+from probe_spacing import ProbeIndex, cKDTree  # noqa: E402
+from report_writers import write_report  # noqa: E402
+from synthetic_board import make_board, write_kicad_pcb  # noqa: E402
+from testpoint_table import TestPointTable  # noqa: E402
+from via_targets import via_snapshot  # noqa: E402
+
+try:
+    import pcbnew
+except ImportError:
+    pcbnew = None
+
+default_sizes = (100, 1000, 10_000, 100_000, 500_000)
+stages = ("discovery", "vias", "lookup", "transform", "report", "distance", "coverage", "write")
+# Only timed when pcbnew is available
+pcbnew_stages = ("library", "pcbnew")
+
+# Changes smaller than this many seconds are noise
+noise_floor = 0.005
+
+
+def best_of(repeat: int, function, *args):
+    """
+    Fastest time of repeat runs and the result of the last one.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_size(pad_count: int, repeat: int = 3, seed: int = 0) -> dict:
+    start = time.perf_counter()
+    board = make_board(pad_count, seed=seed, track_count=pad_count)
+    generated = time.perf_counter() - start
+    settings = Settings(use_aux_origin=True)
+    times = {}
+
+    times["discovery"], snapshot = best_of(
+        repeat, lambda: take_snapshot(board, pad_property=TEST_POINT_PROPERTY))
+    times["vias"], _ = best_of(repeat, via_snapshot, board)
+    pairs = list(zip(snapshot.ref_des, snapshot.pad_number))
+    times["lookup"], _ = best_of(repeat, lambda: PadIndex(board).resolve(pairs))
+    origin = resolve_origin(snapshot, settings)
+    times["transform"], _ = best_of(repeat, pad_positions, snapshot.center, origin)
+    times["report"], table = best_of(repeat, TestPointTable.from_snapshot, snapshot, settings)
+    times["distance"], _ = best_of(repeat, lambda: ProbeIndex(table).nearest(1))
+    times["coverage"], _ = best_of(repeat, net_coverage, snapshot, table)
+    with tempfile.TemporaryDirectory() as d:
+        paths = [Path(d) / f"report{ext}" for ext in (".csv", ".jsonl", ".tpb")]
+        times["write"], _ = best_of(repeat, write_report, table, paths)
+        if pcbnew is not None:
+            times.update(pcbnew_times(board, Path(d) / "board.kicad_pcb", repeat, settings))
+
+    return {
+        "pads": len(board.GetPads()),
+        "test points": len(table),
+        "generate": generated,
+        "stages": times,
+        "total": sum(times[s] for s in stages),
+    }
+
+
+def pcbnew_times(board, path: Path, repeat: int, settings: Settings) -> dict:
+    """
+    Times of the library report and the snapshot report on the board loaded
+    by pcbnew from a saved copy of the synthetic layout.
+    """
+    from kicad_testpoints_ import build_test_point_report, get_pads_by_property
+
+    pcb = pcbnew.LoadBoard(str(write_kicad_pcb(board, path)))
+    times = {}
+    times["library"], _ = best_of(
+        repeat, lambda: build_test_point_report(pcb, settings, get_pads_by_property(pcb)))
+    times["pcbnew"], _ = best_of(
+        repeat, lambda: TestPointTable.from_snapshot(
+            take_snapshot(pcb, pad_property=TEST_POINT_PROPERTY), settings))
+    return times
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": cKDTree is not None,
+        "pcbnew": pcbnew.GetBuildVersion() if pcbnew is not None else None,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Stages slower than the baseline by more than tolerance, as text lines.
+    """
+    regressions = []
+    for size, result in results["sizes"].items():
+        old = baseline["sizes"].get(size)
+        if old is None:
+            continue
+        for stage, seconds in result["stages"].items():
+            before = old["stages"].get(stage)
+            if before is None:
+                continue
+            if seconds > before * (1 + tolerance) and seconds - before > noise_floor:
+                regressions.append(
+                    f"{size:>8} pads {stage:<10} {before * 1000:10.1f} ms -> {seconds * 1000:10.1f} ms"
+                )
+    return regressions
+
+
+def print_results(results: dict, baseline: dict = None):
+    timed = [
+        s for s in (*stages, *pcbnew_stages)
+        if any(s in result["stages"] for result in results["sizes"].values())
+    ]
+    print(f"{'pads':>8} " + " ".join(f"{s:>10}" for s in (*timed, "total")) + "   (ms)")
+    for size, result in results["sizes"].items():
+        line = [result["stages"].get(s, float("nan")) for s in timed] + [result["total"]]
+        print(f"{size:>8} " + " ".join(f"{t * 1000:10.1f}" for t in line))
+        old = (baseline or {}).get("sizes", {}).get(size)
+        if old:
+            ratios = [
+                result["stages"][s] / old["stages"][s]
+                if old["stages"].get(s) and s in result["stages"] else float("nan")
+                for s in timed
+            ] + [result["total"] / old["total"] if old.get("total") else float("nan")]
+            print(f"{'vs base':>8} " + " ".join(f"{r:9.2f}x" for r in ratios))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(default_sizes), help="Pad counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic layouts")
+    parser.add_argument("--save", metavar="JSON", help="Write the results here")
+    parser.add_argument("--baseline", metavar="JSON", help="Compare against these results")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed slow down before a stage counts as a regression"
+    )
+    args = parser.parse_args(argv)
+
+    results = {"environment": environment(), "sizes": {}}
+    for size in args.sizes:
+        results["sizes"][str(size)] = run_size(size, args.repeat, args.seed)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("environment") != results["environment"]:
+            print("Baseline was measured in a different environment", file=sys.stderr)
+    print_results(results, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions over {args.tolerance:.0%}:")
+            print("\n".join(regressions))
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+Synthetic boards for benchmarks, no pcbnew needed.
+
+The board, footprints and pads answer the pcbnew calls made by the report
+code: build_test_point_report, get_pads_by_property, get_pads, PadIndex, the
+snapshot builder and the via sweep. Layouts are random but repeatable for a
+given seed. write_kicad_pcb saves a layout as a board file for pcbnew.
+"""
+
+import json
+import random
+from pathlib import Path
+
+# pcbnew internal units are nanometers
+IU_PER_MM = 1_000_000
+
+# PAD_PROP_TESTPOINT and PAD_PROP_NONE in pcbnew
+TEST_POINT_PROPERTY = 4
+NO_PROPERTY = 0
+
+# Layer ids of F.Cu and B.Cu
+F_CU = 0
+B_CU = 31
+
+
+class Vector:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+
+    def __getitem__(self, i: int) -> int:
+        return (self.x, self.y)[i]
+
+    def __repr__(self):
+        return f"Vector({self.x}, {self.y})"
+
+
+class NetInfo:
+    __slots__ = ("name", "net_class")
+
+    def __init__(self, name: str, net_class: str):
+        self.name = name
+        self.net_class = net_class
+
+    def GetNetname(self) -> str:
+        return self.name
+
+    def GetNetClassName(self) -> str:
+        return self.net_class
+
+
+class Pad:
+    __slots__ = ("footprint", "number", "net", "center", "size", "layer", "hole", "property")
+
+    def __init__(self, footprint, number: str, net: NetInfo, center: Vector, size: Vector,
+                 layer: int, hole: bool, property: int):
+        self.footprint = footprint
+        self.number = number
+        self.net = net
+        self.center = center
+        self.size = size
+        self.layer = layer
+        self.hole = hole
+        self.property = property
+
+    def GetParentFootprint(self):
+        return self.footprint
+
+    def GetBoard(self):
+        return self.footprint.board
+
+    def GetNumber(self) -> str:
+        return self.number
+
+    def GetNetname(self) -> str:
+        return self.net.name
+
+    def GetShortNetname(self) -> str:
+        return self.net.name.rsplit("/", 1)[-1]
+
+    def GetNetClassName(self) -> str:
+        return self.net.net_class
+
+    def GetCenter(self) -> Vector:
+        return self.center
+
+    def GetPosition(self) -> Vector:
+        return self.center
+
+    def GetSize(self) -> Vector:
+        return self.size
+
+    def GetLayer(self) -> int:
+        return self.layer
+
+    def HasHole(self) -> bool:
+        return self.hole
+
+    def GetProperty(self) -> int:
+        return self.property
+
+
+class Footprint:
+    def __init__(self, board, ref_des: str, position: Vector, bottom: bool):
+        self.board = board
+        self.ref_des = ref_des
+        self.position = position
+        self.bottom = bottom
+        self.pads = []
+
+    def GetReferenceAsString(self) -> str:
+        return self.ref_des
+
+    def GetReference(self) -> str:
+        return self.ref_des
+
+    def GetPosition(self) -> Vector:
+        return self.position
+
+    def GetSide(self) -> int:
+        return 1 if self.bottom else 0
+
+    def IsFlipped(self) -> bool:
+        return self.bottom
+
+    def GetLayer(self) -> int:
+        return B_CU if self.bottom else F_CU
+
+    def Pads(self) -> list:
+        return self.pads
+
+
+class Track:
+    __slots__ = ("net", "start", "end", "width", "layer")
+
+    def __init__(self, net: NetInfo, start: Vector, end: Vector, width: int, layer: int):
+        self.net = net
+        self.start = start
+        self.end = end
+        self.width = width
+        self.layer = layer
+
+    def GetClass(self) -> str:
+        return "PCB_TRACK"
+
+    def GetNetname(self) -> str:
+        return self.net.name
+
+    def GetWidth(self) -> int:
+        return self.width
+
+
+class Via:
+    __slots__ = ("net", "position", "width", "drill", "top", "bottom")
+
+    def __init__(self, net: NetInfo, position: Vector, width: int, drill: int,
+                 top: int = F_CU, bottom: int = B_CU):
+        self.net = net
+        self.position = position
+        self.width = width
+        self.drill = drill
+        self.top = top
+        self.bottom = bottom
+
+    def GetClass(self) -> str:
+        return "PCB_VIA"
+
+    def GetNetname(self) -> str:
+        return self.net.name
+
+    def GetNetClassName(self) -> str:
+        return self.net.net_class
+
+    def GetPosition(self) -> Vector:
+        return self.position
+
+    def GetWidth(self) -> int:
+        return self.width
+
+    def GetDrillValue(self) -> int:
+        return self.drill
+
+    def TopLayer(self) -> int:
+        return self.top
+
+    def BottomLayer(self) -> int:
+        return self.bottom
+
+
+class DesignSettings:
+    def __init__(self, aux_origin: Vector):
+        self.aux_origin = aux_origin
+        # KiCad 8 board wide via tenting
+        self.m_TentViasFront = False
+        self.m_TentViasBack = False
+
+    def GetAuxOrigin(self) -> Vector:
+        return self.aux_origin
+
+
+class Board:
+    def __init__(self, aux_origin: Vector = None):
+        self.footprints = []
+        self.tracks = []
+        self.nets = {"": NetInfo("", "")}
+        self.design_settings = DesignSettings(aux_origin or Vector(0, 0))
+        self._pads = None
+
+    def GetPads(self) -> list:
+        if self._pads is None:
+            self._pads = [p for fp in self.footprints for p in fp.pads]
+        return self._pads
+
+    def GetFootprints(self) -> list:
+        return self.footprints
+
+    def Footprints(self) -> list:
+        return self.footprints
+
+    def FindFootprintByReference(self, ref_des: str):
+        for fp in self.footprints:
+            if fp.ref_des == ref_des:
+                return fp
+        return None
+
+    def GetTracks(self) -> list:
+        return self.tracks
+
+    def GetLayerID(self, name: str) -> int:
+        return {"F.Cu": F_CU, "B.Cu": B_CU}[name]
+
+    def GetNetsByName(self) -> dict:
+        return self.nets
+
+    def GetNetCount(self) -> int:
+        return len(self.nets)
+
+    def GetDesignSettings(self) -> DesignSettings:
+        return self.design_settings
+
+
+def make_board(pad_count: int, test_point_fraction: float = 0.25, seed: int = 0,
+               track_count: int = 0) -> Board:
+    """
+    A board with about pad_count pads: single pad test points, with a
+    fraction of the pads, and multi pad parts for the rest, spread over a
+    square board sized for the pad count. About a third of the parts sit on
+    the bottom and a tenth of the pads are through hole. track_count track
+    segments and vias follow, one in five a via, a quarter of those with too
+    thin a ring to probe.
+    """
+    rng = random.Random(seed)
+    # About 4 mm^2 of board per pad
+    side_mm = max(20.0, (pad_count * 4.0) ** 0.5)
+    side = int(side_mm * IU_PER_MM)
+    board = Board(aux_origin=Vector(side // 10, side + side // 10))
+
+    net_count = max(1, pad_count // 3)
+    nets = []
+    for i in range(net_count):
+        if i % 50 == 0:
+            name, net_class = f"/Power/+{1 + i % 5}V{i // 50}", "Power"
+        elif i % 7 == 0:
+            name, net_class = f"/Bus/D{i}", "HighSpeed"
+        else:
+            name, net_class = f"Net-(U{i}-Pad1)", "Default"
+        net = board.nets[name] = NetInfo(name, net_class)
+        nets.append(net)
+    no_net = board.nets[""]
+
+    test_points = int(pad_count * test_point_fraction)
+    placed = 0
+    index = 0
+    while placed < pad_count:
+        index += 1
+        bottom = rng.random() < 0.33
+        layer = B_CU if bottom else F_CU
+        x, y = rng.randrange(side), rng.randrange(side)
+        if placed < test_points:
+            fp = Footprint(board, f"TP{index}", Vector(x, y), bottom)
+            diameter = rng.choice((800_000, 1_000_000, 1_500_000))
+            fp.pads.append(Pad(
+                fp, "1", rng.choice(nets), Vector(x, y), Vector(diameter, diameter),
+                layer, rng.random() < 0.1, TEST_POINT_PROPERTY,
+            ))
+        else:
+            count = min(rng.choice((2, 3, 8, 16, 48)), pad_count - placed)
+            fp = Footprint(board, f"U{index}", Vector(x, y), bottom)
+            hole = rng.random() < 0.1
+            pitch = 1_270_000 if hole else 500_000
+            for n in range(count):
+                net = rng.choice(nets) if rng.random() < 0.9 else no_net
+                center = Vector(x + (n % 8) * pitch, y + (n // 8) * pitch)
+                fp.pads.append(Pad(
+                    fp, str(n + 1), net, center, Vector(pitch // 2, pitch),
+                    layer, hole, NO_PROPERTY,
+                ))
+        board.footprints.append(fp)
+        placed += len(fp.pads)
+
+    for i in range(track_count):
+        net = rng.choice(nets)
+        x, y = rng.randrange(side), rng.randrange(side)
+        if i % 5 == 4:
+            width, drill = rng.choice(((400_000, 300_000), (600_000, 300_000), (800_000, 400_000),
+                                       (450_000, 200_000)))
+            board.tracks.append(Via(net, Vector(x, y), width, drill))
+        else:
+            board.tracks.append(Track(
+                net, Vector(x, y), Vector(x + 1_000_000, y), 200_000, rng.choice((F_CU, B_CU))))
+    return board
+
+
+def _mm(value: int) -> str:
+    return f"{value / IU_PER_MM:.6f}"
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def write_kicad_pcb(board: Board, path) -> Path:
+    """
+    Save the footprints, pads and nets of a synthetic board as a .kicad_pcb
+    file, with the net classes in the .kicad_pro next to it, so pcbnew can
+    load the same layout. Tracks and vias are left out.
+    """
+    path = Path(path)
+    numbers = {name: i for i, name in enumerate(board.nets)}
+    origin = board.design_settings.aux_origin
+    lines = [
+        "(kicad_pcb (version 20221018) (generator synthetic_board)",
+        "  (general (thickness 1.6))",
+        "  (layers (0 \"F.Cu\" signal) (31 \"B.Cu\" signal)"
+        " (36 \"B.SilkS\" user) (37 \"F.SilkS\" user))",
+        f"  (setup (pad_to_mask_clearance 0) (aux_axis_origin {_mm(origin.x)} {_mm(origin.y)}))",
+    ]
+    lines += [f"  (net {i} {_quote(name)})" for name, i in numbers.items()]
+    for fp in board.footprints:
+        side = "B" if fp.bottom else "F"
+        x, y = fp.position.x, fp.position.y
+        lines.append(f"  (footprint \"Synthetic:{fp.ref_des.rstrip('0123456789')}\" "
+                     f"(layer \"{side}.Cu\") (at {_mm(x)} {_mm(y)})")
+        lines.append(f"    (fp_text reference {_quote(fp.ref_des)} (at 0 0) (layer \"{side}.SilkS\")"
+                     " (effects (font (size 1 1))))")
+        for pad in fp.pads:
+            if pad.hole:
+                kind = f"thru_hole circle (drill {_mm(min(pad.size.x, pad.size.y) // 2)})"
+                layers = '"*.Cu"'
+            else:
+                kind, layers = "smd rect", f'"{side}.Cu"'
+            net = f" (net {numbers[pad.net.name]} {_quote(pad.net.name)})" if pad.net.name else ""
+            prop = " (property pad_prop_testpoint)" if pad.property == TEST_POINT_PROPERTY else ""
+            lines.append(
+                f"    (pad {_quote(pad.number)} {kind} (at {_mm(pad.center.x - x)} {_mm(pad.center.y - y)})"
+                f" (size {_mm(pad.size.x)} {_mm(pad.size.y)}) (layers {layers}){net}{prop})"
+            )
+        lines.append("  )")
+    lines.append(")")
+    path.write_text("\n".join(lines) + "\n")
+
+    classes = sorted({net.net_class for net in board.nets.values() if net.net_class})
+    project = {"net_settings": {
+        "classes": [{"name": name} for name in classes],
+        "netclass_assignments": {
+            net.name: net.net_class for net in board.nets.values() if net.name
+        },
+    }}
+    path.with_suffix(".kicad_pro").write_text(json.dumps(project, indent=2))
+    return path
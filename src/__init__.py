@@ -1,10 +1,5 @@
 import sys
 import threading
-import time
-from pathlib import Path
-
-import wx
-import wx.aui
 
 from .plugin import Plugin, Meta
 
@@ -12,50 +7,136 @@ plugin = Plugin()
 plugin.register()
 
 
-def check_for_button():
+class ToolbarButton:
+    """
+    Adds the plugin button to pcbnew's top toolbar. Attempts are made when
+    windows are created and on a timer that backs off exponentially. Once the
+    button exists nothing runs until the toolbar is resized or destroyed,
+    which is when pcbnew rebuilds it.
+    """
     # From Miles McCoo's blog
     # https://kicad.mmccoo.com/2017/03/05/adding-your-own-command-buttons-to-the-pcbnew-gui/
+
+    min_delay_ms = 250
+    max_delay_ms = 60000
+
+    def __init__(self):
+        self.delay_ms = self.min_delay_ms
+        self.tool_id = None
+        self.toolbar = None
+        self.bitmap = None
+        self.timer = None
+        self.pending = False
+        self.listening = False
+
+    def start(self):
+        import wx
+
+        if not wx.GetApp():
+            # No event loop yet, check back without blocking the import
+            t = threading.Timer(self.next_delay() / 1000, self.start)
+            t.daemon = True
+            t.start()
+            return
+        wx.CallAfter(self.search)
+
+    def next_delay(self) -> int:
+        delay = self.delay_ms
+        self.delay_ms = min(self.delay_ms * 2, self.max_delay_ms)
+        return delay
+
+    def search(self):
+        """
+        Look for the toolbar, stopping all events once the button is in place.
+        """
+        import wx
+
+        self.pending = False
+        if self.timer:
+            self.timer.Stop()
+            self.timer = None
+
+        if self.install():
+            self.delay_ms = self.min_delay_ms
+            if self.listening:
+                wx.GetApp().Unbind(wx.EVT_WINDOW_CREATE, handler=self.on_window_create)
+                self.listening = False
+            return
+
+        if not self.listening:
+            wx.GetApp().Bind(wx.EVT_WINDOW_CREATE, self.on_window_create)
+            self.listening = True
+        self.timer = wx.CallLater(self.next_delay(), self.search)
+
+    def on_window_create(self, event):
+        import wx
+
+        event.Skip()
+        # Wait for the window to finish building before looking again
+        if not self.pending:
+            self.pending = True
+            wx.CallAfter(self.search)
+
+    def on_toolbar_size(self, event):
+        event.Skip()
+        if self.toolbar and not self.toolbar.FindTool(self.tool_id):
+            self.search()
+
+    def on_toolbar_destroy(self, event):
+        event.Skip()
+        if event.GetEventObject() is self.toolbar:
+            self.toolbar = None
+            self.search()
+
+    @staticmethod
     def find_pcbnew_window():
+        import wx
+
         windows = wx.GetTopLevelWindows()
-        pcbneww = [w for w in windows if "pcbnew" in w.GetTitle().lower()]
+        pcbneww = [
+            w for w in windows
+            if w.GetName() == "PcbFrame" or "pcbnew" in w.GetTitle().lower()
+        ]
         if len(pcbneww) != 1:
             return None
         return pcbneww[0]
 
-    def callback(_):
-        plugin.Run()
+    def install(self) -> bool:
+        import wx
+        from pcbnew import ID_H_TOOLBAR
 
-    while not wx.GetApp():
-        time.sleep(1)
-    bm = wx.Bitmap(str(Meta.icon_file_path), wx.BITMAP_TYPE_PNG)
-    button_wx_item_id = 0
-
-    from pcbnew import ID_H_TOOLBAR
-
-    while True:
-        time.sleep(1)
-        pcbnew_window = find_pcbnew_window()
+        pcbnew_window = self.find_pcbnew_window()
         if not pcbnew_window:
-            continue
-
+            return False
         top_tb = pcbnew_window.FindWindowById(ID_H_TOOLBAR)
-        if button_wx_item_id == 0 or not top_tb.FindTool(button_wx_item_id):
-            top_tb.AddSeparator()
-            button_wx_item_id = wx.NewId()
-            top_tb.AddTool(
-                button_wx_item_id,
-                Meta.toolname,
-                bm,
-                Meta.short_description,
-                wx.ITEM_NORMAL,
-            )
-            top_tb.Bind(wx.EVT_TOOL, callback, id=button_wx_item_id)
-            top_tb.Realize()
+        if not top_tb:
+            return False
+        if top_tb is self.toolbar and top_tb.FindTool(self.tool_id):
+            return True
+
+        if self.bitmap is None:
+            self.bitmap = wx.Bitmap(str(Meta.icon_file_path), wx.BITMAP_TYPE_PNG)
+        self.tool_id = wx.NewIdRef()
+        top_tb.AddSeparator()
+        top_tb.AddTool(
+            self.tool_id,
+            Meta.toolname,
+            self.bitmap,
+            Meta.short_description,
+            wx.ITEM_NORMAL,
+        )
+        top_tb.Bind(wx.EVT_TOOL, lambda _: plugin.Run(), id=self.tool_id)
+        top_tb.Realize()
+
+        if top_tb is not self.toolbar:
+            self.toolbar = top_tb
+            top_tb.Bind(wx.EVT_SIZE, self.on_toolbar_size)
+            top_tb.Bind(wx.EVT_WINDOW_DESTROY, self.on_toolbar_destroy)
+        return True
 
 
 # Add a button the hacky way if plugin button is not supported
 # in pcbnew, unless this is linux.
 if not plugin.pcbnew_icon_support and not sys.platform.startswith("linux"):
-    t = threading.Thread(target=check_for_button)
-    t.daemon = True
-    t.start()
+    toolbar_button = ToolbarButton()
+    toolbar_button.start()
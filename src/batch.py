@@ -0,0 +1,428 @@
+"""
+batch
+Headless report generation for many boards at once.
+
+Each board is loaded and reported in its own worker process. The report is
+written next to the board using the same name the dialog defaults to, once
+per requested format.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+path_ = Path(__file__).resolve().parent.absolute()
+if str(path_) not in sys.path:
+    sys.path.append(str(path_))
+
+from pad_snapshot import concat, take_snapshot, resolve_origin, Settings, TEST_POINT_PROPERTY
+from testpoint_table import TestPointTable
+from kicad_pcb_reader import read_board
+from report_writers import write_report, available_formats
+from net_coverage import net_coverage, write_coverage
+from probe_drc import (
+    board_geometry, board_outline, check_clearances, default_probe_class, probe_classes
+)
+from panel import detect_panel, read_placements, replicate
+from pad_query import PadQuery
+from probe_order import order_probes
+from probe_plate import pad_sizes, write_plates
+from probe_select import ProbeSelector
+from via_targets import ViaRules, via_snapshot
+import stage_trace
+
+_log = logging.getLogger("kicad_testpoints-pcm")
+
+
+def expand_paths(patterns: list[str]) -> list[Path]:
+    """
+    Board paths from a mix of file names, directories and glob patterns.
+    Directories are searched recursively for .kicad_pcb files.
+    """
+    paths = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            paths.extend(sorted(path.rglob("*.kicad_pcb")))
+        elif glob.has_magic(pattern):
+            paths.extend(Path(p) for p in sorted(glob.glob(pattern, recursive=True)))
+        else:
+            paths.append(path)
+    return list(dict.fromkeys(p.absolute() for p in paths))
+
+
+def report_path(board_path: Path, extension: str = ".csv", kind: str = "testpoints") -> Path:
+    return board_path.parent / f"{board_path.stem}-{kind}{extension}"
+
+
+def load_board(board_path: Path, backend: str = "pcbnew", query: str = None,
+               vias: ViaRules = None):
+    """
+    Test point pads of a board, or the pads picked by a pad filter, and the
+    pcbnew board they came from, which is None when read directly from the
+    file. With via rules the vias that qualify as probe targets follow the
+    pads, see via_targets.
+    """
+    pad_query = None if query is None else PadQuery(query)
+    if backend == "file":
+        if pad_query is None:
+            return read_board(board_path, pad_property=TEST_POINT_PROPERTY, vias=vias), None
+        snapshot = read_board(board_path, pad_property=pad_query.property(), vias=vias)
+        return pad_query.select(snapshot), None
+    import pcbnew
+
+    with stage_trace.span("load board", board=Path(board_path).name):
+        board = stage_trace.traced(pcbnew.LoadBoard(str(board_path)))
+    if pad_query is None:
+        snapshot = take_snapshot(board, pad_property=TEST_POINT_PROPERTY)
+    else:
+        snapshot = take_snapshot(board, query=pad_query)
+    if vias is not None:
+        targets = via_snapshot(board, vias)
+        # Vias are test points named VIA to the pad filter
+        if pad_query is not None:
+            targets = pad_query.select(targets)
+        snapshot = concat([snapshot, targets])
+    return snapshot, board
+
+
+def load_snapshot(board_path: Path, backend: str = "pcbnew", query: str = None,
+                  vias: ViaRules = None):
+    """
+    Test point pads of a board, either through pcbnew or read directly from
+    the file.
+    """
+    return load_board(board_path, backend, query, vias)[0]
+
+
+def process_board(
+    board_path: Path,
+    *,
+    use_aux_origin: bool = True,
+    backend: str = "pcbnew",
+    formats=(".csv",),
+    coverage: bool = False,
+    probe_class: str = None,
+    panel: str = None,
+    query: str = None,
+    order_time: float = None,
+    minimal: bool = False,
+    trace: bool = False,
+    vias: ViaRules = None,
+    plates: bool = False,
+) -> dict:
+    """
+    Load a board, build its report and write it next to the board, along with
+    the per net coverage and the probe clearance check if asked. The board
+    edge and courtyards are only checked with the pcbnew backend. Runs in a
+    worker process so errors are returned rather than raised.
+
+    panel is either a placements CSV, making the board the unit of a panel,
+    or "detect" to find the copies on a board that already is a panel.
+    query is a pad filter, see pad_query, instead of the test point property.
+    With order_time set the rows are put in flying probe visiting order,
+    spending up to that many seconds. minimal keeps only the fewest probes
+    that cover every net, spaced for probe_class. With trace set the stage
+    spans of the board are returned under "trace". With via rules vias that
+    qualify are reported with the pads. plates also writes the drill and DXF
+    files of the fixture's probe plates.
+    """
+    result = {
+        "board": str(board_path),
+        "output": None,
+        "test points": 0,
+        "candidates": 0,
+        "covered nets": 0,
+        "nets": 0,
+        "uncovered": [],
+        "violations": None,
+        "path before": None,
+        "path after": None,
+        "load time": 0.0,
+        "report time": 0.0,
+        "error": None,
+        "trace": None,
+    }
+    if trace:
+        stage_trace.enable()
+    try:
+        start = time.perf_counter()
+        snapshot, board = load_board(board_path, backend, query, vias)
+        if panel == "detect":
+            snapshot = detect_panel(snapshot).snapshot()
+        elif panel:
+            snapshot = replicate(snapshot, read_placements(panel))
+            # The unit board's outline and courtyards don't describe the panel
+            board = None
+        loaded = time.perf_counter()
+
+        settings = Settings()
+        settings.use_aux_origin = use_aux_origin
+        table = TestPointTable.from_snapshot(snapshot, settings)
+        result["candidates"] = len(table)
+        if minimal:
+            selector = ProbeSelector(table, probe_class or default_probe_class)
+            table = TestPointTable.from_rows(selector.selected_rows())
+        analysis = net_coverage(snapshot, table)
+        result["test points"] = len(table)
+        result["nets"] = analysis.total
+        result["covered nets"] = analysis.covered
+        result["uncovered"] = analysis.uncovered()
+        if coverage:
+            write_coverage(
+                analysis, [report_path(Path(board_path), ext, "coverage") for ext in formats]
+            )
+        if probe_class:
+            geometry = None
+            if board is not None:
+                geometry = board_geometry(board, resolve_origin(snapshot, settings))
+            drc = check_clearances(table, geometry, probe_class)
+            drc.write([report_path(Path(board_path), ext, "drc") for ext in formats])
+            result["violations"] = len(drc)
+        if order_time is not None and len(table):
+            order = order_probes(table, order_time)
+            table = order.apply(table)
+            result["path before"] = order.length_before
+            result["path after"] = order.length_after
+        if len(table):
+            outputs = write_report(
+                table, [report_path(Path(board_path), ext) for ext in formats]
+            )
+            if plates:
+                outline = None
+                if board is not None:
+                    outline = board_outline(board, resolve_origin(snapshot, settings))
+                outputs += write_plates(
+                    table, Path(board_path), pad_sizes=pad_sizes(snapshot), outline=outline
+                )
+            result["output"] = ", ".join(str(p) for p in outputs)
+
+        result["load time"] = loaded - start
+        result["report time"] = time.perf_counter() - loaded
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if trace:
+            result["trace"] = stage_trace.disable().shifted_events()
+    return result
+
+
+def run_batch(
+    board_paths: list[Path],
+    use_aux_origin: bool = True,
+    jobs: int = None,
+    backend: str = "pcbnew",
+    formats=(".csv",),
+    coverage: bool = False,
+    probe_class: str = None,
+    panel: str = None,
+    query: str = None,
+    order_time: float = None,
+    minimal: bool = False,
+    trace: bool = False,
+    vias: ViaRules = None,
+    plates: bool = False,
+):
+    """
+    Generate reports for all the boards, one board per worker process. Yields
+    the result of each board as it finishes. With jobs=1 boards are processed
+    in this process.
+    """
+    options = dict(
+        use_aux_origin=use_aux_origin,
+        backend=backend,
+        formats=formats,
+        coverage=coverage,
+        probe_class=probe_class,
+        panel=panel,
+        query=query,
+        order_time=order_time,
+        minimal=minimal,
+        trace=trace,
+        vias=vias,
+        plates=plates,
+    )
+    if jobs == 1:
+        for board_path in board_paths:
+            yield process_board(board_path, **options)
+        return
+
+    jobs = min(jobs or os.cpu_count() or 1, len(board_paths)) or 1
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_board, board_path, **options) for board_path in board_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def format_result(result: dict) -> str:
+    name = Path(result["board"]).name
+    if result["error"]:
+        return f"{name}: FAILED {result['error']}"
+    if not result["output"]:
+        return f"{name}: no test point pads found ({result['load time']:.2f} s load)"
+    drc = ""
+    if result["violations"] is not None:
+        drc = ", %d clearance violations" % result["violations"]
+    if result["candidates"] > result["test points"]:
+        drc += ", selected from %d pads" % result["candidates"]
+    if result["path after"] is not None:
+        drc += ", probe path %.0f -> %.0f mm" % (result["path before"], result["path after"])
+    return "%s: %d test points, coverage %d / %d nets%s, %.2f s load, %.2f s report -> %s" % (
+        name,
+        result["test points"],
+        result["covered nets"],
+        result["nets"],
+        drc,
+        result["load time"],
+        result["report time"],
+        result["output"],
+    )
+
+
+def cli(argv=None):
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(
+        prog="kicadtestpoints batch",
+        description="Write a test point report next to each board without opening the GUI",
+    )
+    parser.add_argument("boards", nargs="+", help="Paths, directories or globs of .kicad_pcb files")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument(
+        "--absolute-origin",
+        action="store_true",
+        help="Reference to the absolute origin instead of the file/drill origin",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("pcbnew", "file"),
+        default="pcbnew",
+        help="Load boards with pcbnew or read the .kicad_pcb file directly",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="append",
+        choices=[ext.lstrip(".") for ext in available_formats()],
+        help="Report format, repeat to write several in one pass (default csv)",
+    )
+    parser.add_argument(
+        "--coverage",
+        action="store_true",
+        help="Also write the coverage of each net next to the report",
+    )
+    parser.add_argument(
+        "--drc",
+        metavar="PROBE",
+        choices=list(probe_classes),
+        help="Check probe clearances for this probe size and write the violations",
+    )
+    parser.add_argument(
+        "--panel",
+        metavar="PLACEMENTS",
+        help=(
+            "Treat each board as the unit of a panel laid out by this CSV (x, y in mm, "
+            "rotation, mirror, suffix), or 'detect' to find the copies on a panel board"
+        ),
+    )
+    parser.add_argument(
+        "--select",
+        metavar="QUERY",
+        help="Pad filter instead of the test point property, e.g. 'ref:TP* or property:testpoint'",
+    )
+    parser.add_argument(
+        "--vias",
+        action="store_true",
+        help="Also report vias open on an outer side as probe targets",
+    )
+    parser.add_argument(
+        "--via-ring",
+        metavar="MM",
+        type=float,
+        default=ViaRules.min_annular_ring,
+        help="Smallest annular ring of a via probe target",
+    )
+    parser.add_argument(
+        "--tented-vias",
+        action="store_true",
+        help="Count vias covered by solder mask as probe targets too",
+    )
+    parser.add_argument(
+        "--plates",
+        action="store_true",
+        help="Also write Excellon drill and DXF files of the fixture's top and bottom probe plates",
+    )
+    parser.add_argument(
+        "--minimal",
+        action="store_true",
+        help="Keep only the fewest test points that cover every net, spaced for the --drc probe",
+    )
+    parser.add_argument(
+        "--order",
+        action="store_true",
+        help="Put the rows in visiting order for a flying probe tester",
+    )
+    parser.add_argument(
+        "--order-time",
+        metavar="SECONDS",
+        type=float,
+        default=2.0,
+        help="Time spent improving the probe order of each board",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="JSON",
+        help="Save the time, counts and peak memory of every stage as a Chrome trace",
+    )
+    args = parser.parse_args(argv)
+    if args.select:
+        try:
+            PadQuery(args.select)
+        except UserWarning as e:
+            parser.error(str(e))
+    formats = [f".{f}" for f in dict.fromkeys(args.format or ["csv"])]
+
+    board_paths = expand_paths(args.boards)
+    if not board_paths:
+        _log.error("No boards found")
+        return 1
+
+    start = time.perf_counter()
+    failed = 0
+    events = []
+    for result in run_batch(
+        board_paths,
+        use_aux_origin=not args.absolute_origin,
+        jobs=args.jobs,
+        backend=args.backend,
+        formats=formats,
+        coverage=args.coverage,
+        probe_class=args.drc,
+        panel=args.panel,
+        query=args.select,
+        order_time=args.order_time if args.order else None,
+        minimal=args.minimal,
+        trace=bool(args.trace),
+        vias=ViaRules(args.via_ring, args.tented_vias) if args.vias else None,
+        plates=args.plates,
+    ):
+        events.extend(result["trace"] or ())
+        failed += bool(result["error"])
+        print(format_result(result), flush=True)
+
+    print(
+        "%d boards, %d failed, %.2f s"
+        % (len(board_paths), failed, time.perf_counter() - start)
+    )
+    if args.trace:
+        print("Trace saved to %s" % stage_trace.write_trace(args.trace, events))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,455 @@
+"""
+Plugin dialog. Only imported when the plugin is run.
+"""
+import logging
+import os
+from pathlib import Path
+import wx
+import wx.aui
+from wx.lib import buttons
+import pcbnew
+
+from net_coverage import write_coverage
+from pad_query import PadQuery, default_query
+from pad_snapshot import resolve_origin, Settings
+from probe_drc import (
+    board_geometry, board_outline, check_clearances, draw_markers, probe_classes,
+    default_probe_class,
+)
+from probe_plate import pad_sizes, write_plates
+from report_job import ReportJob
+from via_targets import ViaRules
+import stage_trace
+from plugin_meta import Meta
+
+_log = logging.getLogger("kicad_testpoints-pcm")
+
+_g_board = None
+_frame_size = (800, 600)
+_frame_size_min = (300, 400)
+# Seconds spent improving the probe order
+order_time_s = 2.0
+
+def set_board(board):
+    """
+    Sets the board global.
+    """
+    global _g_board
+    _g_board = board
+
+def get_board():
+    """
+    Use instead of pcbnew.GetBoard to allow
+    command line use.
+    """
+    return _g_board
+
+
+def setattr_keywords(obj, name, value):
+    return setattr(obj, name, value)
+
+
+class MyPanel(wx.Panel):
+    def __init__(self, parent):
+        _log.debug("MyPanel.__init__")
+        super().__init__(parent)
+        self.settings = Settings()
+        self.job = None
+
+        # Get current working directory
+        if pcbnew.GetBoard():
+            set_board(pcbnew.GetBoard())
+
+        dir_path = Path(os.path.curdir)
+        stem = Meta.toolname
+        if get_board():
+            stem = Path(get_board().GetFileName()).stem
+            wd = Path(get_board().GetFileName()).absolute()
+            if wd.exists():
+                dir_path = wd.parent
+
+        default_file_path = dir_path / f"{stem}-testpoints.csv"
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+
+        bold = wx.Font(
+            12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD
+        )
+
+        body_title_text = wx.StaticText(self, label="Usage")
+        body_title_text.SetFont(bold)
+        sizer.Add(body_title_text, 0, wx.EXPAND | wx.ALL, 5)
+
+        body_text = wx.StaticText(self, label=Meta.body)
+        sizer.Add(body_text, 1, wx.EXPAND | wx.ALL, 5)
+
+        # Origin selection
+        choices = (
+            "Reference to file/drill origin",
+            "Reference to absolute origin"
+        )
+        self.coordinate_selection = wx.RadioBox(self, label='Coordinate Positions', choices=choices, majorDimension=2, style=wx.RA_SPECIFY_ROWS)
+        sizer.Add(self.coordinate_selection, 0, wx.ALL, 10)
+
+        body_text = wx.StaticText(self, label=(
+            "Coordinates are Cartesian with x increasing to the right and y increasing upwards. "
+            "Note that the origin should be consistent between gerbers and the testpoints."))
+
+        sizer.Add(body_text, 1, wx.EXPAND | wx.ALL, 5)
+
+
+        # Pad selection
+        query_label = wx.StaticText(self, label="Test point pads:")
+        sizer.Add(query_label, 0, wx.ALL, 5)
+        self.query_text = wx.TextCtrl(self, value=default_query)
+        self.query_text.SetToolTip(
+            "Terms: property:testpoint ref:TP* net:REGEX netclass:REGEX layer:top|bottom "
+            "hole smd size>=0.8, combined with and, or, not and brackets"
+        )
+        sizer.Add(self.query_text, 0, wx.EXPAND | wx.ALL, 5)
+
+        # File output selector
+        file_output_label = wx.StaticText(self, label="File Output:")
+        sizer.Add(file_output_label, 0, wx.ALL, 5)
+
+        self.file_output_selector = wx.FilePickerCtrl(
+            self,
+            style=wx.FLP_SAVE | wx.FLP_USE_TEXTCTRL | wx.FLP_OVERWRITE_PROMPT,
+            wildcard=(
+                "CSV files (*.csv)|*.csv|JSON Lines (*.jsonl)|*.jsonl|"
+                "Packed binary (*.tpb)|*.tpb|Parquet (*.parquet)|*.parquet|"
+                "Arrow (*.arrow)|*.arrow|All files (*.*)|*.*"
+            ),
+            path=default_file_path.as_posix(),
+        )
+        self.file_output_selector.SetPath(default_file_path.as_posix())
+        sizer.Add(self.file_output_selector, 0, wx.EXPAND | wx.ALL, 5)
+
+        self.coverage_checkbox = wx.CheckBox(self, label="Also write net coverage")
+        sizer.Add(self.coverage_checkbox, 0, wx.ALL, 5)
+
+        self.plates_checkbox = wx.CheckBox(self, label="Also write probe plate drill and DXF files")
+        sizer.Add(self.plates_checkbox, 0, wx.ALL, 5)
+
+        self.vias_checkbox = wx.CheckBox(self, label="Also report untented vias as probe targets")
+        sizer.Add(self.vias_checkbox, 0, wx.ALL, 5)
+
+        self.order_checkbox = wx.CheckBox(self, label="Order probes for a flying probe tester")
+        sizer.Add(self.order_checkbox, 0, wx.ALL, 5)
+
+        self.trace_checkbox = wx.CheckBox(self, label="Save a timing trace of each stage")
+        sizer.Add(self.trace_checkbox, 0, wx.ALL, 5)
+
+        # Probe clearance check
+        drc_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.drc_checkbox = wx.CheckBox(self, label="Check probe clearances for")
+        drc_sizer.Add(self.drc_checkbox, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.probe_class_choice = wx.Choice(self, choices=list(probe_classes))
+        self.probe_class_choice.SetStringSelection(default_probe_class)
+        drc_sizer.Add(self.probe_class_choice, 0, wx.ALIGN_CENTER_VERTICAL)
+        drc_sizer.Add(wx.StaticText(self, label="probes"), 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 5)
+        sizer.Add(drc_sizer, 0, wx.ALL, 5)
+
+        # Progress
+        self.progress_text = wx.StaticText(self, label="")
+        sizer.Add(self.progress_text, 0, wx.EXPAND | wx.ALL, 5)
+        self.progress_gauge = wx.Gauge(self, range=100)
+        sizer.Add(self.progress_gauge, 0, wx.EXPAND | wx.ALL, 5)
+
+        # Buttons
+        self.submit_button = buttons.GenButton(self, label="Submit")
+        self.cancel_button = buttons.GenButton(self, label="Cancel")
+        self.submit_button.SetBackgroundColour(wx.Colour(50, 225, 50))
+        self.cancel_button.SetBackgroundColour(wx.Colour(225, 50, 50))
+        self.submit_button.Bind(wx.EVT_BUTTON, self.on_submit)
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel)
+
+        # Horizontal box sizer for buttons
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        button_sizer.Add(self.cancel_button, 0, wx.ALL, 5)
+        button_sizer.Add(self.submit_button, 0, wx.ALL | wx.EXPAND, 5)
+        sizer.Add(button_sizer, 0, wx.ALIGN_RIGHT | wx.ALL, 5)
+
+        # Sizer for layout
+        self.SetSizer(sizer)
+
+    def on_submit(self, _):
+        if self.job and self.job.running:
+            return
+
+        file_path = Path(self.file_output_selector.GetPath())
+        if not file_path:
+            wx.MessageBox(
+                "Please select a file output path.", "Error", wx.OK | wx.ICON_ERROR
+            )
+            return
+
+        self.settings.use_aux_origin = self.coordinate_selection.GetSelection() == 0
+        try:
+            query = PadQuery(self.query_text.GetValue().strip() or default_query)
+        except UserWarning as e:
+            wx.MessageBox(f"Pad filter: {e}", "Error", wx.OK | wx.ICON_ERROR)
+            return
+
+        _log.debug("Submitting.\n%s\nAux origin %s", file_path, str(self.settings.use_aux_origin))
+
+        order_time = order_time_s if self.order_checkbox.GetValue() else None
+        vias = ViaRules() if self.vias_checkbox.GetValue() else None
+        if self.trace_checkbox.GetValue():
+            stage_trace.enable()
+        self.job = ReportJob(
+            stage_trace.traced(get_board()), file_path, settings=self.settings, query=query,
+            order_time=order_time, vias=vias,
+        )
+        self.set_running(True)
+        wx.CallAfter(self.run_job)
+
+    def set_running(self, running: bool):
+        self.submit_button.Enable(not running)
+        self.coordinate_selection.Enable(not running)
+        self.query_text.Enable(not running)
+        self.file_output_selector.Enable(not running)
+        self.coverage_checkbox.Enable(not running)
+        self.plates_checkbox.Enable(not running)
+        self.vias_checkbox.Enable(not running)
+        self.order_checkbox.Enable(not running)
+        self.trace_checkbox.Enable(not running)
+        self.drc_checkbox.Enable(not running)
+        self.probe_class_choice.Enable(not running)
+        self.cancel_button.SetLabel("Stop" if running else "Cancel")
+        if not running:
+            self.progress_gauge.SetValue(0)
+
+    def show_progress(self):
+        job = self.job
+        if job.total:
+            self.progress_gauge.SetRange(max(job.total, 1))
+            self.progress_gauge.SetValue(min(job.done, job.total))
+            self.progress_text.SetLabel(f"{job.stage}: {job.done} / {job.total} pads")
+        else:
+            self.progress_gauge.Pulse()
+            self.progress_text.SetLabel(f"{job.stage}: {job.done} pads")
+
+    def run_job(self):
+        """
+        Runs a short step of the job then gives the event loop a turn before
+        the next one. Everything stays on the main thread for pcbnew.
+        """
+        # The dialog may have been closed while a step was queued
+        if not self:
+            return
+        job = self.job
+        try:
+            stopped = job.step()
+        except Exception as e:
+            _log.exception("Report failed")
+            job.cancel()
+            self.set_running(False)
+            self.progress_text.SetLabel(f"Failed: {e}")
+            message = f"Report failed: {e}"
+            trace_path = self.save_trace(job)
+            if trace_path:
+                message += "\nTrace saved to: %s" % trace_path
+            wx.MessageBox(message, "Error", wx.OK | wx.ICON_ERROR)
+            return
+
+        self.show_progress()
+        if not stopped:
+            wx.CallAfter(self.run_job)
+            return
+
+        self.set_running(False)
+        if job.stage == job.cancelled:
+            self.progress_text.SetLabel("Cancelled")
+            self.save_trace(job)
+            return
+        self.on_job_done(job)
+
+    def save_trace(self, job):
+        """
+        Stop tracing and save the spans next to the report. Returns the path,
+        None when the trace was off.
+        """
+        tracer = stage_trace.disable()
+        if tracer is None:
+            return None
+        file_path = job.file_path
+        trace_path = file_path.with_name(f"{file_path.stem}-trace.json")
+        stage_trace.write_trace(trace_path, tracer.events)
+        _log.info("Stage times:\n%s", tracer.summary())
+        return trace_path
+
+    def on_job_done(self, job):
+        if not len(job.data):
+            self.save_trace(job)
+            self.progress_text.SetLabel("")
+            wx.MessageBox(
+                "No test point pads found, have you set any?",
+                "Error",
+                wx.OK | wx.ICON_ERROR,
+            )
+            return
+
+        coverage = job.net_coverage()
+        file_path = job.file_path
+        message = "%s\n\nSaved to: %s" % (coverage.summary(), file_path)
+        if job.order is not None:
+            message += "\n" + job.order.summary()
+        if self.coverage_checkbox.GetValue():
+            coverage_path = file_path.with_name(f"{file_path.stem}-coverage{file_path.suffix}")
+            write_coverage(coverage, [coverage_path])
+            message += "\nCoverage saved to: %s" % coverage_path
+        if self.plates_checkbox.GetValue():
+            origin = resolve_origin(job.snapshot, self.settings)
+            plate_paths = write_plates(
+                job.data, file_path, pad_sizes=pad_sizes(job.snapshot),
+                outline=board_outline(get_board(), origin),
+            )
+            message += "\nProbe plates saved to: %s" % ", ".join(p.name for p in plate_paths)
+        if self.drc_checkbox.GetValue():
+            message += "\n\n" + self.check_clearances(job)
+        trace_path = self.save_trace(job)
+        if trace_path:
+            message += "\nTrace saved to: %s" % trace_path
+        _log.info(message)
+
+        wx.MessageBox(message, "Success", wx.OK)
+
+        self.GetTopLevelParent().EndModal(wx.ID_OK)
+        return
+
+    def check_clearances(self, job) -> str:
+        """
+        Check the report against the board, mark the violations on it and
+        save them next to the report. Returns the text for the message.
+        """
+        board = get_board()
+        origin = resolve_origin(job.snapshot, self.settings)
+        drc = check_clearances(
+            job.data,
+            board_geometry(board, origin),
+            self.probe_class_choice.GetStringSelection(),
+        )
+        file_path = job.file_path
+        drc_path = file_path.with_name(f"{file_path.stem}-drc{file_path.suffix}")
+        drc.write([drc_path])
+        draw_markers(board, drc, origin)
+        pcbnew.Refresh()
+        _log.info(drc.summary())
+        return "%s\nViolations saved to: %s" % (drc.summary(), drc_path)
+
+    def on_cancel(self, _):
+        if self.job and self.job.running:
+            _log.debug("Stopping report")
+            self.job.cancel()
+            return
+        _log.debug("Canceling")
+        self.GetTopLevelParent().EndModal(wx.ID_CANCEL)
+
+
+class AboutPanel(wx.Panel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        font = wx.Font(
+            12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL
+        )
+        bold = wx.Font(
+            12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD
+        )
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+
+        # Static text for about information
+        version_text = wx.StaticText(self, label=f"Version: {Meta.version}")
+        version_text.SetFont(bold)
+        sizer.Add(version_text, 1, wx.EXPAND | wx.ALL, 5)
+
+        message_text = wx.StaticText(self, label=Meta.about_text)
+        message_text.SetFont(font)
+        sizer.Add(message_text, 1, wx.EXPAND | wx.ALL, 5)
+
+        body_text = wx.StaticText(self, label=Meta.about_body)
+        body_text.SetFont(font)
+        sizer.Add(body_text, 5, wx.EXPAND | wx.ALL, 5)
+
+        from wx.lib.agw.hyperlink import HyperLinkCtrl
+        link_sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        pre_link_text = wx.StaticText(self, label="Brought to you by TheJigsApp: ")
+        pre_link_text.SetFont(font)
+        link_sizer.Add(pre_link_text, 0, wx.EXPAND, 0)
+
+        link = HyperLinkCtrl(self, wx.ID_ANY, f"{Meta.website}", URL=Meta.website)
+        link.SetFont(font)
+        link.SetColours(wx.BLUE, wx.BLUE, wx.BLUE)
+        link_sizer.Add(link, 0, wx.EXPAND, 0)
+
+        sizer.Add(link_sizer, 1, wx.EXPAND | wx.ALL, 5)
+
+        gh_link_sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        gh_pre_link_text = wx.StaticText(self, label="Git Repo: ")
+        gh_pre_link_text.SetFont(font)
+        gh_link_sizer.Add(gh_pre_link_text, 0, wx.EXPAND, 0)
+
+        gh_link = HyperLinkCtrl(self, wx.ID_ANY, f"{Meta.gitlink}", URL=Meta.gitlink)
+        gh_link.SetFont(font)
+        gh_link.SetColours(wx.BLUE, wx.BLUE, wx.BLUE)
+        gh_link_sizer.Add(gh_link, 0, wx.EXPAND, 0)
+
+        sizer.Add(gh_link_sizer, 1, wx.EXPAND | wx.ALL, 5)
+        self.SetSizer(sizer)
+
+
+class MyDialog(wx.Dialog):
+    """
+    Top level GUI view
+    """
+    def __init__(self, parent, title):
+        super().__init__(
+            parent, title=title, style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER
+        )
+
+        # Sizer for layout
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        # Create a notebook with two tabs
+        notebook = wx.Notebook(self)
+        tab_panel = MyPanel(notebook)
+        about_panel = AboutPanel(notebook)
+
+        notebook.AddPage(tab_panel, "Main")
+        notebook.AddPage(about_panel, "About")
+
+        sizer.Add(notebook, 1, wx.EXPAND | wx.ALL, 10)
+
+        self.SetSizer(sizer)
+        self.SetMinSize(_frame_size_min)
+        self.SetSize(_frame_size)
+
+    def on_close(self, event):
+        self.EndModal(wx.ID_CANCEL)
+        event.Skip()
+
+    def on_maximize(self, _):
+        self.fit_to_screen()
+
+    def on_size(self, _):
+        if self.IsMaximized():
+            self.fit_to_screen()
+
+    def fit_to_screen(self):
+        screen_width, screen_height = wx.DisplaySize()
+        self.SetSize(wx.Size(screen_width, screen_height))
+
+
+def get_gui_frame(name: str = "PcbFrame"):
+    pcb_frame = None
+
+    try:
+        pcb_frame = [
+            x for x in wx.GetTopLevelWindows() if x.GetName() == name
+        ][0]
+    except IndexError:
+        pass
+    return pcb_frame
@@ -0,0 +1,438 @@
+"""
+kicad_pcb_reader
+Build a pad snapshot straight from a .kicad_pcb file without pcbnew.
+
+The file is memory mapped and the top level nodes are found with one numpy pass
+over its brackets. Only the setup, nets, net classes and footprints are then
+tokenized; tracks, zones and drawings are never parsed. Net classes are read
+from the project file next to the board when there is one.
+"""
+
+import fnmatch
+import json
+import logging
+import math
+import mmap
+import re
+from pathlib import Path
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot, IU_PER_MM, concat
+from stage_trace import stage
+from via_targets import ViaFields, ViaRules
+
+_log = logging.getLogger("kicad_testpoints")
+
+_token = re.compile(r'(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+)')
+
+# PAD_PROP in pcbnew
+pad_properties = {
+    "pad_prop_bga": 1,
+    "pad_prop_fiducial_glob": 2,
+    "pad_prop_fiducial_loc": 3,
+    "pad_prop_testpoint": 4,
+    "pad_prop_heatsink": 5,
+    "pad_prop_castellated": 6,
+    "pad_prop_mechanical": 7,
+}
+
+# Top level nodes that are parsed, everything else is skipped
+_board_nodes = {"setup", "net", "net_class", "footprint", "module"}
+# Children of footprints and pads that are never needed
+_skipped_nodes = {
+    "fp_line", "fp_arc", "fp_circle", "fp_rect", "fp_poly", "fp_curve",
+    "model", "primitives", "zone", "group", "uuid", "tstamp", "tedit",
+    "effects", "descr", "tags", "path", "sheetname", "sheetfile",
+}
+
+
+class _Atom(str):
+    """
+    A quoted string, kept apart from keywords so "1" and 1 don't clash.
+    """
+
+
+def _parse_node(text: str):
+    """
+    Parse one node into nested lists of [name, args...]. Children named in
+    _skipped_nodes are dropped.
+    """
+    stack = []
+    node = None
+    skipping = 0
+    expect_name = False
+    for open_, close, quoted, atom in _token.findall(text):
+        if skipping:
+            if open_:
+                skipping += 1
+            elif close:
+                skipping -= 1
+            continue
+        if open_:
+            expect_name = True
+        elif close:
+            if not stack:
+                return node
+            node = stack.pop()
+        elif expect_name:
+            expect_name = False
+            if atom in _skipped_nodes:
+                skipping = 1
+                continue
+            child = [atom]
+            if node is not None:
+                node.append(child)
+                stack.append(node)
+            node = child
+        elif atom:
+            node.append(atom)
+        else:
+            if "\\" in quoted:
+                quoted = re.sub(r"\\(.)", r"\1", quoted)
+            node.append(_Atom(quoted))
+    return node
+
+
+def _children(node, name):
+    return [child for child in node[1:] if isinstance(child, list) and child[0] == name]
+
+
+def _child(node, name):
+    for child in node[1:]:
+        if isinstance(child, list) and child[0] == name:
+            return child
+    return None
+
+
+def _to_iu(value) -> int:
+    return _kiround(float(value) * IU_PER_MM)
+
+
+def _kiround(value: float) -> int:
+    return int(value + 0.5) if value >= 0 else int(value - 0.5)
+
+
+def _rotate(x: int, y: int, angle: float) -> tuple[int, int]:
+    """
+    Rotate like pcbnew's RotatePoint, exact for right angles.
+    """
+    angle = angle % 360
+    if angle == 0:
+        return x, y
+    if angle == 90:
+        return y, -x
+    if angle == 180:
+        return -x, -y
+    if angle == 270:
+        return -y, x
+    s = math.sin(math.radians(angle))
+    c = math.cos(math.radians(angle))
+    return _kiround(y * s + x * c), _kiround(y * c - x * s)
+
+
+def _top_level_nodes(buf) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Start and end offsets of the nodes directly inside the root node. Brackets
+    inside quoted strings are ignored.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    quotes = np.flatnonzero(data == ord('"'))
+    # A quote is escaped when it follows an odd number of backslashes
+    escaped = np.zeros(len(quotes), dtype=bool)
+    for i in np.flatnonzero(data[quotes - 1] == ord("\\")) if len(quotes) else ():
+        q = quotes[i] - 1
+        while q >= 0 and data[q] == ord("\\"):
+            q -= 1
+        escaped[i] = (quotes[i] - 1 - q) % 2 == 1
+    quotes = quotes[~escaped]
+
+    brackets = np.flatnonzero((data == ord("(")) | (data == ord(")")))
+    brackets = brackets[np.searchsorted(quotes, brackets) % 2 == 0]
+    step = np.where(data[brackets] == ord("("), 1, -1)
+    depth = np.cumsum(step)
+    starts = brackets[(step == 1) & (depth == 2)]
+    ends = brackets[(step == -1) & (depth == 1)]
+    return starts, ends
+
+
+def _read_nodes(path: Path, footprint_filter: bytes = None, nodes: set = _board_nodes):
+    """
+    Parsed board level nodes named in nodes. Footprints not containing
+    footprint_filter are skipped without being parsed.
+    """
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if not re.match(rb"\s*\(\s*kicad_pcb[\s()]", buf):
+            msg = f"{path} is not a kicad_pcb file"
+            raise UserWarning(msg)
+        starts, ends = _top_level_nodes(buf)
+        # Cheap check of the first letters before looking at the name
+        data = np.frombuffer(buf, dtype=np.uint8)
+        first = data[np.minimum(starts + 1, len(data) - 1)]
+        letters = bytes(sorted({ord(n[0]) for n in nodes}))
+        keep = np.isin(first, np.frombuffer(letters, dtype=np.uint8))
+        # The map can't close while numpy still points into it
+        del data
+        name = re.compile(rb"\(\s*([^\s()\"]+)")
+        for start, end in zip(starts[keep].tolist(), ends[keep].tolist()):
+            node_name = name.match(buf, start).group(1).decode()
+            if node_name not in nodes:
+                continue
+            if (
+                footprint_filter
+                and node_name in ("footprint", "module")
+                and buf.find(footprint_filter, start, end) < 0
+            ):
+                continue
+            yield _parse_node(buf[start:end + 1].decode("utf-8"))
+
+
+def _net_name(net_node, net_numbers: dict) -> str:
+    """
+    Net of a pad or via, given by name or by the number of a board net.
+    """
+    if not net_node:
+        return ""
+    if len(net_node) > 2:
+        return str(net_node[2])
+    if isinstance(net_node[1], _Atom):
+        return str(net_node[1])
+    return net_numbers.get(net_node[1], "")
+
+
+def _yes(value) -> bool:
+    return value in ("yes", "true")
+
+
+def _tenting(node, default: tuple) -> tuple[bool, bool]:
+    """
+    Front and back via tenting from a (tenting front back) list of the tented
+    sides or a (tenting (front yes) (back no)) node, default if there is none.
+    """
+    tenting = _child(node, "tenting") if node else None
+    if tenting is None:
+        return default
+    front, back = default
+    for flag in tenting[1:]:
+        if isinstance(flag, list):
+            if flag[0] == "front":
+                front = _yes(flag[1])
+            elif flag[0] == "back":
+                back = _yes(flag[1])
+    if not any(isinstance(flag, list) for flag in tenting[1:]):
+        front, back = "front" in tenting[1:], "back" in tenting[1:]
+    return front, back
+
+
+class NetClasses:
+    """
+    Net name to net class name, following the project file's assignments and
+    patterns. Unassigned nets are in the Default class.
+    """
+
+    default = "Default"
+
+    def __init__(self, assignments: dict = None, patterns: list = None):
+        self.assignments = dict(assignments or {})
+        self.patterns = list(patterns or [])
+        self._cache = {}
+
+    @classmethod
+    def from_project(cls, project_path: Path) -> "NetClasses":
+        with project_path.open() as f:
+            settings = json.load(f).get("net_settings", {})
+
+        assignments = {}
+        # KiCad 6 lists the nets in each class
+        for net_class in settings.get("classes", []):
+            for net in net_class.get("nets", []):
+                assignments[net] = net_class["name"]
+
+        for net, net_class in (settings.get("netclass_assignments") or {}).items():
+            # KiCad 9 allows several classes per net, the first has priority
+            if isinstance(net_class, list):
+                net_class = net_class[0] if net_class else cls.default
+            assignments[net] = net_class
+
+        patterns = [
+            (p["pattern"], p["netclass"]) for p in settings.get("netclass_patterns") or []
+        ]
+        return cls(assignments, patterns)
+
+    def __getitem__(self, net: str) -> str:
+        try:
+            return self._cache[net]
+        except KeyError:
+            pass
+        net_class = self.assignments.get(net)
+        if net_class is None:
+            net_class = self.default
+            for pattern, pattern_class in self.patterns:
+                if fnmatch.fnmatchcase(net, pattern):
+                    net_class = pattern_class
+                    break
+        self._cache[net] = net_class
+        return net_class
+
+
+@stage("pad discovery", lambda s, *_: {"pads": len(s), "nets": len(s.nets)})
+def read_board(board_path: Path, pad_property: int = None, project_path: Path = None,
+               vias: ViaRules = None) -> PadSnapshot:
+    """
+    Read the pads of a .kicad_pcb file into a snapshot with the same data
+    take_snapshot gets from pcbnew. With pad_property set only pads with that
+    fabrication property are kept. The project file defaults to the .kicad_pro
+    next to the board. With via rules the vias that qualify as probe targets
+    follow the pads, like via_snapshot finds them.
+    """
+    board_path = Path(board_path)
+    if project_path is None:
+        project_path = board_path.with_suffix(".kicad_pro")
+    project_path = Path(project_path)
+
+    aux_origin = (0, 0)
+    net_numbers = {}
+    board_nets = {}
+    board_classes = {}
+    footprints = []
+    via_nodes = []
+    # KiCad tents vias unless told otherwise
+    tenting = (True, True)
+    footprint_filter = None
+    if pad_property is not None:
+        names = [name for name, value in pad_properties.items() if value == pad_property]
+        if names:
+            footprint_filter = names[0].encode()
+    nodes = _board_nodes if vias is None else _board_nodes | {"via"}
+    for node in _read_nodes(board_path, footprint_filter, nodes):
+        name = node[0]
+        if name == "setup":
+            origin = _child(node, "aux_axis_origin")
+            if origin:
+                aux_origin = (_to_iu(origin[1]), _to_iu(origin[2]))
+            vias_on_mask = _child(_child(node, "pcbplotparams") or [], "viasonmask")
+            if vias_on_mask:
+                tenting = (not _yes(vias_on_mask[1]),) * 2
+            tenting = _tenting(node, tenting)
+        elif name == "via":
+            via_nodes.append(node)
+        elif name == "net":
+            net_name = str(node[2]) if len(node) > 2 else ""
+            net_numbers[node[1]] = net_name
+            board_nets[net_name] = None
+        elif name == "net_class":
+            # Older boards keep the classes in the board file
+            for add_net in _children(node, "add_net"):
+                board_classes[str(add_net[1])] = str(node[1])
+        else:
+            footprints.append(node)
+
+    net_classes = NetClasses(board_classes)
+    if project_path.exists():
+        project_classes = NetClasses.from_project(project_path)
+        net_classes = NetClasses({**board_classes, **project_classes.assignments}, project_classes.patterns)
+
+    ref_des, pad_number, net, net_class = [], [], [], []
+    has_hole, bottom, footprint_bottom, pad_property_list, center, size = [], [], [], [], [], []
+    for fp in footprints:
+        fp_bottom = _child(fp, "layer")[1] == "B.Cu"
+        at = _child(fp, "at")
+        fp_x, fp_y = _to_iu(at[1]), _to_iu(at[2])
+        fp_angle = float(at[3]) if len(at) > 3 else 0.0
+
+        reference = ""
+        for prop in _children(fp, "property"):
+            if prop[1] == "Reference":
+                reference = str(prop[2])
+        for text in _children(fp, "fp_text"):
+            if text[1] == "reference":
+                reference = str(text[2])
+
+        for pad in _children(fp, "pad"):
+            prop = 0
+            prop_node = _child(pad, "property")
+            if prop_node:
+                prop = pad_properties.get(prop_node[1], 0)
+            if pad_property is not None and prop != pad_property:
+                continue
+
+            pad_at = _child(pad, "at")
+            x, y = _rotate(_to_iu(pad_at[1]), _to_iu(pad_at[2]), fp_angle)
+
+            net_node = _child(pad, "net")
+            pad_net = _net_name(net_node, net_numbers)
+            if net_node:
+                board_nets[pad_net] = None
+
+            drill = _child(pad, "drill")
+            hole = False
+            if drill:
+                sizes = [float(v) for v in drill[1:] if not isinstance(v, list) and v != "oval"]
+                hole = bool(sizes) and min(sizes) > 0
+                # GetCenter is the shape's center, offset from the hole and
+                # turned with the pad
+                offset = _child(drill, "offset")
+                if offset:
+                    pad_angle = float(pad_at[3]) if len(pad_at) > 3 else 0.0
+                    dx, dy = _rotate(_to_iu(offset[1]), _to_iu(offset[2]), pad_angle)
+                    x, y = x + dx, y + dy
+
+            # Same rule as get_pad_side, the pad's layer is the footprint side
+            # unless it is an SMD pad on the opposite side
+            layers = _child(pad, "layers")[1:]
+            front = "F.Cu" in layers or "*.Cu" in layers or "F&B.Cu" in layers
+
+            ref_des.append(reference)
+            pad_number.append(str(pad[1]))
+            net.append(pad_net)
+            net_class.append(net_classes[pad_net])
+            has_hole.append(hole)
+            bottom.append(fp_bottom or not front)
+            footprint_bottom.append(fp_bottom)
+            pad_property_list.append(prop)
+            center.append((fp_x + x, fp_y + y))
+            pad_size = _child(pad, "size")
+            size.append((_to_iu(pad_size[1]), _to_iu(pad_size[2])) if pad_size else (0, 0))
+
+    via_fields = ViaFields()
+    for number, via in enumerate(via_nodes, 1):
+        width = _to_iu(_child(via, "size")[1])
+        if not vias.qualifies(width, _to_iu(_child(via, "drill")[1])):
+            continue
+        layers = _child(via, "layers")[1:]
+        top_open = layers[0] == "F.Cu"
+        bottom_open = layers[-1] == "B.Cu"
+        if not vias.tented:
+            tented_front, tented_back = _tenting(via, tenting)
+            top_open = top_open and not tented_front
+            bottom_open = bottom_open and not tented_back
+        if not (top_open or bottom_open):
+            continue
+        net_node = _child(via, "net")
+        via_net = _net_name(net_node, net_numbers)
+        if net_node:
+            board_nets[via_net] = None
+        at = _child(via, "at")
+        via_fields.add(
+            number, via_net, net_classes[via_net], (_to_iu(at[1]), _to_iu(at[2])), width,
+            top_open, bottom_open,
+        )
+
+    snapshot = PadSnapshot(
+        ref_des=ref_des,
+        pad_number=pad_number,
+        net=net,
+        net_class=net_class,
+        has_hole=np.array(has_hole, dtype=bool),
+        bottom=np.array(bottom, dtype=bool),
+        footprint_bottom=np.array(footprint_bottom, dtype=bool),
+        pad_property=np.array(pad_property_list, dtype=np.int32),
+        center=np.array(center, dtype=np.int64).reshape(-1, 2),
+        size=np.array(size, dtype=np.int64).reshape(-1, 2),
+        aux_origin=aux_origin,
+        nets=list(board_nets),
+        net_classes={n: net_classes[n] for n in board_nets},
+    )
+    if via_fields.count:
+        snapshot = concat([snapshot, via_fields.snapshot()])
+    return snapshot
@@ -0,0 +1,210 @@
+"""
+net_coverage
+Which nets of a board are reached by test points.
+
+Board nets and test point nets are joined on integer net codes so the whole
+analysis is a few dictionary lookups and bincounts, near linear in the number
+of nets and pads. Net names are normalized once per name and cached across
+runs for the power and ground detection.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot
+from report_writers import MultiWriter
+from stage_trace import stage
+
+_log = logging.getLogger("kicad_testpoints")
+
+kinds = ("signal", "power", "ground")
+
+_ground = re.compile(r"^(A|D|P|S|CHASSIS|EARTH|SIG|PWR)?_?(GND|GROUND|VSS|0V)")
+_power = re.compile(
+    r"^(V(CC|DD|EE|BAT|BUS|IN|SYS|REF|IO|CORE|MAIN|PP|AA)|PWR|POWER|[+-]?\d+V\d*|[+-]\d)"
+)
+
+
+@lru_cache(maxsize=65536)
+def normalize_net(name: str) -> str:
+    """
+    Upper case net name without the hierarchical sheet path or the Net-()
+    wrapper of unnamed nets, so /Power/+3v3 and +3V3 compare equal.
+    """
+    name = name.rsplit("/", 1)[-1].strip().upper()
+    if name.startswith("NET-(") and name.endswith(")"):
+        name = name[5:-1]
+    return name
+
+
+@lru_cache(maxsize=65536)
+def net_kind(name: str, net_class: str = "") -> str:
+    """
+    "ground", "power" or "signal" from the net name, falling back on the net
+    class name.
+    """
+    for value in (normalize_net(name), normalize_net(net_class)):
+        if not value:
+            continue
+        if _ground.match(value):
+            return "ground"
+        if _power.match(value):
+            return "power"
+    return "signal"
+
+
+@dataclass
+class NetCoverage:
+    """
+    Per board net: its class, kind and the number of test points on it.
+    Nets are in board order, the unconnected net "" is left out.
+    """
+    nets: list = field(default_factory=list)
+    net_class: list = field(default_factory=list)
+    kind: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int8))
+    probes: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    # Test points with no net or on a net the board does not list
+    unmatched: int = 0
+
+    columns = ("net", "net class", "kind", "probes")
+
+    @property
+    def total(self) -> int:
+        return len(self.nets)
+
+    @property
+    def covered(self) -> int:
+        return int(np.count_nonzero(self.probes))
+
+    def uncovered(self) -> list[str]:
+        return [self.nets[i] for i in np.flatnonzero(self.probes == 0)]
+
+    def multiply_probed(self) -> dict:
+        """
+        Net -> number of test points, for nets with more than one.
+        """
+        return {self.nets[i]: int(self.probes[i]) for i in np.flatnonzero(self.probes > 1)}
+
+    def _grouped(self, codes: np.ndarray, names) -> dict:
+        covered = np.bincount(codes, weights=self.probes > 0, minlength=len(names))
+        total = np.bincount(codes, minlength=len(names))
+        return {
+            name: (int(c), int(t))
+            for name, c, t in zip(names, covered.tolist(), total.tolist())
+            if t
+        }
+
+    def by_class(self) -> dict:
+        """
+        Net class -> (covered nets, total nets).
+        """
+        lookup = {}
+        codes = np.fromiter(
+            (lookup.setdefault(c, len(lookup)) for c in self.net_class),
+            dtype=np.intp,
+            count=len(self.net_class),
+        )
+        return self._grouped(codes, list(lookup))
+
+    def by_kind(self) -> dict:
+        """
+        "signal", "power" and "ground" -> (covered nets, total nets).
+        """
+        return self._grouped(self.kind.astype(np.intp), kinds)
+
+    def nets_of_kind(self, kind: str) -> list[str]:
+        code = kinds.index(kind)
+        return [self.nets[i] for i in np.flatnonzero(self.kind == code)]
+
+    def records(self):
+        return zip(self.nets, self.net_class, (kinds[k] for k in self.kind.tolist()),
+                   self.probes.tolist())
+
+    def rows(self):
+        return (dict(zip(self.columns, r)) for r in self.records())
+
+    def summary(self, limit: int = 10) -> str:
+        """
+        Multi line text for the dialog and the command line.
+        """
+        lines = [f"Coverage: {self.covered} / {self.total} nets"]
+        for kind, (covered, total) in self.by_kind().items():
+            lines.append(f"  {kind}: {covered} / {total}")
+        lines.append("By net class:")
+        for name, (covered, total) in sorted(self.by_class().items()):
+            lines.append(f"  {name or '(none)'}: {covered} / {total}")
+
+        def listing(title, names):
+            if not names:
+                return
+            shown = ", ".join(names[:limit])
+            more = f" and {len(names) - limit} more" if len(names) > limit else ""
+            lines.append(f"{title} ({len(names)}): {shown}{more}")
+
+        listing("Uncovered", self.uncovered())
+        listing("Probed more than once", [f"{n} x{c}" for n, c in self.multiply_probed().items()])
+        if self.unmatched:
+            lines.append(f"Test points without a board net: {self.unmatched}")
+        return "\n".join(lines)
+
+
+@stage("net coverage", lambda c, *_: {"nets": c.total, "covered nets": c.covered})
+def net_coverage(snapshot: PadSnapshot, report=None) -> NetCoverage:
+    """
+    Coverage of the snapshot's board nets by the test points in report, a
+    TestPointTable or a list of report rows. Defaults to the snapshot's own
+    test point pads.
+    """
+    if report is None:
+        test_points = snapshot.test_points()
+        test_point_nets = test_points.net
+        test_point_classes = test_points.net_class
+    elif hasattr(report, "codes"):
+        test_point_nets = report.column("net")
+        test_point_classes = report.column("net class")
+    else:
+        test_point_nets = [row["net"] for row in report]
+        test_point_classes = [row["net class"] for row in report]
+
+    nets = [n for n in dict.fromkeys(snapshot.nets) if n]
+    index = {n: i for i, n in enumerate(nets)}
+
+    # Net classes from the board, then from the test points themselves
+    classes = dict(zip(test_point_nets, test_point_classes))
+    classes.update(snapshot.net_classes)
+    net_class = [classes.get(n, "") for n in nets]
+
+    codes = np.fromiter(
+        (index.get(n, -1) for n in test_point_nets), dtype=np.intp, count=len(test_point_nets)
+    )
+    matched = codes[codes >= 0]
+    probes = np.bincount(matched, minlength=len(nets)).astype(np.int64)
+    kind = np.fromiter(
+        (kinds.index(net_kind(n, c)) for n, c in zip(nets, net_class)),
+        dtype=np.int8,
+        count=len(nets),
+    )
+    _log.debug("Net kinds cached: %s", net_kind.cache_info())
+    return NetCoverage(
+        nets=nets,
+        net_class=net_class,
+        kind=kind,
+        probes=probes,
+        unmatched=len(codes) - len(matched),
+    )
+
+
+def write_coverage(coverage: NetCoverage, paths: list) -> list:
+    """
+    Write one row per net to every path, format by extension.
+    """
+    out = MultiWriter(paths).open(NetCoverage.columns)
+    try:
+        out.write(list(coverage.records()))
+    finally:
+        out.close()
+    return out.paths
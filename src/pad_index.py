@@ -0,0 +1,75 @@
+"""
+pad_index
+Board level lookup of pads by (ref des, pad number).
+
+Built with one pass over the footprints so a list of test points resolves with
+dictionary lookups instead of a FindFootprintByReference call and a linear pad
+scan for each entry.
+"""
+
+import logging
+
+_log = logging.getLogger("kicad_testpoints")
+
+
+class PadIndex:
+    """
+    ref des -> {pad number -> pad}. As with FindFootprintByReference and
+    get_pads the first footprint and pad found win when names repeat.
+    """
+
+    def __init__(self, board):
+        self.footprints = {}
+        for fp in board.GetFootprints():
+            ref_des = fp.GetReferenceAsString()
+            if ref_des in self.footprints:
+                continue
+            pads = {}
+            for pad in fp.Pads():
+                pads.setdefault(str(pad.GetNumber()), pad)
+            self.footprints[ref_des] = pads
+
+    def __contains__(self, ref_des: str):
+        return ref_des in self.footprints
+
+    def get(self, ref_des: str, pad_number):
+        """
+        The pad or None if either the footprint or the pad doesn't exist.
+        """
+        return self.footprints.get(ref_des, {}).get(str(pad_number))
+
+    def resolve(self, pad_pair: tuple[tuple[str, int]]) -> list:
+        """
+        Get list of matching pads from a list of (ref_des, pad_num). All the
+        missing entries are reported together in a single UserWarning.
+        """
+        pads = []
+        missing_refs = []
+        missing_pads = []
+        for ref_des, pad_number in pad_pair:
+            module = self.footprints.get(ref_des)
+            if module is None:
+                missing_refs.append(ref_des)
+                continue
+            pad = module.get(str(pad_number))
+            if pad is None:
+                missing_pads.append((ref_des, pad_number))
+                continue
+            pads.append(pad)
+
+        if missing_refs or missing_pads:
+            lines = []
+            if missing_refs:
+                lines.append("Ref Des not found: %s" % ", ".join(dict.fromkeys(missing_refs)))
+            for ref_des, pad_number in missing_pads:
+                nums = list(self.footprints[ref_des])
+                lines.append(f"Pad {pad_number} not found in module {ref_des} ({nums})")
+            raise UserWarning("\n".join(lines))
+        return pads
+
+
+def get_pads(pad_pair: tuple[tuple[str, int]], board) -> list:
+    """
+    Get list of matching pads from a list of (ref_des, pad_num)
+    """
+    return PadIndex(board).resolve(pad_pair)
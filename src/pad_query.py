@@ -0,0 +1,327 @@
+"""
+pad_query
+A small filter language for picking the pads to report.
+
+    property:testpoint ref:TP* net:GND|VCC.* netclass:Power layer:bottom
+    hole smd size>=0.8 not ref:J* (ref:TP* or property:testpoint)
+
+Terms next to each other must all match, "or" joins alternatives, "not"
+negates and brackets group. ref takes a glob, net and netclass a regular
+expression that must match the whole name, size is the smaller side of the
+pad in mm and property takes a fabrication property name or number.
+
+Brackets balanced within a value belong to it, so net:Net-(J1-Pad2) and
+net:(GND|VCC) are single terms. Values can also be quoted, net:"A B". A net
+or net class name also matches as written, brackets and all, as KiCad names
+unnamed nets like Net-(J1-Pad2).
+
+A query compiles once into a predicate over pcbnew pads that makes only the
+calls its terms need, cheapest terms first, and into vectorized masks over a
+PadSnapshot.
+"""
+
+import fnmatch
+import logging
+import re
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot, IU_PER_MM, TEST_POINT_PROPERTY
+
+_log = logging.getLogger("kicad_testpoints")
+
+properties = {
+    "none": 0,
+    "bga": 1,
+    "fiducial_glob": 2,
+    "fiducial_loc": 3,
+    "testpoint": TEST_POINT_PROPERTY,
+    "heatsink": 5,
+    "castellated": 6,
+    "mechanical": 7,
+}
+
+# Same selection as the plugin has always made
+default_query = "property:testpoint"
+
+_size = re.compile(r"^size(>=|>|<=|<|=)([0-9.]+)$")
+
+# Rough cost in pcbnew calls, cheaper terms are tested first
+_cost = {"property": 1, "hole": 1, "smd": 1, "net": 1, "netclass": 1,
+         "size": 2, "ref": 2, "layer": 3}
+
+_operators = {
+    ">=": np.greater_equal, ">": np.greater, "<=": np.less_equal,
+    "<": np.less, "=": np.equal,
+}
+
+
+def _tokenize(text: str) -> list[str]:
+    """
+    Brackets, keywords and terms of a query. A term runs to the next space
+    or unbalanced bracket; only name:value terms hold brackets.
+    """
+    tokens = []
+    at, end = 0, len(text)
+    while at < end:
+        if text[at].isspace():
+            at += 1
+            continue
+        if text[at] in "()":
+            tokens.append(text[at])
+            at += 1
+            continue
+        start, depth, quote = at, 0, None
+        while at < end:
+            c = text[at]
+            if quote:
+                if c == quote:
+                    quote = None
+            elif c in "\"'" and text[at - 1] == ":" and at > start:
+                quote = c
+            elif c.isspace():
+                break
+            elif c == "(":
+                if ":" not in text[start:at]:
+                    break
+                depth += 1
+            elif c == ")":
+                if not depth:
+                    break
+                depth -= 1
+            at += 1
+        if quote:
+            msg = f"Missing closing quote in pad filter term {text[start:]!r}"
+            raise UserWarning(msg)
+        tokens.append(text[start:at])
+    return tokens
+
+
+def _parse_term(token: str):
+    if token in ("hole", "smd"):
+        return ("term", token, None)
+    m = _size.match(token)
+    if m:
+        return ("term", "size", (m.group(1), float(m.group(2))))
+    name, sep, value = token.partition(":")
+    if not sep or not value:
+        msg = f"Can't read pad filter term {token!r}"
+        raise UserWarning(msg)
+    name = name.lower()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1]
+    if name == "property":
+        key = value.lower().removeprefix("pad_prop_")
+        if key in properties:
+            return ("term", name, properties[key])
+        try:
+            return ("term", name, int(value))
+        except ValueError:
+            msg = f"Unknown pad property {value!r}, use one of: {', '.join(properties)}"
+            raise UserWarning(msg) from None
+    if name == "ref":
+        return ("term", name, re.compile(fnmatch.translate(value)))
+    if name in ("net", "netclass"):
+        try:
+            return ("term", name, re.compile(f"(?:{value})|{re.escape(value)}"))
+        except re.error as e:
+            msg = f"Bad {name} pattern {value!r}: {e}"
+            raise UserWarning(msg) from None
+    if name == "layer":
+        if value.lower() not in ("top", "bottom"):
+            msg = f"Pad layer must be top or bottom, not {value!r}"
+            raise UserWarning(msg)
+        return ("term", name, value.lower() == "bottom")
+    msg = f"Unknown pad filter {name!r}"
+    raise UserWarning(msg)
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.at = 0
+
+    def peek(self):
+        return self.tokens[self.at] if self.at < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.at += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            msg = "Empty pad filter"
+            raise UserWarning(msg)
+        node = self.parse_or()
+        if self.peek() is not None:
+            msg = f"Unexpected {self.peek()!r} in pad filter"
+            raise UserWarning(msg)
+        return node
+
+    def parse_or(self):
+        items = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else ("or", items)
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while self.peek() not in (None, ")", "or"):
+            if self.peek() == "and":
+                self.take()
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else ("and", items)
+
+    def parse_not(self):
+        token = self.take()
+        if token is None:
+            msg = "Pad filter ends too early"
+            raise UserWarning(msg)
+        if token == "not":
+            return ("not", self.parse_not())
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                msg = "Missing ) in pad filter"
+                raise UserWarning(msg)
+            return node
+        if token in (")", "and", "or"):
+            msg = f"Unexpected {token!r} in pad filter"
+            raise UserWarning(msg)
+        return _parse_term(token)
+
+
+def _node_cost(node) -> int:
+    if node[0] == "term":
+        return _cost[node[1]]
+    if node[0] == "not":
+        return _node_cost(node[1])
+    return sum(_node_cost(n) for n in node[1])
+
+
+def _min_size(size) -> int:
+    try:
+        return min(size.x, size.y)
+    except AttributeError:
+        return min(size[0], size[1])
+
+
+class PadQuery:
+    """
+    A compiled pad filter. predicate(pad) tests a pcbnew pad, mask(snapshot)
+    tests every pad of a snapshot at once.
+    """
+
+    def __init__(self, text: str = default_query):
+        self.text = text
+        self.tree = _Parser(text).parse()
+        self.predicate = self._compile()
+
+    def __repr__(self):
+        return f"PadQuery({self.text!r})"
+
+    def _compile(self):
+        """
+        Generate the predicate as one python expression so a pad costs a
+        single call with short circuiting between terms.
+        """
+        namespace = {"_min_size": _min_size}
+
+        def constant(value):
+            name = f"_c{len(namespace)}"
+            namespace[name] = value
+            return name
+
+        def source(node) -> str:
+            kind = node[0]
+            if kind == "not":
+                return f"not ({source(node[1])})"
+            if kind in ("and", "or"):
+                parts = sorted(node[1], key=_node_cost)
+                return "(" + f" {kind} ".join(f"({source(n)})" for n in parts) + ")"
+            _, name, value = node
+            if name == "property":
+                return f"p.GetProperty() == {int(value)}"
+            if name == "hole":
+                return "p.HasHole()"
+            if name == "smd":
+                return "not p.HasHole()"
+            if name == "net":
+                return f"{constant(value.fullmatch)}(p.GetNetname()) is not None"
+            if name == "netclass":
+                return f"{constant(value.fullmatch)}(p.GetNetClassName()) is not None"
+            if name == "ref":
+                return (
+                    f"{constant(value.match)}"
+                    "(p.GetParentFootprint().GetReferenceAsString()) is not None"
+                )
+            if name == "layer":
+                # Same side rule as the report
+                side = "bool(p.GetParentFootprint().GetSide() - p.GetLayer())"
+                return side if value else f"not {side}"
+            if name == "size":
+                op, mm = value
+                op = "==" if op == "=" else op
+                return f"_min_size(p.GetSize()) {op} {int(round(mm * IU_PER_MM))}"
+            raise AssertionError(name)
+
+        code = source(self.tree)
+        _log.debug("Pad filter %r compiled to: %s", self.text, code)
+        return eval(f"lambda p: {code}", namespace)
+
+    def property(self):
+        """
+        The fabrication property every matching pad must have, if the query
+        requires one, so readers can skip other pads early.
+        """
+        node = self.tree
+        terms = node[1] if node[0] == "and" else [node]
+        for term in terms:
+            if term[0] == "term" and term[1] == "property":
+                return term[2]
+        return None
+
+    def mask(self, snapshot: PadSnapshot) -> np.ndarray:
+        return self._mask(self.tree, snapshot)
+
+    def _mask(self, node, snapshot: PadSnapshot) -> np.ndarray:
+        kind = node[0]
+        if kind == "not":
+            return ~self._mask(node[1], snapshot)
+        if kind == "and":
+            mask = np.ones(len(snapshot), dtype=bool)
+            for n in node[1]:
+                mask &= self._mask(n, snapshot)
+            return mask
+        if kind == "or":
+            mask = np.zeros(len(snapshot), dtype=bool)
+            for n in node[1]:
+                mask |= self._mask(n, snapshot)
+            return mask
+
+        _, name, value = node
+        if name == "property":
+            return snapshot.pad_property == value
+        if name == "hole":
+            return snapshot.has_hole.copy()
+        if name == "smd":
+            return ~snapshot.has_hole
+        if name == "layer":
+            return snapshot.bottom == value
+        if name == "size":
+            op, mm = value
+            return _operators[op](snapshot.size.min(axis=1), int(round(mm * IU_PER_MM)))
+        values = {"net": snapshot.net, "netclass": snapshot.net_class, "ref": snapshot.ref_des}[name]
+        match = value.match if name == "ref" else value.fullmatch
+        # Each distinct name is only matched once
+        results = {v: match(v) is not None for v in set(values)}
+        return np.fromiter((results[v] for v in values), dtype=bool, count=len(values))
+
+    def select(self, snapshot: PadSnapshot) -> PadSnapshot:
+        return snapshot.select(self.mask(snapshot))
+
+
+def compile_query(text: str = None) -> PadQuery:
+    return PadQuery(text or default_query)
@@ -0,0 +1,306 @@
+"""
+pad_snapshot
+Copy everything the report needs out of pcbnew in a single pass over the pads.
+
+The snapshot only holds plain python and numpy data so it can be pickled, sent
+to other processes and used without pcbnew installed. Reports, coverage and
+exports are built from the snapshot rather than the live board.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from itertools import islice
+
+import numpy as np
+
+from stage_trace import stage
+
+_log = logging.getLogger("kicad_testpoints")
+
+# pcbnew internal units are nanometers
+IU_PER_MM = 1e6
+
+# PAD_PROP_TESTPOINT in pcbnew
+TEST_POINT_PROPERTY = 4
+
+
+class Settings:
+    """
+    Report options, the same as kicad_testpoints.Settings but usable without
+    pcbnew.
+    """
+
+    def __init__(self, use_aux_origin: bool = False):
+        self.use_aux_origin = use_aux_origin
+
+
+def _xy(point) -> tuple[int, int]:
+    try:
+        return point.x, point.y
+    except AttributeError:
+        return point[0], point[1]
+
+
+@dataclass
+class PadSnapshot:
+    """
+    One entry per pad in each of the per pad fields. Positions are kept in
+    pcbnew internal units.
+    """
+    ref_des: list = field(default_factory=list)
+    pad_number: list = field(default_factory=list)
+    net: list = field(default_factory=list)
+    net_class: list = field(default_factory=list)
+    has_hole: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=bool))
+    bottom: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=bool))
+    footprint_bottom: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=bool))
+    pad_property: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    center: np.ndarray = field(default_factory=lambda: np.empty((0, 2), dtype=np.int64))
+    # Pad width and height before rotation
+    size: np.ndarray = field(default_factory=lambda: np.empty((0, 2), dtype=np.int64))
+    # Board level data
+    aux_origin: tuple = None
+    nets: list = field(default_factory=list)
+    # Net name -> net class name for every net on the board, when known
+    net_classes: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.ref_des)
+
+    def select(self, which) -> "PadSnapshot":
+        """
+        New snapshot with only the pads picked by a boolean mask or index array.
+        """
+        which = np.asarray(which)
+        if which.dtype == bool:
+            which = np.flatnonzero(which)
+        return PadSnapshot(
+            ref_des=[self.ref_des[i] for i in which],
+            pad_number=[self.pad_number[i] for i in which],
+            net=[self.net[i] for i in which],
+            net_class=[self.net_class[i] for i in which],
+            has_hole=self.has_hole[which],
+            bottom=self.bottom[which],
+            footprint_bottom=self.footprint_bottom[which],
+            pad_property=self.pad_property[which],
+            center=self.center[which],
+            size=self.size[which],
+            aux_origin=self.aux_origin,
+            nets=self.nets,
+            net_classes=self.net_classes,
+        )
+
+    def test_points(self) -> "PadSnapshot":
+        """
+        Pads with the fabrication property set to test point.
+        """
+        return self.select(self.pad_property == TEST_POINT_PROPERTY)
+
+
+def concat(snapshots: list) -> PadSnapshot:
+    """
+    Pads of several snapshots in one, with the board level data of the first.
+    """
+    first = snapshots[0]
+    return PadSnapshot(
+        ref_des=[v for s in snapshots for v in s.ref_des],
+        pad_number=[v for s in snapshots for v in s.pad_number],
+        net=[v for s in snapshots for v in s.net],
+        net_class=[v for s in snapshots for v in s.net_class],
+        has_hole=np.concatenate([s.has_hole for s in snapshots]),
+        bottom=np.concatenate([s.bottom for s in snapshots]),
+        footprint_bottom=np.concatenate([s.footprint_bottom for s in snapshots]),
+        pad_property=np.concatenate([s.pad_property for s in snapshots]),
+        center=np.concatenate([s.center for s in snapshots]).reshape(-1, 2),
+        size=np.concatenate([s.size for s in snapshots]).reshape(-1, 2),
+        aux_origin=first.aux_origin,
+        nets=first.nets,
+        net_classes=first.net_classes,
+    )
+
+
+class SnapshotBuilder:
+    """
+    Takes a snapshot a slice of pads at a time so the caller can report
+    progress or stop between steps. Like everything touching pcbnew it must
+    run on the main thread.
+    """
+
+    def __init__(self, board, pads=None, pad_property: int = None, query=None):
+        self.board = board
+        self.pads = board.GetPads() if pads is None else pads
+        self.pad_property = pad_property
+        self.predicate = None if query is None else query.predicate
+        try:
+            self.total = len(self.pads)
+        except TypeError:
+            self.total = None
+        self.done = 0
+        self.finished = False
+        self._pads = iter(self.pads)
+        self._fields = {
+            "ref_des": [], "pad_number": [], "net": [], "net_class": [], "has_hole": [],
+            "bottom": [], "footprint_bottom": [], "pad_property": [], "center": [], "size": [],
+        }
+
+    @stage("pad discovery", lambda done, builder, *_: {"pads read": builder.done})
+    def step(self, count: int = None) -> bool:
+        """
+        Read up to count more pads, all of them by default. Returns True once
+        every pad has been read.
+        """
+        f = self._fields
+        pads = self._pads if count is None else islice(self._pads, count)
+        read = 0
+        predicate = self.predicate
+        for p in pads:
+            read += 1
+            if predicate is not None and not predicate(p):
+                continue
+            prop = p.GetProperty()
+            if self.pad_property is not None and prop != self.pad_property:
+                continue
+            fp = p.GetParentFootprint()
+            fp_side = fp.GetSide()
+            f["ref_des"].append(fp.GetReferenceAsString())
+            f["pad_number"].append(p.GetNumber())
+            f["net"].append(p.GetNetname())
+            f["net_class"].append(p.GetNetClassName())
+            f["has_hole"].append(p.HasHole())
+            # Same rule as get_pad_side
+            f["bottom"].append(bool(fp_side - p.GetLayer()))
+            f["footprint_bottom"].append(bool(fp_side))
+            f["pad_property"].append(prop)
+            f["center"].append(_xy(p.GetCenter()))
+            f["size"].append(_xy(p.GetSize()))
+        self.done += read
+        self.finished = count is None or read < count
+        return self.finished
+
+    @stage("net lookup", lambda s, *_: {"pads": len(s), "nets": len(s.nets)})
+    def snapshot(self) -> PadSnapshot:
+        f = self._fields
+        aux_origin = self.board.GetDesignSettings().GetAuxOrigin()
+        if aux_origin is not None:
+            aux_origin = _xy(aux_origin)
+
+        return PadSnapshot(
+            ref_des=f["ref_des"],
+            pad_number=f["pad_number"],
+            net=f["net"],
+            net_class=f["net_class"],
+            has_hole=np.array(f["has_hole"], dtype=bool),
+            bottom=np.array(f["bottom"], dtype=bool),
+            footprint_bottom=np.array(f["footprint_bottom"], dtype=bool),
+            pad_property=np.array(f["pad_property"], dtype=np.int32),
+            center=np.array(f["center"], dtype=np.int64).reshape(-1, 2),
+            size=np.array(f["size"], dtype=np.int64).reshape(-1, 2),
+            aux_origin=aux_origin,
+            nets=[str(n) for n in self.board.GetNetsByName()],
+            net_classes=self.board_net_classes(),
+        )
+
+    def board_net_classes(self) -> dict:
+        """
+        Net class of every net, read from the board's NETINFO_ITEMs.
+        """
+        nets = self.board.GetNetsByName()
+        if not hasattr(nets, "items"):
+            return {}
+        net_classes = {}
+        for name, net in nets.items():
+            try:
+                net_class = net.GetNetClassName()
+            except AttributeError:
+                # Newer KiCad only returns the NETCLASS
+                net_class = net.GetNetClass().GetName()
+            net_classes[str(name)] = str(net_class)
+        return net_classes
+
+
+def take_snapshot(board, pads=None, pad_property: int = None, query=None) -> PadSnapshot:
+    """
+    Walk the pads once and copy out the report data. Defaults to all pads on
+    the board. With pad_property set only pads with that fabrication property
+    are copied, the rest cost a single GetProperty call. A PadQuery selects
+    pads the same way with its own terms.
+    """
+    builder = SnapshotBuilder(board, pads, pad_property, query)
+    builder.step()
+    return builder.snapshot()
+
+
+def resolve_origin(snapshot: PadSnapshot, settings) -> tuple:
+    """
+    Origin in internal units for the report. The aux (drill/file) origin when
+    selected and set on the board, otherwise the absolute origin.
+    """
+    if not settings.use_aux_origin:
+        return (0, 0)
+    if snapshot.aux_origin is None:
+        # Keep origin as 0,0
+        _log.info("No aux origin returned. Using 0,0 as origin")
+        settings.use_aux_origin = False
+        return (0, 0)
+    return snapshot.aux_origin
+
+
+def _round_ties(values: np.ndarray, ties: np.ndarray) -> np.ndarray:
+    """
+    Round to 4 places. np.round and round() only disagree on exact midpoints,
+    which are found from the integer values, so those few go through round().
+    """
+    rounded = np.round(values, 4)
+    for i in np.flatnonzero(ties):
+        rounded.flat[i] = round(float(values.flat[i]), 4)
+    return rounded
+
+
+@stage("position transform", lambda positions, *_: {"pads": len(positions)})
+def pad_positions(centers: np.ndarray, origin: tuple) -> np.ndarray:
+    """
+    Pad positions in mm, relative to the origin and in cartesian coordinates.
+    centers is an (n, 2) array in internal units. Rounded the same way as
+    get_pad_position.
+    """
+    centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+    origin = np.asarray(origin, dtype=np.int64)
+    # Centers are rounded to 0.1 um, i.e. 100 internal units
+    centers_mm = _round_ties(centers / IU_PER_MM, centers % 100 == 50)
+    offset = np.rint(centers_mm * 1e4).astype(np.int64) * 100 - origin
+    positions = _round_ties(centers_mm - origin / IU_PER_MM, offset % 100 == 50)
+    positions[:, 1] *= -1
+    return positions
+
+
+def build_report(snapshot: PadSnapshot, settings) -> list[dict]:
+    """
+    Same rows as build_test_point_report, built from a snapshot.
+    """
+    origin = resolve_origin(snapshot, settings)
+    positions = pad_positions(snapshot.center, origin).tolist()
+    sides = ("TOP", "BOTTOM")
+    pad_types = ("SMT", "THRU")
+    return [
+        {
+            "source ref des": ref_des,
+            "source pad": pad_number,
+            "net": net,
+            "net class": net_class,
+            "side": sides[bottom],
+            "x": x,
+            "y": y,
+            "pad type": pad_types[has_hole],
+            "footprint side": sides[footprint_bottom],
+        }
+        for ref_des, pad_number, net, net_class, bottom, (x, y), has_hole, footprint_bottom in zip(
+            snapshot.ref_des,
+            snapshot.pad_number,
+            snapshot.net,
+            snapshot.net_class,
+            snapshot.bottom.tolist(),
+            positions,
+            snapshot.has_hole.tolist(),
+            snapshot.footprint_bottom.tolist(),
+        )
+    ]
@@ -0,0 +1,270 @@
+"""
+panel
+Reports for panels built from one unit board.
+
+A panel is the unit board's pads plus a placement per copy: an offset, a
+rotation and an optional mirror. replicate transforms the unit's pads for
+every copy in one batch and gives each copy's ref des a unique suffix, so a
+96 up panel costs one board read plus a matrix multiply.
+
+detect_panel finds the copies in a snapshot of a whole panel, matching pads
+by ref des and pad number. Copies may share ref des or carry a numeric
+suffix like R1_3, which each copy keeps.
+"""
+
+import csv
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot, IU_PER_MM, concat
+
+_log = logging.getLogger("kicad_testpoints")
+
+_suffix = re.compile(r"^(.+)[_.-](\d+)$")
+
+
+@dataclass
+class Placement:
+    """
+    Where a copy of the unit goes, in board internal units. The unit is
+    mirrored first (flipped left to right onto the other side), then rotated
+    about its origin like pcbnew's RotatePoint, then moved by x, y.
+    """
+    x: int = 0
+    y: int = 0
+    rotation: float = 0.0
+    mirror: bool = False
+    suffix: str = None
+
+    def matrix(self) -> np.ndarray:
+        """
+        2x2 matrix of the mirror and rotation, exact for right angles.
+        """
+        angle = self.rotation % 360
+        exact = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}
+        if angle in exact:
+            c, s = exact[angle]
+        else:
+            c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+        rotate = np.array([[c, s], [-s, c]], dtype=np.float64)
+        if self.mirror:
+            return rotate @ np.diag([-1.0, 1.0])
+        return rotate
+
+
+def _kiround(values: np.ndarray) -> np.ndarray:
+    """
+    Round half away from zero like pcbnew's KiROUND.
+    """
+    return np.where(values >= 0, np.floor(values + 0.5), np.ceil(values - 0.5)).astype(np.int64)
+
+
+def replicate(unit: PadSnapshot, placements: list, aux_origin: tuple = None) -> PadSnapshot:
+    """
+    Snapshot of the whole panel, copy after copy. Copies without a suffix
+    get _1, _2, ... in placement order. The panel keeps the unit's aux
+    origin unless another is given.
+    """
+    if not placements:
+        return unit.select(np.zeros(0, dtype=np.intp))
+    n = len(unit)
+    matrices = np.stack([p.matrix() for p in placements])
+    offsets = np.array([(p.x, p.y) for p in placements], dtype=np.float64)
+    # (copies, pads, 2) in one go
+    centers = np.einsum("mij,nj->mni", matrices, unit.center.astype(np.float64))
+    centers = _kiround(centers + offsets[:, None, :]).reshape(-1, 2)
+
+    mirrored = np.repeat([p.mirror for p in placements], n)
+    suffixes = [
+        f"_{k + 1}" if p.suffix is None else p.suffix for k, p in enumerate(placements)
+    ]
+    copies = len(placements)
+    snapshot = PadSnapshot(
+        ref_des=[f"{ref}{suffix}" for suffix in suffixes for ref in unit.ref_des],
+        pad_number=unit.pad_number * copies,
+        net=unit.net * copies,
+        net_class=unit.net_class * copies,
+        has_hole=np.tile(unit.has_hole, copies),
+        bottom=np.tile(unit.bottom, copies) ^ mirrored,
+        footprint_bottom=np.tile(unit.footprint_bottom, copies) ^ mirrored,
+        pad_property=np.tile(unit.pad_property, copies),
+        center=centers,
+        size=np.tile(unit.size, (copies, 1)),
+        aux_origin=unit.aux_origin if aux_origin is None else aux_origin,
+        nets=unit.nets,
+        net_classes=unit.net_classes,
+    )
+    return snapshot
+
+
+@dataclass
+class Panel:
+    """
+    A detected panel: the first copy as the unit, a placement per copy
+    (the first is the identity) and the pads that are not part of any copy,
+    like fiducials or test points on the rails.
+    """
+    unit: PadSnapshot
+    placements: list = field(default_factory=list)
+    extra: PadSnapshot = None
+
+    def snapshot(self) -> PadSnapshot:
+        panel = replicate(self.unit, self.placements)
+        if self.extra is not None and len(self.extra):
+            panel = concat([panel, self.extra])
+        return panel
+
+
+def _pad_keys(snapshot: PadSnapshot, strip_suffix: bool):
+    refs = snapshot.ref_des
+    if strip_suffix:
+        refs = [m.group(1) if (m := _suffix.match(r)) else r for r in refs]
+    lookup = {}
+    keys = np.fromiter(
+        (lookup.setdefault(k, len(lookup)) for k in zip(refs, snapshot.pad_number)),
+        dtype=np.int64,
+        count=len(snapshot),
+    )
+    return keys, refs
+
+
+def _full_groups(columns: list, copy: np.ndarray, copies: int) -> np.ndarray:
+    """
+    Rows whose group, by equal values in every column, has one row from
+    each copy.
+    """
+    if not len(copy):
+        return np.zeros(0, dtype=bool)
+    columns = [c - c.min() for c in columns]
+    dims = [int(c.max()) + 1 for c in columns]
+    if math.prod(dims) < 2**62:
+        _, group, sizes = np.unique(
+            np.ravel_multi_index(columns, dims), return_inverse=True, return_counts=True
+        )
+    else:
+        _, group, sizes = np.unique(
+            np.stack(columns, axis=1), axis=0, return_inverse=True, return_counts=True
+        )
+    group = group.ravel()
+    full = sizes[group] == copies
+    # A copy may only appear once in each group
+    if len(np.unique(group[full] * copies + copy[full])) != np.count_nonzero(full):
+        msg = "Panel copies overlap, can't tell them apart"
+        raise UserWarning(msg)
+    return full
+
+
+def detect_panel(snapshot: PadSnapshot, tolerance: int = 1000) -> Panel:
+    """
+    Find repeated copies of a unit in a panel snapshot. Positions must agree
+    within tolerance internal units. Raises UserWarning when the snapshot
+    doesn't repeat. Copies at other than right angles to the first come back
+    from Panel.snapshot within a nanometre of where pcbnew put them.
+    """
+    for strip_suffix in (False, True):
+        keys, refs = _pad_keys(snapshot, strip_suffix)
+        counts = np.bincount(keys)
+        copies = int(counts.max()) if len(counts) else 0
+        if copies > 1:
+            break
+    else:
+        msg = "No repeated copies found in the panel"
+        raise UserWarning(msg)
+
+    center = snapshot.center.astype(np.float64)
+    repeated = np.flatnonzero(counts == copies)
+    # Two pads seen once per copy fix each copy's position and angle. The
+    # second is the one closest to the first so copies can't be mixed up.
+    anchor = repeated[0]
+    a = np.flatnonzero(keys == anchor)
+    a = a[np.lexsort((center[a, 0], center[a, 1]))]
+    best = None
+    for other in repeated[1:]:
+        b = np.flatnonzero(keys == other)
+        distance = np.hypot(*(center[b] - center[a[0]]).T).min()
+        if distance > tolerance and (best is None or distance < best[0]):
+            best = (distance, b)
+    if best is None:
+        msg = "Panel copies need at least two pads in common"
+        raise UserWarning(msg)
+    b = best[1]
+
+    placements = []
+    v0 = None
+    for i in a:
+        d = center[b] - center[i]
+        j = b[np.argmin(np.hypot(*d.T))]
+        v = center[j] - center[i]
+        mirror = bool(snapshot.footprint_bottom[i] != snapshot.footprint_bottom[a[0]])
+        if v0 is None:
+            v0 = v
+        u = v0 * (-1, 1) if mirror else v0
+        rotation = round(math.degrees(math.atan2(u[1], u[0]) - math.atan2(v[1], v[0])) % 360, 3)
+        # Copies keep the suffix they carry on the panel
+        suffix = snapshot.ref_des[i][len(refs[i]):] if strip_suffix else None
+        placement = Placement(rotation=rotation % 360, mirror=mirror, suffix=suffix)
+        x, y = center[i] - placement.matrix() @ center[a[0]]
+        placement.x, placement.y = int(round(x)), int(round(y))
+        placements.append(placement)
+
+    # Map every pad back into the unit frame once per copy. A unit pad is one
+    # that every copy maps onto the same spot.
+    inverse = np.stack([np.linalg.inv(p.matrix()) for p in placements])
+    offsets = np.array([(p.x, p.y) for p in placements], dtype=np.float64)
+    u = np.einsum("mij,mnj->mni", inverse, center[None, :, :] - offsets[:, None, :])
+    mirrored = np.array([p.mirror for p in placements])
+    side = (snapshot.bottom[None, :] ^ mirrored[:, None]).ravel()
+    copy = np.repeat(np.arange(len(placements)), len(snapshot))
+    pad = np.tile(np.arange(len(snapshot)), len(placements))
+    all_keys = np.tile(keys, len(placements))
+    u = u.reshape(-1, 2) / tolerance
+
+    # Rounding can put matching pads either side of a cell edge, so pads left
+    # over are tried again on a grid shifted by half a cell
+    in_copy = np.zeros(len(snapshot), dtype=bool)
+    unit_pads = []
+    for shift in (0.0, 0.5):
+        rows = np.flatnonzero(~in_copy[pad])
+        cells = np.rint(u[rows] + shift).astype(np.int64)
+        full = _full_groups(
+            [all_keys[rows], cells[:, 0], cells[:, 1], side[rows].astype(np.int64)],
+            copy[rows],
+            len(placements),
+        )
+        rows = rows[full]
+        unit_pads.append(pad[rows[copy[rows] == 0]])
+        in_copy[pad[rows]] = True
+    unit_pads = np.concatenate(unit_pads)
+
+    unit_pads = np.sort(unit_pads)
+    unit = snapshot.select(unit_pads)
+    unit.ref_des = [refs[i] for i in unit_pads]
+    extra = snapshot.select(~in_copy)
+    _log.debug(
+        "Panel: %d copies of %d pads, %d extra pads", len(placements), len(unit), len(extra)
+    )
+    return Panel(unit, placements, extra)
+
+
+def read_placements(path: Path) -> list[Placement]:
+    """
+    Placements from a CSV with x and y in mm as shown in pcbnew, and
+    optional rotation in degrees, mirror (0/1) and suffix columns.
+    """
+    placements = []
+    with Path(path).open(newline="") as f:
+        for row in csv.DictReader(f):
+            suffix = row.get("suffix") or None
+            placements.append(Placement(
+                x=int(round(float(row["x"]) * IU_PER_MM)),
+                y=int(round(float(row["y"]) * IU_PER_MM)),
+                rotation=float(row.get("rotation") or 0),
+                mirror=str(row.get("mirror", "")).strip().lower() in ("1", "true", "yes"),
+                suffix=suffix,
+            ))
+    return placements
@@ -0,0 +1,31 @@
+"""
+Information about the package, kept apart so registering the plugin doesn't
+import the GUI.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+
+from _version import __version__
+
+
+@dataclass
+class Meta:
+    """
+    Information about package
+    """
+    toolname : str = "kicadtestpoints"
+    title : str = "Testpoint Report Setup"
+    body : str = ("Set testpoints by setting the desired pads 'Fabrication Property' to "
+    "'Test Point Pad'. The output default is in the JigsApp test point report style. ")
+    about_text : str = "This plugin generates TheJigsApp styletest point reports. Test more, worry less."
+    short_description : str = "Fabrication Testpoint Report Generator"
+    website : str = "https://www.thejigsapp.com"
+    gitlink : str = "https://github.com/snhobbs/kicad-testpoints-pcm"
+    version : str = __version__
+    category : str = "Read PCB"
+    icon_dir : Path =  Path(__file__).parent
+    icon_file_path : Path = icon_dir / "icon-24x24.png"
+    # assert icon_file_path.exists()
+    about_body = ("Bed-of-nails test jigs greatly improve electronics development and production. "
+                  "TheJigsApp autogenerated test jigs make them cost-effective, flexible, and fast. "
+                  "Checkout our ordering portal and getting started guides to build yours now.")
@@ -0,0 +1,478 @@
+"""
+probe_drc
+Clearance checks for fixture probes.
+
+Probe targets are checked against each other, the board edge and the
+courtyards of components on the same side. Probes, edge segments and
+courtyards are bucketed in uniform grids so each check only measures nearby
+pairs, keeping the whole run near O(n log n).
+
+Everything works in report coordinates: mm from the report origin with y
+increasing upwards. board_geometry converts the pcbnew outline and courtyards
+to match.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from pad_snapshot import IU_PER_MM
+from probe_spacing import ProbeIndex
+from report_writers import MultiWriter
+
+_log = logging.getLogger("kicad_testpoints")
+
+# Name of the group holding the markers drawn on the board
+marker_group = "Test point DRC"
+# User layer kept for the markers, everything on it is replaced by each run
+marker_layer = "User_9"
+
+# Components at least this tall, in mm, need component_clearance around them.
+# Lower ones only block probes inside their courtyard.
+tall_height = 3.0
+
+
+@dataclass
+class ProbeClass:
+    """
+    Clearances needed by one probe size, in mm. spacing is the minimum center
+    to center distance to another probe on the same side. receptacle_drill
+    is the plate hole its receptacle is pressed into and min_pad the smallest
+    pad it reliably lands on.
+    """
+    name: str
+    spacing: float
+    edge_clearance: float = 3.175
+    component_clearance: float = 1.27
+    receptacle_drill: float = 1.7
+    min_pad: float = 0.0
+
+
+probe_classes = {
+    c.name: c
+    for c in (
+        ProbeClass("100mil", 2.54, receptacle_drill=1.7, min_pad=1.5),
+        ProbeClass("75mil", 1.91, receptacle_drill=1.35, min_pad=1.0),
+        ProbeClass("50mil", 1.27, receptacle_drill=0.9, min_pad=0.7),
+        ProbeClass("39mil", 1.0, receptacle_drill=0.65),
+    )
+}
+default_probe_class = "100mil"
+
+
+@dataclass
+class Courtyard:
+    """
+    Component keepout for probes on its side. rings are (n, 2) arrays, holes
+    included, combined with the even-odd rule.
+    """
+    ref_des: str
+    bottom: bool
+    rings: list
+    # mm, None when unknown
+    height: float = None
+
+
+@dataclass
+class BoardGeometry:
+    """
+    Board outline rings, cutouts included, and component courtyards.
+    """
+    outline: list = field(default_factory=list)
+    courtyards: list = field(default_factory=list)
+
+
+def _segments(rings: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Start and end points of the closed rings' edges, each (n, 2).
+    """
+    rings = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings if len(r) > 1]
+    if not rings:
+        empty = np.empty((0, 2))
+        return empty, empty
+    return np.concatenate(rings), np.concatenate([np.roll(r, -1, axis=0) for r in rings])
+
+
+def _point_segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    d = b - a
+    length2 = np.einsum("ij,ij->i", d, d)
+    t = np.einsum("ij,ij->i", p - a, d) / np.where(length2 > 0, length2, 1)
+    closest = a + np.clip(t, 0, 1)[:, None] * d
+    return np.hypot(*(p - closest).T)
+
+
+def _crosses(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Whether a ray from p towards +x crosses each segment, for the even-odd
+    rule.
+    """
+    straddles = (a[:, 1] > p[:, 1]) != (b[:, 1] > p[:, 1])
+    dy = np.where(straddles, b[:, 1] - a[:, 1], 1)
+    x = a[:, 0] + (p[:, 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) / dy
+    return straddles & (p[:, 0] < x)
+
+
+def _grid_candidates(points: np.ndarray, lo: np.ndarray, hi: np.ndarray, cell: float):
+    """
+    (point, box) index pairs with the point inside the box. Boxes are spread
+    over the grid cells they touch and joined with the points' cells by
+    sorting, so only nearby pairs are ever compared.
+    """
+    empty = np.empty(0, dtype=np.intp)
+    if not len(points) or not len(lo):
+        return empty, empty
+    base = np.minimum(points.min(axis=0), lo.min(axis=0))
+    c0 = np.floor((lo - base) / cell).astype(np.int64)
+    c1 = np.floor((hi - base) / cell).astype(np.int64)
+    pc = np.floor((points - base) / cell).astype(np.int64)
+    width = max(c1[:, 1].max(), pc[:, 1].max()) + 1
+
+    spans = c1 - c0 + 1
+    counts = spans[:, 0] * spans[:, 1]
+    box = np.repeat(np.arange(len(lo)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = (c0[box, 0] + within // spans[box, 1]) * width + c0[box, 1] + within % spans[box, 1]
+    order = np.argsort(keys, kind="stable")
+    keys, box = keys[order], box[order]
+
+    point_keys = pc[:, 0] * width + pc[:, 1]
+    start = np.searchsorted(keys, point_keys, side="left")
+    found = np.searchsorted(keys, point_keys, side="right") - start
+    pi = np.repeat(np.arange(len(points)), found)
+    offsets = np.arange(found.sum()) - np.repeat(np.cumsum(found) - found, found)
+    bi = box[np.repeat(start, found) + offsets]
+    inside = np.all((points[pi] >= lo[bi]) & (points[pi] <= hi[bi]), axis=1)
+    return pi[inside], bi[inside]
+
+
+class DrcReport:
+    """
+    One row per violation.
+    """
+
+    columns = ("rule", "probe", "side", "x", "y", "other", "distance", "required")
+
+    def __init__(self, records: list = None):
+        self.records = list(records or [])
+
+    def __len__(self):
+        return len(self.records)
+
+    def rows(self):
+        return (dict(zip(self.columns, r)) for r in self.records)
+
+    def by_rule(self) -> dict:
+        counts = {}
+        for record in self.records:
+            counts[record[0]] = counts.get(record[0], 0) + 1
+        return counts
+
+    def summary(self) -> str:
+        if not self.records:
+            return "Probe clearance: no violations"
+        return "Probe clearance: %d violations (%s)" % (
+            len(self),
+            ", ".join(f"{n} {rule}" for rule, n in self.by_rule().items()),
+        )
+
+    def write(self, paths: list) -> list:
+        """
+        Write the violations to every path, format by extension.
+        """
+        out = MultiWriter(paths).open(self.columns)
+        try:
+            out.write(self.records)
+        finally:
+            out.close()
+        return out.paths
+
+
+def _probe_classes(table, probe_class, classes: dict) -> list:
+    if probe_class is None:
+        probe_class = default_probe_class
+    if isinstance(probe_class, (str, ProbeClass)):
+        probe_class = [probe_class] * len(table)
+    try:
+        return [c if isinstance(c, ProbeClass) else classes[c] for c in probe_class]
+    except KeyError as e:
+        msg = f"Unknown probe class {e.args[0]}, use one of: {', '.join(classes)}"
+        raise UserWarning(msg) from None
+
+
+def check_clearances(
+    table, geometry: BoardGeometry = None, probe_class=None, classes: dict = None
+) -> DrcReport:
+    """
+    Check the probes of a TestPointTable. probe_class is a class name or
+    ProbeClass for every probe, or a sequence with one per probe. Without
+    geometry only the probe to probe spacing is checked.
+    """
+    classes = probe_classes if classes is None else classes
+    assigned = _probe_classes(table, probe_class, classes)
+    spacing = np.array([c.spacing for c in assigned], dtype=np.float64)
+    edge = np.array([c.edge_clearance for c in assigned], dtype=np.float64)
+    component = np.array([c.component_clearance for c in assigned], dtype=np.float64)
+
+    xy = table.xy()
+    side_names = table.column("side")
+    bottom = np.array([s == "BOTTOM" for s in side_names], dtype=bool)
+    names = [f"{r}-{p}" for r, p in zip(table.ref_des, table.pad_number)]
+    records = []
+
+    def add(rule, i, other, distance, required):
+        records.append((
+            rule, names[i], side_names[i], float(xy[i, 0]), float(xy[i, 1]),
+            other, round(float(distance), 4), float(required),
+        ))
+
+    # Probe to probe, only on the same side
+    for side in (False, True):
+        which = np.flatnonzero(bottom == side)
+        if len(which) < 2:
+            continue
+        a, b, dist = ProbeIndex(table.select(which)).pairs_within(spacing[which].max())
+        a, b = which[a], which[b]
+        required = np.maximum(spacing[a], spacing[b])
+        for i, j, d, r in zip(a, b, dist, required):
+            if d < r:
+                add("probe spacing", i, names[j], d, r)
+
+    if geometry is not None:
+        _check_edge(xy, edge, geometry.outline, add)
+        _check_courtyards(xy, bottom, table.ref_des, component, geometry.courtyards, add)
+
+    _log.debug("Probe DRC: %d violations", len(records))
+    return DrcReport(records)
+
+
+def _check_edge(xy, edge, outline, add):
+    a, b = _segments(outline)
+    if not len(a):
+        return
+    reach = edge.max()
+    lo = np.minimum(a, b) - reach
+    hi = np.maximum(a, b) + reach
+    pi, si = _grid_candidates(xy, lo, hi, max(reach, 1.0))
+    nearest = np.full(len(xy), np.inf)
+    np.minimum.at(nearest, pi, _point_segment_distance(xy[pi], a[si], b[si]))
+
+    # Probes off the board, counting crossings only with the edge segments
+    # in the probe's horizontal band: the grid with every x set to 0
+    y0 = np.minimum(a[:, 1], b[:, 1])
+    y1 = np.maximum(a[:, 1], b[:, 1])
+    band = max(np.ptp(np.concatenate([y0, y1])) / len(a), 1e-6)
+    zeros = np.zeros(len(a))
+    pi, si = _grid_candidates(
+        np.column_stack((np.zeros(len(xy)), xy[:, 1])),
+        np.column_stack((zeros, y0)), np.column_stack((zeros, y1)), band)
+    hits = _crosses(xy[pi], a[si], b[si])
+    crossings = np.bincount(pi[hits], minlength=len(xy))
+    outside = crossings % 2 == 0
+
+    for i in np.flatnonzero(outside | (nearest < edge)):
+        add("off board" if outside[i] else "board edge", i, "Edge.Cuts", nearest[i], edge[i])
+
+
+def _check_courtyards(xy, bottom, ref_des, component, courtyards, add):
+    if not courtyards:
+        return
+    starts, ends, owner = [], [], []
+    lo, hi, reach = [], [], []
+    max_clearance = component.max()
+    for k, courtyard in enumerate(courtyards):
+        a, b = _segments(courtyard.rings)
+        tall = courtyard.height is not None and courtyard.height >= tall_height
+        r = max_clearance if tall else 0.0
+        starts.append(a)
+        ends.append(b)
+        owner.append(np.full(len(a), k))
+        points = np.concatenate([a, b]) if len(a) else np.zeros((1, 2))
+        lo.append(points.min(axis=0) - r)
+        hi.append(points.max(axis=0) + r)
+        reach.append(tall)
+    a, b, owner = np.concatenate(starts), np.concatenate(ends), np.concatenate(owner)
+    lo, hi, tall = np.array(lo), np.array(hi), np.array(reach, dtype=bool)
+    segment_start = np.searchsorted(owner, np.arange(len(courtyards)), side="left")
+    segment_count = np.bincount(owner, minlength=len(courtyards))
+
+    size = np.median(np.max(hi - lo, axis=1))
+    pi, ci = _grid_candidates(xy, lo, hi, max(size, max_clearance, 1.0))
+    same = np.array([
+        courtyards[c].bottom == bottom[p] and courtyards[c].ref_des != ref_des[p]
+        for p, c in zip(pi.tolist(), ci.tolist())
+    ], dtype=bool).reshape(-1)
+    pi, ci = pi[same], ci[same]
+    if not len(pi):
+        return
+
+    # Every candidate pair against each segment of its courtyard
+    counts = segment_count[ci]
+    pair = np.repeat(np.arange(len(pi)), counts)
+    seg = np.repeat(segment_start[ci], counts) + (
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    p = xy[pi[pair]]
+    distance = np.full(len(pi), np.inf)
+    np.minimum.at(distance, pair, _point_segment_distance(p, a[seg], b[seg]))
+    crossings = np.bincount(pair, weights=_crosses(p, a[seg], b[seg]), minlength=len(pi))
+    inside = crossings % 2 == 1
+
+    required = np.where(tall[ci], component[pi], 0.0)
+    for k in np.flatnonzero(inside | (distance < required)):
+        rule = "under component" if inside[k] else "component clearance"
+        add(rule, pi[k], courtyards[ci[k]].ref_des, distance[k], required[k])
+
+
+def to_report(points, origin: tuple) -> np.ndarray:
+    """
+    Board points in internal units to report coordinates.
+    """
+    points = (np.asarray(points, dtype=np.float64).reshape(-1, 2) - origin) / IU_PER_MM
+    points[:, 1] *= -1
+    return points
+
+
+def from_report(points, origin: tuple) -> np.ndarray:
+    """
+    Report coordinates back to board internal units.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2) * (1, -1)
+    return np.rint(points * IU_PER_MM + origin).astype(np.int64)
+
+
+def _poly_rings(poly, origin) -> list:
+    rings = []
+
+    def chain(c):
+        return to_report([(c.CPoint(j).x, c.CPoint(j).y) for j in range(c.PointCount())], origin)
+
+    for i in range(poly.OutlineCount()):
+        rings.append(chain(poly.Outline(i)))
+        for h in range(poly.HoleCount(i)):
+            rings.append(chain(poly.Hole(i, h)))
+    return rings
+
+
+def _footprint_height(fp):
+    """
+    Height in mm from a "Height" field on the footprint, if there is one.
+    """
+    try:
+        field = fp.GetFieldByName("Height")
+        text = field.GetText() if field else None
+    except AttributeError:
+        # Before KiCad 8 fields were footprint properties
+        text = fp.GetProperty("Height") if fp.HasProperty("Height") else None
+    try:
+        return float(str(text).lower().replace("mm", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _courtyard(fp, bottom: bool):
+    import pcbnew
+
+    layer = pcbnew.B_CrtYd if bottom else pcbnew.F_CrtYd
+    try:
+        fp.BuildCourtyardCaches()
+        return fp.GetCourtyard(layer)
+    except AttributeError:
+        # KiCad 6
+        return fp.GetPolyCourtyard(layer)
+
+
+def board_geometry(board, origin: tuple, heights: dict = None) -> BoardGeometry:
+    """
+    Board outline and footprint courtyards from pcbnew in report coordinates.
+    Heights come from the heights dict by ref des, then from a "Height" field
+    on the footprint. Footprints without a courtyard use their bounding box.
+    """
+    heights = heights or {}
+    courtyards = []
+    for fp in board.GetFootprints():
+        ref_des = fp.GetReferenceAsString()
+        bottom = bool(fp.GetSide())
+        poly = _courtyard(fp, bottom)
+        fp_rings = _poly_rings(poly, origin) if poly.OutlineCount() else []
+        if not fp_rings:
+            box = fp.GetBoundingBox(False, False)
+            fp_rings = [to_report([
+                (box.GetLeft(), box.GetTop()),
+                (box.GetRight(), box.GetTop()),
+                (box.GetRight(), box.GetBottom()),
+                (box.GetLeft(), box.GetBottom()),
+            ], origin)]
+        height = heights.get(ref_des)
+        if height is None:
+            height = _footprint_height(fp)
+        courtyards.append(Courtyard(ref_des, bottom, fp_rings, height))
+    return BoardGeometry(board_outline(board, origin), courtyards)
+
+
+def board_outline(board, origin: tuple) -> list:
+    """
+    Board outline rings, cutouts included, in report coordinates.
+    """
+    import pcbnew
+
+    outline = pcbnew.SHAPE_POLY_SET()
+    return _poly_rings(outline, origin) if board.GetBoardPolygonOutlines(outline) else []
+
+
+def clear_markers(board, layer: int = None):
+    """
+    Remove the markers of a previous run: every drawing on the marker layer
+    and the marker group.
+    """
+    import pcbnew
+
+    if layer is None:
+        layer = getattr(pcbnew, marker_layer)
+    for item in list(board.GetDrawings()):
+        if item.GetLayer() == layer:
+            board.Remove(item)
+    for group in list(board.Groups()):
+        if group.GetName() == marker_group:
+            # Markers an older version drew on another layer
+            for item in list(group.GetItems()):
+                if item.GetLayer() != layer:
+                    board.Remove(item)
+            board.Remove(group)
+
+
+def draw_markers(board, report: DrcReport, origin: tuple, layer: int = None, size: float = 1.0):
+    """
+    Circle every violation on the marker layer, User.9 unless another is
+    given, grouped so the user can remove them in one go. The layer is
+    cleared first, so a run never leaves markers of an older one behind.
+    pcbnew's own DRC markers can't be created from python, so these are
+    plain shapes.
+    """
+    import pcbnew
+
+    if layer is None:
+        layer = getattr(pcbnew, marker_layer)
+    clear_markers(board, layer)
+    if not len(report):
+        return
+    enabled = board.GetEnabledLayers()
+    enabled.AddLayer(layer)
+    board.SetEnabledLayers(enabled)
+    point = getattr(pcbnew, "VECTOR2I", None) or pcbnew.wxPoint
+    circle = getattr(pcbnew, "SHAPE_T_CIRCLE", None) or pcbnew.S_CIRCLE
+
+    group = pcbnew.PCB_GROUP(board)
+    group.SetName(marker_group)
+    board.Add(group)
+    centers = from_report([(row[3], row[4]) for row in report.records], origin)
+    radius = int(size / 2 * IU_PER_MM)
+    for x, y in centers.tolist():
+        shape = pcbnew.PCB_SHAPE(board)
+        shape.SetShape(circle)
+        shape.SetLayer(layer)
+        shape.SetWidth(int(0.1 * IU_PER_MM))
+        shape.SetCenter(point(x, y))
+        shape.SetEnd(point(x + radius, y))
+        board.Add(shape)
+        group.AddItem(shape)
@@ -0,0 +1,481 @@
+"""
+probe_order
+Visiting order for flying probe testers.
+
+A tester runs the report in row order, so the rows are reordered per side to
+shorten the path of the head. A nearest neighbour tour is built from a
+uniform grid of the probes, then improved with 2-opt and Or-opt moves limited
+to each probe's nearest neighbours until the time budget runs out or no move
+helps.
+
+The report from build_test_point_report can be passed in directly, as can a
+TestPointTable or a pandas DataFrame with the same columns. Work is done in
+steps so the dialog can keep pcbnew responsive.
+"""
+
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from math import floor, hypot, sqrt
+
+import numpy as np
+
+from probe_spacing import _report_rows
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+_log = logging.getLogger("kicad_testpoints")
+
+# Candidate neighbours per probe for the improvement moves
+neighbor_count = 8
+# Longest run of probes moved by one Or-opt move
+_segment_length = 3
+# Moves tried between time checks
+_batch = 128
+_eps = 1e-9
+
+
+def path_length(xy: np.ndarray) -> float:
+    """
+    Length of the path through the points in order.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) < 2:
+        return 0.0
+    return float(np.hypot(*np.diff(xy, axis=0).T).sum())
+
+
+def _cell_size(xy: np.ndarray) -> float:
+    """
+    Grid cell holding about two points on average.
+    """
+    extent = xy.max(axis=0) - xy.min(axis=0)
+    area = float(extent[0] * extent[1])
+    if area > 0:
+        return sqrt(2 * area / len(xy))
+    return max(float(extent.max()) / len(xy), 1e-3)
+
+
+class _Grid:
+    """
+    Unvisited points bucketed in uniform cells for nearest neighbour lookup.
+    Rebuilt with larger cells as points are taken so searches stay short.
+    """
+
+    def __init__(self, xs: list, ys: list, points: list):
+        self.xs = xs
+        self.ys = ys
+        self.build(points)
+
+    def build(self, points: list):
+        xy = np.column_stack((np.take(self.xs, points), np.take(self.ys, points)))
+        self.cell = _cell_size(xy)
+        self.x0, self.y0 = xy.min(axis=0).tolist()
+        cells = np.floor((xy - (self.x0, self.y0)) / self.cell).astype(np.int64)
+        self.nx, self.ny = (cells.max(axis=0) + 1).tolist()
+        self.cells = {}
+        for i, (cx, cy) in zip(points, cells.tolist()):
+            self.cells.setdefault((cx, cy), []).append(i)
+        self.built = len(points)
+        self.remaining = len(points)
+
+    def key(self, i: int) -> tuple:
+        # Same expression as build, floor division can land one cell lower
+        return (
+            floor((self.xs[i] - self.x0) / self.cell),
+            floor((self.ys[i] - self.y0) / self.cell),
+        )
+
+    def remove(self, i: int):
+        key = self.key(i)
+        bucket = self.cells[key]
+        bucket.remove(i)
+        if not bucket:
+            del self.cells[key]
+        self.remaining -= 1
+        if self.remaining and self.remaining * 4 < self.built:
+            self.build([j for bucket in self.cells.values() for j in bucket])
+
+    def _ring(self, cx: int, cy: int, r: int):
+        if r == 0:
+            yield cx, cy
+            return
+        for y in (cy - r, cy + r):
+            if 0 <= y < self.ny:
+                for x in range(max(cx - r, 0), min(cx + r, self.nx - 1) + 1):
+                    yield x, y
+        for x in (cx - r, cx + r):
+            if 0 <= x < self.nx:
+                for y in range(max(cy - r + 1, 0), min(cy + r - 1, self.ny - 1) + 1):
+                    yield x, y
+
+    def nearest(self, x: float, y: float):
+        """
+        Closest unvisited point to (x, y), None once all are taken. Rings of
+        cells are searched outwards until no closer point can be left.
+        """
+        if not self.remaining:
+            return None
+        xs, ys, cells = self.xs, self.ys, self.cells
+        cx = min(max(floor((x - self.x0) / self.cell), 0), self.nx - 1)
+        cy = min(max(floor((y - self.y0) / self.cell), 0), self.ny - 1)
+        best, best_d = None, float("inf")
+        for r in range(max(self.nx, self.ny) + 1):
+            for key in self._ring(cx, cy, r):
+                for j in cells.get(key, ()):
+                    d = hypot(xs[j] - x, ys[j] - y)
+                    if d < best_d:
+                        best, best_d = j, d
+            if best is not None and best_d <= r * self.cell:
+                break
+        return best
+
+
+def _neighbors(xy: np.ndarray, k: int) -> np.ndarray:
+    """
+    Up to k nearest other points of every point, closest first, padded with
+    -1. Uses a KD-tree when scipy is available, otherwise the points in the
+    surrounding grid cells.
+    """
+    n = len(xy)
+    found = min(k, n - 1)
+    neighbors = np.full((n, max(found, 0)), -1, dtype=np.intp)
+    if found < 1:
+        return neighbors
+    if cKDTree is not None:
+        _, idx = cKDTree(xy).query(xy, k=found + 1)
+        own = idx == np.arange(n)[:, None]
+        missing = ~own.any(axis=1)
+        own[missing, -1] = True
+        return idx[~own].reshape(n, found)
+
+    cells = np.floor((xy - xy.min(axis=0)) / _cell_size(xy)).astype(np.int64)
+    width = cells[:, 1].max() + 3
+    keys = (cells[:, 0] + 1) * width + (cells[:, 1] + 1)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    found_a, found_b = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = keys + dx * width + dy
+            lo = np.searchsorted(sorted_keys, target, side="left")
+            hi = np.searchsorted(sorted_keys, target, side="right")
+            counts = hi - lo
+            a = np.repeat(np.arange(n), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            found_a.append(a)
+            found_b.append(order[np.repeat(lo, counts) + offsets])
+    a, b = np.concatenate(found_a), np.concatenate(found_b)
+    keep = a != b
+    a, b = a[keep], b[keep]
+    d = np.hypot(*(xy[a] - xy[b]).T)
+    order = np.lexsort((b, d, a))
+    a, b = a[order], b[order]
+    starts = np.searchsorted(a, np.arange(n))
+    rank = np.arange(len(a)) - starts[a]
+    keep = rank < found
+    neighbors[a[keep], rank[keep]] = b[keep]
+    return neighbors
+
+
+class _PathOptimizer:
+    """
+    Nearest neighbour tour and local search for the probes of one side. The
+    first probe of the tour stays first. run() is a generator that yields
+    every few moves so the caller can stop on time.
+    """
+
+    def __init__(self, xy: np.ndarray, start: tuple):
+        self.xy = xy
+        self.xs = xy[:, 0].tolist()
+        self.ys = xy[:, 1].tolist()
+        self.start = start
+        self.tour = None
+        self.placed = 0
+        self.moves = 0
+
+    def d(self, a: int, b: int) -> float:
+        return hypot(self.xs[a] - self.xs[b], self.ys[a] - self.ys[b])
+
+    def run(self):
+        n = len(self.xs)
+        if not n:
+            self.tour = np.empty(0, dtype=np.intp)
+            return
+        grid = _Grid(self.xs, self.ys, list(range(n)))
+        tour = []
+        current = grid.nearest(*self.start)
+        while current is not None:
+            tour.append(current)
+            grid.remove(current)
+            self.placed = len(tour)
+            if self.placed % _batch == 0:
+                yield
+            current = grid.nearest(self.xs[current], self.ys[current])
+        self.tour = np.array(tour, dtype=np.intp)
+        yield
+
+        if n < 3:
+            return
+        self.neighbors = _neighbors(self.xy, neighbor_count).tolist()
+        self.pos = np.empty(n, dtype=np.intp)
+        self.pos[self.tour] = np.arange(n)
+        queue = deque(self.tour.tolist())
+        queued = [True] * n
+        tried = 0
+        while queue:
+            a = queue.popleft()
+            queued[a] = False
+            touched = self.two_opt(a) or self.or_opt(a)
+            if touched:
+                self.moves += 1
+                for i in touched:
+                    if i is not None and not queued[i]:
+                        queued[i] = True
+                        queue.append(i)
+            tried += 1
+            if tried % _batch == 0:
+                yield
+
+    def at(self, i: int):
+        return int(self.tour[i]) if 0 <= i < len(self.tour) else None
+
+    def reverse(self, i: int, j: int):
+        """
+        Reverse tour[i:j].
+        """
+        self.tour[i:j] = self.tour[i:j][::-1].copy()
+        self.pos[self.tour[i:j]] = np.arange(i, j)
+
+    def two_opt(self, a: int):
+        """
+        Replace an edge at a and another edge at one of its neighbours with the
+        two shorter edges between them. Returns the probes whose edges changed.
+        """
+        d, at = self.d, self.at
+        i = int(self.pos[a])
+        succ, pred = at(i + 1), at(i - 1)
+        for c in self.neighbors[a]:
+            if c < 0:
+                break
+            ac = d(a, c)
+            if (succ is None or d(a, succ) <= ac) and (pred is None or d(pred, a) <= ac):
+                # Neighbours are closest first, none further on can help
+                break
+            j = int(self.pos[c])
+            if succ is not None and d(a, succ) - ac > _eps:
+                if j > i + 1:
+                    # a c ... succ cn
+                    cn = at(j + 1)
+                    gain = d(a, succ) - ac
+                    if cn is not None:
+                        gain += d(c, cn) - d(succ, cn)
+                    if gain > _eps:
+                        self.reverse(i + 1, j + 1)
+                        return a, succ, c, cn
+                elif j < i - 1:
+                    # c a ... cn succ
+                    cn = at(j + 1)
+                    gain = d(a, succ) - ac + d(c, cn) - d(cn, succ)
+                    if gain > _eps:
+                        self.reverse(j + 1, i + 1)
+                        return a, succ, c, cn
+            if pred is not None and d(pred, a) - ac > _eps:
+                if j > i + 1:
+                    # pred cp ... a c
+                    cp = at(j - 1)
+                    gain = d(pred, a) - ac + d(cp, c) - d(pred, cp)
+                    if gain > _eps:
+                        self.reverse(i, j)
+                        return a, pred, c, cp
+                elif 1 <= j < i - 1:
+                    # cp pred ... c a
+                    cp = at(j - 1)
+                    gain = d(pred, a) - ac + d(cp, c) - d(cp, pred)
+                    if gain > _eps:
+                        self.reverse(j, i)
+                        return a, pred, c, cp
+        return None
+
+    def or_opt(self, a: int):
+        """
+        Move a run of up to three probes starting at a between two neighbours
+        elsewhere on the path, either way round. Returns the probes whose
+        edges changed.
+        """
+        d, at = self.d, self.at
+        i = int(self.pos[a])
+        if i == 0:
+            return None
+        for length in range(1, _segment_length + 1):
+            e = at(i + length - 1)
+            if e is None:
+                break
+            p, q = at(i - 1), at(i + length)
+            removed = d(p, a)
+            if q is not None:
+                removed += d(e, q) - d(p, q)
+            if removed <= _eps:
+                continue
+            for c in self.neighbors[a] + self.neighbors[e]:
+                if c < 0:
+                    continue
+                j = int(self.pos[c])
+                if i <= j < i + length:
+                    continue
+                # Insert after c, then before c
+                for x, y in ((c, at(j + 1)), (at(j - 1), c)):
+                    if x is None or x == p or i <= self.pos[x] < i + length:
+                        continue
+                    forward = d(x, a) + (d(e, y) if y is not None else 0)
+                    backward = d(x, e) + (d(a, y) if y is not None else 0)
+                    added = min(forward, backward) - (d(x, y) if y is not None else 0)
+                    if removed - added > _eps:
+                        self.move(i, length, x, backward < forward)
+                        return a, e, p, q, x, y
+        return None
+
+    def move(self, i: int, length: int, x: int, flip: bool):
+        """
+        Move tour[i:i + length] to just after x.
+        """
+        segment = self.tour[i:i + length].copy()
+        if flip:
+            segment = segment[::-1]
+        rest = np.concatenate((self.tour[:i], self.tour[i + length:]))
+        k = int(self.pos[x])
+        k = k + 1 if k < i else k + 1 - length
+        self.tour = np.concatenate((rest[:k], segment, rest[k:]))
+        self.pos[self.tour] = np.arange(len(self.tour))
+
+
+@dataclass
+class ProbeOrder:
+    """
+    Row order of a report, top side probes first. sides holds the path
+    length in mm of each side in report order and in the new order.
+    """
+    order: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.intp))
+    # side -> (length before, length after)
+    sides: dict = field(default_factory=dict)
+    moves: int = 0
+
+    @property
+    def length_before(self) -> float:
+        return sum(before for before, _ in self.sides.values())
+
+    @property
+    def length_after(self) -> float:
+        return sum(after for _, after in self.sides.values())
+
+    def summary(self) -> str:
+        before, after = self.length_before, self.length_after
+        saved = 100 * (1 - after / before) if before else 0
+        return "Probe path %.1f mm -> %.1f mm (%.0f%% shorter)" % (before, after, saved)
+
+    def apply(self, report):
+        """
+        The report with its rows in this order, as the same kind of report.
+        """
+        if hasattr(report, "iloc"):
+            return report.iloc[self.order].reset_index(drop=True)
+        if hasattr(report, "select"):
+            return report.select(self.order)
+        rows = list(report)
+        return [rows[i] for i in self.order.tolist()]
+
+
+class ProbeOrderer:
+    """
+    Finds a short visiting order for the probes of a report. Call step()
+    until it returns True, then result(). Stops improving once time_budget
+    seconds have passed since the first step.
+    """
+
+    def __init__(self, report, time_budget: float = 2.0, start: tuple = (0.0, 0.0)):
+        if hasattr(report, "xy"):
+            xy = report.xy()
+            sides = report.column("side")
+        else:
+            rows = list(_report_rows(report))
+            xy = np.array([(row["x"], row["y"]) for row in rows], dtype=np.float64)
+            sides = [row["side"] for row in rows]
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.time_budget = time_budget
+        self.deadline = None
+        self.total = len(xy)
+
+        names = list(dict.fromkeys(["TOP", "BOTTOM", *sides]))
+        sides = np.array(sides, dtype=object)
+        self.groups = []
+        for name in names:
+            rows = np.flatnonzero(sides == name)
+            if len(rows):
+                self.groups.append((name, rows, _PathOptimizer(xy[rows], start)))
+        self._runs = iter([(group, group[2].run()) for group in self.groups])
+        self._run = next(self._runs, None)
+
+    @property
+    def done(self) -> int:
+        return sum(optimizer.placed for _, _, optimizer in self.groups)
+
+    @property
+    def finished(self) -> bool:
+        return self._run is None
+
+    def step(self, budget: float = None) -> bool:
+        """
+        Work for about budget seconds, or until finished when None. Returns
+        True when finished.
+        """
+        now = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = now + self.time_budget
+        end = None if budget is None else now + budget
+        while self._run is not None:
+            (_, _, optimizer), run = self._run
+            if next(run, StopIteration) is StopIteration:
+                self._run = next(self._runs, None)
+                continue
+            now = time.perf_counter()
+            if optimizer.tour is not None and now >= self.deadline:
+                # Out of time, keep the best path found so far
+                run.close()
+                self._run = next(self._runs, None)
+                continue
+            if end is not None and now >= end:
+                break
+        return self.finished
+
+    def result(self) -> ProbeOrder:
+        order, lengths, moves = [], {}, 0
+        for name, rows, optimizer in self.groups:
+            order.append(rows[optimizer.tour])
+            lengths[name] = (path_length(optimizer.xy), path_length(optimizer.xy[optimizer.tour]))
+            moves += optimizer.moves
+        order = np.concatenate(order) if order else np.empty(0, dtype=np.intp)
+        result = ProbeOrder(order=order, sides=lengths, moves=moves)
+        _log.debug("%s, %d improving moves", result.summary(), moves)
+        return result
+
+
+def order_probes(report, time_budget: float = 2.0, start: tuple = (0.0, 0.0)) -> ProbeOrder:
+    """
+    Visiting order for the probes of a report, each side starting from the
+    probe closest to start (report coordinates, mm).
+    """
+    orderer = ProbeOrderer(report, time_budget, start)
+    orderer.step()
+    return orderer.result()
+
+
+def order_report(report, time_budget: float = 2.0, start: tuple = (0.0, 0.0)):
+    """
+    The report with its rows in visiting order, and the ProbeOrder.
+    """
+    order = order_probes(report, time_budget, start)
+    return order.apply(report), order
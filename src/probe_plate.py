@@ -0,0 +1,224 @@
+"""
+probe_plate
+Drill and DXF files for the probe plates of a bed of nails fixture.
+
+Every probe gets a receptacle hole in the plate on its side. The receptacle
+size comes from the probe class, given for every probe or picked from the
+pad size: the largest class whose min_pad fits the pad, one class larger for
+through hole pads, which are probed in the hole. The lower plate is seen from
+below, so bottom side points are mirrored in x.
+
+Classes, tools and coordinates are worked out on whole arrays and the files
+are written a chunk of holes at a time: Excellon with one tool per
+receptacle size, and an ASCII DXF with a circle per hole on a layer per
+probe class plus the board outline when known. Coordinates are report
+coordinates, mm from the report origin with y up.
+"""
+
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from pad_snapshot import IU_PER_MM, PadSnapshot
+from probe_drc import _probe_classes, _segments, default_probe_class, probe_classes
+from testpoint_table import TestPointTable
+
+_log = logging.getLogger("kicad_testpoints")
+
+sides = ("top", "bottom")
+formats = (".drl", ".dxf")
+
+# Holes formatted at a time
+chunk_size = 4096
+
+outline_layer = "OUTLINE"
+
+
+@dataclass
+class PlateHoles:
+    """
+    Receptacle holes of one plate. probe_class indexes classes.
+    """
+    side: str
+    names: list
+    x: np.ndarray
+    y: np.ndarray
+    probe_class: np.ndarray
+    classes: list
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def diameter(self) -> np.ndarray:
+        drills = np.array([c.receptacle_drill for c in self.classes], dtype=np.float64)
+        return drills[self.probe_class]
+
+    def counts(self) -> dict:
+        """
+        Probe class name -> number of holes.
+        """
+        counts = np.bincount(self.probe_class, minlength=len(self.classes))
+        return {c.name: int(n) for c, n in zip(self.classes, counts.tolist()) if n}
+
+
+def pad_sizes(snapshot: PadSnapshot) -> dict:
+    """
+    (ref des, pad) -> smaller side of the pad in mm, for picking probe
+    classes by pad size.
+    """
+    sizes = snapshot.size.min(axis=1) / IU_PER_MM
+    return dict(zip(zip(snapshot.ref_des, snapshot.pad_number), sizes.tolist()))
+
+
+def classes_by_size(sizes: np.ndarray, through_hole: np.ndarray, classes: dict = None):
+    """
+    Index of the probe class for each pad size in mm and the classes indexed,
+    smallest first. Unknown (nan) sizes get the default class.
+    """
+    ordered = sorted((classes or probe_classes).values(), key=lambda c: c.min_pad)
+    limits = np.array([c.min_pad for c in ordered])
+    sizes = np.asarray(sizes, dtype=np.float64)
+    index = np.searchsorted(limits, np.nan_to_num(sizes, nan=0.0), side="right") - 1
+    index = np.clip(index + np.asarray(through_hole, dtype=np.intp), 0, len(ordered) - 1)
+    names = [c.name for c in ordered]
+    default = names.index(default_probe_class) if default_probe_class in names else len(ordered) - 1
+    index[np.isnan(sizes)] = default
+    return index, ordered
+
+
+def plate_holes(report, probe_class=None, pad_sizes: dict = None, classes: dict = None) -> list:
+    """
+    Holes of the top and bottom plates for a report, a TestPointTable or
+    report rows. probe_class is one class for all probes or one per probe;
+    without it classes are picked from pad_sizes, see pad_sizes(), and the
+    default class is used for everything when neither is given.
+    """
+    table = report if isinstance(report, TestPointTable) else TestPointTable.from_rows(list(report))
+    classes = classes or probe_classes
+    if probe_class is None and pad_sizes is not None:
+        sizes = np.fromiter(
+            (pad_sizes.get(key, np.nan) for key in zip(table.ref_des, table.pad_number)),
+            dtype=np.float64, count=len(table),
+        )
+        through_hole = np.asarray(table.column("pad type"), dtype=object) == "THRU"
+        index, ordered = classes_by_size(sizes, through_hole, classes)
+    else:
+        per_probe = _probe_classes(table, probe_class, classes)
+        ordered = list({c.name: c for c in per_probe}.values())
+        lookup = {c.name: i for i, c in enumerate(ordered)}
+        index = np.fromiter((lookup[c.name] for c in per_probe), dtype=np.intp, count=len(table))
+
+    names = np.array([f"{r}-{p}" for r, p in zip(table.ref_des, table.pad_number)], dtype=object)
+    bottom = np.asarray(table.column("side"), dtype=object) == "BOTTOM"
+    plates = []
+    for side, which in zip(sides, (~bottom, bottom)):
+        rows = np.flatnonzero(which)
+        x = table.x[rows]
+        plates.append(PlateHoles(
+            side=side,
+            names=names[rows].tolist(),
+            # The lower plate is drilled from below
+            x=-x if side == "bottom" else x.copy(),
+            y=table.y[rows].copy(),
+            probe_class=index[rows],
+            classes=ordered,
+        ))
+    return plates
+
+
+def _chunks(indices: np.ndarray, size: int = None):
+    size = size or chunk_size
+    for start in range(0, len(indices), size):
+        yield indices[start:start + size]
+
+
+def write_excellon(path: Path, holes: PlateHoles) -> Path:
+    """
+    Excellon drill file, metric with decimal coordinates, one tool per
+    receptacle size.
+    """
+    path = Path(path)
+    tools, tool_of = np.unique(np.round(holes.diameter, 3), return_inverse=True)
+    order = np.argsort(tool_of, kind="stable")
+    bounds = np.searchsorted(tool_of[order], np.arange(len(tools) + 1))
+    with path.open("w", newline="\n") as f:
+        f.write("M48\n; Probe plate %s, %d holes\nFMAT,2\nMETRIC\n" % (holes.side, len(holes)))
+        f.writelines("T%dC%.3f\n" % (t, d) for t, d in enumerate(tools.tolist(), 1))
+        f.write("%\nG90\nG05\n")
+        for t in range(len(tools)):
+            f.write("T%d\n" % (t + 1))
+            for part in _chunks(order[bounds[t]:bounds[t + 1]]):
+                f.write("".join(
+                    "X%.4fY%.4f\n" % xy for xy in zip(holes.x[part].tolist(), holes.y[part].tolist())
+                ))
+        f.write("M30\n")
+    return path
+
+
+def _layer(probe_class) -> str:
+    return f"PROBE_{probe_class.name.upper()}"
+
+
+def write_dxf(path: Path, holes: PlateHoles, outline: list = None) -> Path:
+    """
+    ASCII DXF with a circle per receptacle hole on a layer per probe class,
+    and the board outline rings, mirrored like the holes, when given.
+    """
+    path = Path(path)
+    layers = [_layer(c) for c in holes.classes]
+    radius = holes.diameter / 2
+    with path.open("w", newline="\n") as f:
+        f.write("0\nSECTION\n2\nHEADER\n9\n$INSUNITS\n70\n4\n0\nENDSEC\n")
+        f.write("0\nSECTION\n2\nENTITIES\n")
+        for part in _chunks(np.arange(len(holes))):
+            f.write("".join(
+                "0\nCIRCLE\n8\n%s\n10\n%.4f\n20\n%.4f\n30\n0.0\n40\n%.4f\n" % (layers[c], x, y, r)
+                for c, x, y, r in zip(
+                    holes.probe_class[part].tolist(), holes.x[part].tolist(),
+                    holes.y[part].tolist(), radius[part].tolist(),
+                )
+            ))
+        if outline:
+            start, end = _segments(outline)
+            if holes.side == "bottom":
+                start, end = start * (-1, 1), end * (-1, 1)
+            for part in _chunks(np.arange(len(start))):
+                f.write("".join(
+                    "0\nLINE\n8\n%s\n10\n%.4f\n20\n%.4f\n30\n0.0\n11\n%.4f\n21\n%.4f\n31\n0.0\n"
+                    % (outline_layer, x0, y0, x1, y1)
+                    for (x0, y0), (x1, y1) in zip(start[part].tolist(), end[part].tolist())
+                ))
+        f.write("0\nENDSEC\n0\nEOF\n")
+    return path
+
+
+def plate_path(base: Path, side: str, extension: str) -> Path:
+    base = Path(base)
+    return base.parent / f"{base.stem}-plate-{side}{extension}"
+
+
+def write_plates(report, base: Path, probe_class=None, pad_sizes: dict = None,
+                 outline: list = None, extensions=formats) -> list[Path]:
+    """
+    Drill and DXF files of both plates, named <base stem>-plate-<side> next
+    to base. Plates without probes are skipped. Returns the paths written.
+    """
+    for extension in extensions:
+        if extension not in formats:
+            msg = f"Unknown plate format {extension!r}, use one of: {', '.join(formats)}"
+            raise UserWarning(msg)
+    paths = []
+    for holes in plate_holes(report, probe_class, pad_sizes):
+        if not len(holes):
+            continue
+        for extension in extensions:
+            path = plate_path(base, holes.side, extension)
+            if extension == ".drl":
+                paths.append(write_excellon(path, holes))
+            else:
+                paths.append(write_dxf(path, holes, outline))
+        _log.debug("Probe plate %s: %s", holes.side, holes.counts())
+    return paths
@@ -0,0 +1,273 @@
+"""
+probe_select
+Pick the fewest test points that still cover every net.
+
+Every flagged pad is a candidate probe on its net. One probe per net is
+chosen so that no two chosen probes on the same side are closer than the
+probe spacing, preferring the top side. Candidates are bucketed in a uniform
+grid with cells of the spacing size so conflicts are only looked for between
+neighbouring cells.
+
+A greedy pass covers the nets with the fewest candidates first. A local
+search then covers nets the greedy pass left out by moving a single blocking
+probe to another pad on its net, and moves probes to the top side where
+there is room. time_budget trades quality for speed: 0 keeps the greedy
+result, which takes about a second for 50k candidates.
+
+Candidates can be added and removed afterwards; only the nets they touch
+are solved again.
+"""
+
+import logging
+import time
+from math import floor, hypot
+
+from probe_drc import probe_classes
+from probe_spacing import _report_rows, probe_name
+
+_log = logging.getLogger("kicad_testpoints")
+
+
+def _spacing(probe) -> float:
+    if isinstance(probe, str):
+        try:
+            return probe_classes[probe].spacing
+        except KeyError:
+            msg = f"Unknown probe class {probe}, use one of: {', '.join(probe_classes)}"
+            raise UserWarning(msg) from None
+    return float(probe)
+
+
+class ProbeSelector:
+    """
+    Minimal set of probes over the candidates of a report. report can be
+    the rows of build_test_point_report, a TestPointTable or a DataFrame.
+    probe is a probe class name or the spacing in mm.
+    """
+
+    def __init__(self, report=(), probe="100mil", time_budget: float = 1.0):
+        self.spacing = _spacing(probe)
+        self.time_budget = time_budget
+        self.rows = []
+        self.alive = []
+        self.x, self.y, self.bottom, self.net = [], [], [], []
+        self.conflicts = []
+        # Chosen probes in conflict with each candidate
+        self.blocked = []
+        self.by_name = {}
+        self.net_codes = {}
+        self.net_names = []
+        self.candidates = []
+        self.chosen = {}
+        self.uncovered = set()
+        self.cells = ({}, {})
+        self.add(report)
+
+    def __len__(self):
+        return len(self.chosen)
+
+    def _key(self, i: int) -> tuple:
+        if self.spacing <= 0:
+            return (0, 0)
+        return (floor(self.x[i] / self.spacing), floor(self.y[i] / self.spacing))
+
+    def _near(self, i: int):
+        """
+        Live candidates on the same side closer than the spacing.
+        """
+        if self.spacing <= 0:
+            return
+        cells = self.cells[self.bottom[i]]
+        cx, cy = self._key(i)
+        x, y, spacing = self.x[i], self.y[i], self.spacing
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    if j != i and hypot(self.x[j] - x, self.y[j] - y) < spacing:
+                        yield j
+
+    def _sort_key(self, i: int) -> tuple:
+        return (self.bottom[i], len(self.conflicts[i]), i)
+
+    def _choose(self, i: int):
+        self.chosen[self.net[i]] = i
+        self.uncovered.discard(self.net[i])
+        for j in self.conflicts[i]:
+            self.blocked[j] += 1
+
+    def _unchoose(self, i: int):
+        del self.chosen[self.net[i]]
+        self.uncovered.add(self.net[i])
+        for j in self.conflicts[i]:
+            self.blocked[j] -= 1
+
+    def add(self, report) -> list[int]:
+        """
+        Add candidates and solve the nets they are on. Returns their ids.
+        """
+        added = []
+        for row in _report_rows(report):
+            i = len(self.rows)
+            name = row.get("net") or ""
+            if not name:
+                # Unconnected pads cover nothing
+                continue
+            net = self.net_codes.get(name)
+            if net is None:
+                net = self.net_codes[name] = len(self.net_names)
+                self.net_names.append(name)
+                self.candidates.append(set())
+            self.rows.append(dict(row))
+            self.alive.append(True)
+            self.x.append(float(row["x"]))
+            self.y.append(float(row["y"]))
+            self.bottom.append(row["side"] == "BOTTOM")
+            self.net.append(net)
+            self.by_name[probe_name(row)] = i
+            self.candidates[net].add(i)
+            self.cells[self.bottom[i]].setdefault(self._key(i), set()).add(i)
+            conflicts = set(self._near(i))
+            self.conflicts.append(conflicts)
+            self.blocked.append(sum(self.chosen.get(self.net[j]) == j for j in conflicts))
+            for j in conflicts:
+                self.conflicts[j].add(i)
+            added.append(i)
+        self.solve({self.net[i] for i in added})
+        return added
+
+    def remove(self, names) -> int:
+        """
+        Remove candidates by probe name ("REF-PAD") and solve their nets
+        again. Returns the number removed.
+        """
+        nets = set()
+        removed = 0
+        for name in names:
+            i = self.by_name.pop(name, None)
+            if i is None or not self.alive[i]:
+                continue
+            net = self.net[i]
+            if self.chosen.get(net) == i:
+                self._unchoose(i)
+            self.alive[i] = False
+            self.candidates[net].discard(i)
+            self.cells[self.bottom[i]][self._key(i)].discard(i)
+            for j in self.conflicts[i]:
+                self.conflicts[j].discard(i)
+            self.conflicts[i] = set()
+            if not self.candidates[net]:
+                self.uncovered.discard(net)
+            nets.add(net)
+            removed += 1
+        self.solve(nets)
+        return removed
+
+    def solve(self, nets=None):
+        """
+        Greedy then local search over the nets, all of them by default.
+        """
+        start = time.perf_counter()
+        if nets is None:
+            nets = range(len(self.net_names))
+        nets = [n for n in nets if self.candidates[n] and n not in self.chosen]
+        # Fewest candidates first, they have the least choice
+        nets.sort(key=lambda n: (len(self.candidates[n]), n))
+        for net in nets:
+            free = [i for i in self.candidates[net] if not self.blocked[i]]
+            if free:
+                self._choose(min(free, key=self._sort_key))
+            else:
+                self.uncovered.add(net)
+        greedy = time.perf_counter()
+        self.improve(start + self.time_budget)
+        _log.debug(
+            "Probe selection: %s, greedy %.3f s, local search %.3f s",
+            self.summary(), greedy - start, time.perf_counter() - greedy,
+        )
+
+    def _free(self, net: int, skip: int = None):
+        """
+        The best candidate of a net that no chosen probe blocks.
+        """
+        free = [i for i in self.candidates[net] if not self.blocked[i] and i != skip]
+        return min(free, key=self._sort_key) if free else None
+
+    def _repair(self, net: int) -> bool:
+        """
+        Cover an uncovered net, moving one blocking probe to another pad on
+        its own net if needed.
+        """
+        if net in self.chosen:
+            return False
+        i = self._free(net)
+        if i is not None:
+            self._choose(i)
+            return True
+        for i in sorted(self.candidates[net], key=self._sort_key):
+            blockers = [j for j in self.conflicts[i] if self.chosen.get(self.net[j]) == j]
+            if len(blockers) != 1:
+                continue
+            blocker = blockers[0]
+            self._unchoose(blocker)
+            self._choose(i)
+            other = self._free(self.net[blocker], skip=blocker)
+            if other is not None:
+                self._choose(other)
+                return True
+            self._unchoose(i)
+            self._choose(blocker)
+        return False
+
+    def _to_top(self, net: int) -> bool:
+        i = self.chosen[net]
+        if not self.bottom[i]:
+            return False
+        self._unchoose(i)
+        other = self._free(net)
+        if other is not None and not self.bottom[other]:
+            self._choose(other)
+            return True
+        self._choose(i)
+        return False
+
+    def improve(self, deadline: float):
+        """
+        Local search until no move helps or the deadline passes.
+        """
+        improved = True
+        while improved:
+            improved = False
+            for moves in (self._repair, self._to_top):
+                nets = self.uncovered if moves == self._repair else self.chosen
+                for net in sorted(nets):
+                    if time.perf_counter() >= deadline:
+                        return
+                    improved |= moves(net)
+
+    def selected(self) -> list[int]:
+        return sorted(self.chosen.values())
+
+    def selected_rows(self) -> list[dict]:
+        """
+        Report rows of the chosen probes, in the order they were added.
+        """
+        return [self.rows[i] for i in self.selected()]
+
+    def uncovered_nets(self) -> list[str]:
+        return sorted(self.net_names[n] for n in self.uncovered)
+
+    def summary(self) -> str:
+        candidates = sum(self.alive)
+        nets = sum(1 for c in self.candidates if c)
+        bottom = sum(self.bottom[i] for i in self.chosen.values())
+        return "%d of %d candidates selected, %d / %d nets covered, %d on the bottom" % (
+            len(self.chosen), candidates, len(self.chosen), nets, bottom,
+        )
+
+
+def select_probes(report, probe="100mil", time_budget: float = 1.0) -> list[dict]:
+    """
+    Report rows of the fewest probes that cover every net the report can
+    reach, see ProbeSelector.
+    """
+    return ProbeSelector(report, probe, time_budget).selected_rows()
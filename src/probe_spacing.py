@@ -0,0 +1,345 @@
+"""
+probe_spacing
+Spatially indexed distance queries between test point probes.
+
+Replaces the row by row walk of calc_probe_distances with a single index over
+all probe coordinates. The report from build_test_point_report can be passed in
+directly, as can a TestPointTable or a pandas DataFrame with the same columns.
+"""
+
+import logging
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+_log = logging.getLogger("kicad_testpoints")
+
+# Rings of grid cells searched before the probes left, far from the others,
+# are compared with every probe
+_max_rings = 32
+
+# Number of probes compared at once by the brute force search
+_chunk_size = 1024
+
+
+def _cell_range(sorted_keys: np.ndarray, order: np.ndarray, line: np.ndarray, first: np.ndarray,
+                last: np.ndarray, lines: int, span: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Points in cells first to last of a grid line, for each query. Keys are
+    line * span + cell; out of range lines and cells are left out.
+    Returns (query, point) arrays.
+    """
+    first = np.maximum(first, 0)
+    last = np.minimum(last, span - 1)
+    valid = (line >= 0) & (line < lines) & (first <= last)
+    lo = np.searchsorted(sorted_keys, line * span + first, side="left")
+    hi = np.searchsorted(sorted_keys, line * span + last, side="right")
+    counts = np.where(valid, hi - lo, 0)
+    a = np.repeat(np.arange(len(line)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return a, order[np.repeat(lo, counts) + offsets]
+
+
+def probe_name(row) -> str:
+    """
+    Name a probe by its test point ref des if the report has one, otherwise by
+    the source ref des and pad.
+    """
+    name = row.get("test point ref des")
+    if name is not None:
+        return str(name)
+    return f"{row['source ref des']}-{row['source pad']}"
+
+
+def _report_rows(report):
+    if hasattr(report, "to_dict"):
+        return report.to_dict("records")
+    if hasattr(report, "rows"):
+        return report.rows()
+    return report
+
+
+class ProbeIndex:
+    """
+    Index over the probe coordinates of a report. Uses a KD-tree when scipy is
+    available and a uniform grid with vectorized numpy otherwise.
+    """
+
+    def __init__(self, report):
+        if hasattr(report, "xy"):
+            # TestPointTable, use its columns as they are
+            self.names = [f"{r}-{p}" for r, p in zip(report.ref_des, report.pad_number)]
+            self.xy = report.xy()
+            self._tree = cKDTree(self.xy) if (cKDTree and len(report)) else None
+            self._lookup = None
+            return
+        rows = list(_report_rows(report))
+        self.names = [probe_name(row) for row in rows]
+        self.xy = np.array(
+            [(row["x"], row["y"]) for row in rows], dtype=np.float64
+        ).reshape(-1, 2)
+        self._tree = cKDTree(self.xy) if (cKDTree and len(rows)) else None
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _distance(self, a, b):
+        d = self.xy[a] - self.xy[b]
+        return np.sqrt(d[..., 0] ** 2 + d[..., 1] ** 2)
+
+    def index_of(self, name: str) -> int:
+        if self._lookup is None:
+            self._lookup = {n: i for i, n in reversed(list(enumerate(self.names)))}
+        try:
+            return self._lookup[name]
+        except KeyError:
+            msg = f"Probe {name} not found"
+            raise UserWarning(msg) from None
+
+    def distances_from(self, name: str) -> np.ndarray:
+        """
+        Distance from the named probe to every probe, in report order.
+        """
+        i = self.index_of(name)
+        return self._distance(np.full(len(self), i), np.arange(len(self)))
+
+    def nearest(self, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The k nearest other probes for every probe. Returns (indices, distances),
+        both shaped (n, k). Missing neighbours have index -1 and distance inf.
+        """
+        n = len(self)
+        indices = np.full((n, k), -1, dtype=np.intp)
+        distances = np.full((n, k), np.inf)
+        found = min(k, n - 1)
+        if found < 1:
+            return indices, distances
+
+        if self._tree is not None:
+            _, idx = self._tree.query(self.xy, k=found + 1)
+            idx = idx.reshape(n, found + 1)
+            # Drop each probe's own entry; with coincident probes it may not
+            # be in the first column
+            own = idx == np.arange(n)[:, None]
+            missing = ~own.any(axis=1)
+            own[missing, -1] = True
+            idx = idx[~own].reshape(n, found)
+        else:
+            idx = self._grid_nearest(found)
+
+        dist = self._distance(np.arange(n)[:, None], idx)
+        order = np.argsort(dist, axis=1, kind="stable")
+        indices[:, :found] = np.take_along_axis(idx, order, axis=1)
+        distances[:, :found] = np.take_along_axis(dist, order, axis=1)
+        return indices, distances
+
+    def _grid_nearest(self, k: int) -> np.ndarray:
+        """
+        Indices of the k nearest other probes from a uniform grid holding
+        about k + 1 probes per cell. Probes search ring after ring of cells
+        around their own until the k-th distance found is within the distance
+        to the edge of the searched cells, as every probe further out is at
+        least that far away. Each ring is two grid rows and two grid columns,
+        found by range searches on the probes sorted row by row and column by
+        column. Probes are worked on in row order so neighbours are close in
+        memory too.
+
+        The cell size ignores the outermost percent of probes on each axis so
+        a few stray probes don't crowd the rest into a handful of cells.
+        """
+        n = len(self)
+        origin = self.xy.min(axis=0)
+        extent = np.percentile(self.xy, 99, axis=0) - np.percentile(self.xy, 1, axis=0)
+        if extent.prod() > 0:
+            size = np.sqrt(extent.prod() * (k + 1) / n)
+        else:
+            # All probes on a line or the same point
+            size = extent.max() * (k + 1) / n or 1.0
+        cells = np.floor((self.xy - origin) / size).astype(np.int64)
+        width, height = cells[:, 0].max() + 1, cells[:, 1].max() + 1
+        row_keys = cells[:, 1] * width + cells[:, 0]
+        perm = np.argsort(row_keys, kind="stable")
+        xy, cells, row_keys = self.xy[perm], cells[perm], row_keys[perm]
+        # Distance from each probe to the nearest edge of its own cell
+        inside = xy - origin - cells * size
+        margin = np.minimum(inside, size - inside).min(axis=1)
+        col_keys = cells[:, 0] * height + cells[:, 1]
+        cols = np.argsort(col_keys, kind="stable")
+        rows = (row_keys, np.arange(n))
+        cols = (col_keys[cols], cols)
+
+        best_i = np.full((n, k), -1, dtype=np.intp)
+        best_d = np.full((n, k), np.inf)
+        active = np.arange(n)
+        ring = 0
+        while len(active):
+            cx, cy = cells[active, 0], cells[active, 1]
+            if ring == 0:
+                found = [_cell_range(*rows, cy, cx, cx, height, width)]
+            else:
+                found = [
+                    _cell_range(*rows, cy - ring, cx - ring, cx + ring, height, width),
+                    _cell_range(*rows, cy + ring, cx - ring, cx + ring, height, width),
+                    _cell_range(*cols, cx - ring, cy - ring + 1, cy + ring - 1, width, height),
+                    _cell_range(*cols, cx + ring, cy - ring + 1, cy + ring - 1, width, height),
+                ]
+            a = np.concatenate([f[0] for f in found])
+            b = np.concatenate([f[1] for f in found])
+            keep = b != active[a]
+            a, b = a[keep], b[keep]
+
+            # Merge with the best found so far and keep the k closest
+            old = best_i[active] >= 0
+            a = np.concatenate((np.nonzero(old)[0], a))
+            b = np.concatenate((best_i[active][old], b))
+            d = np.hypot(*(xy[active[a]] - xy[b]).T)
+            # By probe then distance; one key sorts much faster than lexsort
+            order = np.argsort(d)
+            order = order[np.argsort(a[order] * len(a) + np.arange(len(a)))]
+            a, b, d = a[order], b[order], d[order]
+            starts = np.searchsorted(a, np.arange(len(active)))
+            rank = np.arange(len(a)) - starts[a]
+            keep = rank < k
+            best_i[active[a[keep]], rank[keep]] = b[keep]
+            best_d[active[a[keep]], rank[keep]] = d[keep]
+
+            done = best_d[active, k - 1] <= ring * size + margin[active]
+            if ring >= max(width, height):
+                break
+            active = active[~done]
+            ring += 1
+            if ring > _max_rings and len(active):
+                unsorted = np.empty(n, dtype=np.intp)
+                unsorted[perm] = np.arange(n)
+                best_i[active] = unsorted[self._brute_nearest(perm[active], k)]
+                break
+        nearest = np.empty_like(best_i)
+        nearest[perm] = perm[best_i]
+        return nearest
+
+    def _brute_nearest(self, probes: np.ndarray, k: int) -> np.ndarray:
+        """
+        Indices of the k nearest other probes of each of probes, comparing
+        with every probe.
+        """
+        idx = np.empty((len(probes), k), dtype=np.intp)
+        for start in range(0, len(probes), _chunk_size):
+            part = probes[start:start + _chunk_size]
+            d = self.xy[part, None, :] - self.xy[None, :, :]
+            d2 = d[..., 0] ** 2 + d[..., 1] ** 2
+            d2[np.arange(len(part)), part] = np.inf
+            closest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(d2, closest, axis=1), axis=1)
+            idx[start:start + len(part)] = np.take_along_axis(closest, order, axis=1)
+        return idx
+
+    def pairs_within(self, pitch: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All probe pairs closer than pitch. Returns (a, b, distance) arrays with
+        a < b, sorted by distance.
+        """
+        if self._tree is not None:
+            pairs = self._tree.query_pairs(pitch, output_type="ndarray")
+            a, b = pairs[:, 0], pairs[:, 1]
+        else:
+            a, b = self._grid_pairs(pitch)
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        dist = self._distance(a, b)
+        keep = dist < pitch
+        a, b, dist = a[keep], b[keep], dist[keep]
+        order = np.lexsort((b, a, dist))
+        return a[order], b[order], dist[order]
+
+    def _grid_pairs(self, pitch: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate pairs from a uniform grid with cells of the pitch size. Each
+        cell is compared with itself and half of its neighbours so every pair
+        is visited once.
+        """
+        empty = np.empty(0, dtype=np.intp)
+        if len(self) < 2 or pitch <= 0:
+            return empty, empty
+        cells = np.floor((self.xy - self.xy.min(axis=0)) / pitch).astype(np.int64)
+        width = cells[:, 1].max() + 3
+        keys = (cells[:, 0] + 1) * width + (cells[:, 1] + 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        found_a, found_b = [], []
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            target = keys + dx * width + dy
+            lo = np.searchsorted(sorted_keys, target, side="left")
+            hi = np.searchsorted(sorted_keys, target, side="right")
+            counts = hi - lo
+            a = np.repeat(np.arange(len(self)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            b = order[np.repeat(lo, counts) + offsets]
+            if dx == 0 and dy == 0:
+                keep = a < b
+                a, b = a[keep], b[keep]
+            found_a.append(a)
+            found_b.append(b)
+        return np.concatenate(found_a), np.concatenate(found_b)
+
+
+def calc_probe_distances(name: str, report) -> dict:
+    """
+    Calculate distance to all probes from this one. Return dict of distances.
+    Same result as kicad_testpoints.calc_probe_distances.
+    """
+    index = ProbeIndex(report)
+    distances = index.distances_from(name)
+    return {n: float(d) for n, d in zip(index.names, distances)}
+
+
+def nearest_probes(report, k: int = 1) -> list[dict]:
+    """
+    The k nearest probes to each probe, one row per (probe, neighbour).
+    """
+    index = ProbeIndex(report)
+    indices, distances = index.nearest(k)
+    rows = []
+    for i, name in enumerate(index.names):
+        for rank, (j, d) in enumerate(zip(indices[i], distances[i]), start=1):
+            if j < 0:
+                break
+            rows.append({
+                "probe": name,
+                "rank": rank,
+                "neighbor": index.names[j],
+                "distance": float(d),
+            })
+    return rows
+
+
+def probes_within(report, pitch: float) -> list[dict]:
+    """
+    All pairs of probes closer than pitch, closest first.
+    """
+    index = ProbeIndex(report)
+    a, b, dist = index.pairs_within(pitch)
+    return [
+        {"probe": index.names[i], "neighbor": index.names[j], "distance": float(d)}
+        for i, j, d in zip(a, b, dist)
+    ]
+
+
+def min_spacing_table(report) -> list[dict]:
+    """
+    The closest other probe and its distance for every probe in the report.
+    """
+    index = ProbeIndex(report)
+    indices, distances = index.nearest(1)
+    return [
+        {
+            "probe": name,
+            "neighbor": index.names[j] if j >= 0 else None,
+            "distance": float(d),
+        }
+        for name, j, d in zip(index.names, indices[:, 0], distances[:, 0])
+    ]
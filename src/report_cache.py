@@ -0,0 +1,173 @@
+"""
+report_cache
+On disk cache of report rows, one entry per footprint.
+
+Each footprint is fingerprinted from its pads in the snapshot: position,
+side and every attribute that ends up in the report. Footprints whose
+fingerprint is in the cache reuse their rows, only the rest are rebuilt. The
+cache is dropped when the plugin version or the origin setting changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot, resolve_origin
+from stage_trace import stage
+from testpoint_table import TestPointTable
+from _version import __version__
+
+_log = logging.getLogger("kicad_testpoints")
+
+# Default number of footprints kept
+max_entries = 20000
+
+# Bumped when the layout of the entries changes
+_format = 2
+
+
+def cache_path(report_path: Path) -> Path:
+    """
+    The cache lives next to the report it speeds up.
+    """
+    report_path = Path(report_path)
+    return report_path.with_name(report_path.name + ".cache")
+
+
+def footprint_fingerprints(snapshot: PadSnapshot) -> dict:
+    """
+    Map of ref des -> (fingerprint, pad indices) in snapshot order.
+    """
+    groups = {}
+    for i, ref_des in enumerate(snapshot.ref_des):
+        groups.setdefault(ref_des, []).append(i)
+
+    records = list(zip(
+        snapshot.pad_number,
+        snapshot.net,
+        snapshot.net_class,
+        snapshot.has_hole.tolist(),
+        snapshot.bottom.tolist(),
+        snapshot.footprint_bottom.tolist(),
+        snapshot.pad_property.tolist(),
+        snapshot.center.tolist(),
+    ))
+    fingerprints = {}
+    for ref_des, indices in groups.items():
+        h = hashlib.blake2b(repr((ref_des, [records[i] for i in indices])).encode(), digest_size=16)
+        fingerprints[ref_des] = (h.hexdigest(), indices)
+    return fingerprints
+
+
+class ReportCache:
+    """
+    Report records by footprint fingerprint, least recently used entries are
+    dropped when saving beyond max_entries.
+    """
+
+    def __init__(self, path: Path, max_entries: int = max_entries):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.key = None
+        self.entries = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: Path, max_entries: int = max_entries) -> "ReportCache":
+        cache = cls(path, max_entries)
+        if not cache.path.exists():
+            return cache
+        try:
+            with cache.path.open() as f:
+                data = json.load(f)
+            cache.key = data["key"]
+            cache.generation = data["generation"]
+            cache.entries = data["entries"]
+        except (OSError, ValueError, KeyError) as e:
+            _log.info("Ignoring unreadable report cache %s: %s", cache.path, e)
+            cache.key = None
+            cache.entries = {}
+        return cache
+
+    def save(self):
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            keep = sorted(entries, key=lambda k: entries[k]["used"], reverse=True)
+            entries = {k: entries[k] for k in keep[:self.max_entries]}
+        self.entries = entries
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w") as f:
+            json.dump({"key": self.key, "generation": self.generation, "entries": entries}, f)
+        os.replace(tmp, self.path)
+
+    @stage("report cache", lambda t, cache, *_: {
+        "pads": len(t), "cache hits": cache.hits, "cache misses": cache.misses})
+    def build_table(self, snapshot: PadSnapshot, settings) -> TestPointTable:
+        """
+        Same table as TestPointTable.from_snapshot, rebuilding only footprints
+        that changed since the cache was written.
+        """
+        origin = resolve_origin(snapshot, settings)
+        key = {
+            "version": __version__,
+            "format": _format,
+            "use_aux_origin": bool(settings.use_aux_origin),
+            "origin": [int(v) for v in origin],
+        }
+        if key != self.key:
+            if self.key is not None:
+                _log.debug("Report cache invalidated")
+            self.key = key
+            self.entries = {}
+
+        self.generation += 1
+        self.hits = self.misses = 0
+        records = [None] * len(snapshot)
+        changed = []
+        fingerprints = footprint_fingerprints(snapshot)
+        for fingerprint, indices in fingerprints.values():
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                changed.extend(indices)
+                self.misses += 1
+                continue
+            entry["used"] = self.generation
+            self.hits += 1
+            for i, record in zip(indices, entry["rows"]):
+                records[i] = tuple(record)
+
+        if not self.hits:
+            table = TestPointTable.from_snapshot(snapshot, settings)
+            records = list(table.records())
+        elif changed:
+            rebuilt = TestPointTable.from_snapshot(
+                snapshot.select(np.array(changed, dtype=np.intp)), settings
+            )
+            for i, record in zip(changed, rebuilt.records()):
+                records[i] = record
+            table = TestPointTable.from_records(records)
+        else:
+            table = TestPointTable.from_records(records)
+
+        for fingerprint, indices in fingerprints.values():
+            if fingerprint not in self.entries:
+                self.entries[fingerprint] = {
+                    "rows": [records[i] for i in indices],
+                    "used": self.generation,
+                }
+
+        _log.debug("Report cache: %d footprints reused, %d rebuilt", self.hits, self.misses)
+        return table
+
+    def build_report(self, snapshot: PadSnapshot, settings) -> list[dict]:
+        """
+        Same rows as pad_snapshot.build_report.
+        """
+        return list(self.build_table(snapshot, settings).rows())
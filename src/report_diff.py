@@ -0,0 +1,319 @@
+"""
+report_diff
+Changes to the test points between two revisions of a board, to tell whether
+an existing bed of nails fixture can be reused.
+
+Test points are matched on (source ref des, source pad) with one dictionary
+pass over each report. Points left over on both sides are then matched by
+position, same side and within the tolerance, so a part renamed or
+renumbered between revisions is not reported as one probe removed and
+another added. The leftovers are bucketed in a grid of tolerance sized
+cells, keeping the whole diff linear in the number of points.
+
+Each change is one row:
+
+    added        a probe the fixture doesn't have
+    removed      a probe the fixture has that the board no longer needs
+    moved        matched, but further apart than the tolerance
+    side         matched, but on the other side of the board
+    net          matched, on a different net
+    renamed      matched by position, under another ref des or pad
+
+The fixture can be reused when nothing was added, moved or changed side.
+"""
+
+import argparse
+import logging
+import sys
+from math import floor
+from pathlib import Path
+
+import numpy as np
+
+from pad_snapshot import Settings
+from report_writers import MultiWriter, read_report
+from testpoint_table import TestPointTable
+
+_log = logging.getLogger("kicad_testpoints")
+
+changes = ("added", "removed", "moved", "side", "net", "renamed")
+
+# Changes that need the fixture rebuilt
+fixture_changes = ("added", "moved", "side")
+
+# Default position tolerance in mm
+default_tolerance = 0.1
+
+
+def _table(report) -> TestPointTable:
+    if isinstance(report, TestPointTable):
+        return report
+    if isinstance(report, (str, Path)):
+        return read_report(report)
+    if hasattr(report, "to_dict"):
+        report = report.to_dict("records")
+    # Only the position, side and net columns are compared
+    return TestPointTable.from_records(
+        [tuple(row.get(c, "") for c in TestPointTable.columns) for row in report]
+    )
+
+
+class ReportDiff:
+    """
+    One row per change between the old and new report.
+    """
+
+    columns = (
+        "change", "old probe", "new probe", "old net", "new net", "side",
+        "old x", "old y", "new x", "new y", "distance",
+    )
+
+    def __init__(self, records: list = None, matched: int = 0, tolerance: float = default_tolerance):
+        self.records = list(records or [])
+        self.matched = matched
+        self.tolerance = tolerance
+
+    def __len__(self):
+        return len(self.records)
+
+    def rows(self):
+        return (dict(zip(self.columns, r)) for r in self.records)
+
+    def of(self, change: str) -> list[dict]:
+        return [row for row in self.rows() if row["change"] == change]
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(changes, 0)
+        for record in self.records:
+            counts[record[0]] += 1
+        return counts
+
+    @property
+    def fixture_reusable(self) -> bool:
+        return not any(r[0] in fixture_changes for r in self.records)
+
+    def summary(self) -> str:
+        counts = self.counts()
+        listed = ", ".join(f"{n} {change}" for change, n in counts.items() if n)
+        return "%d probes matched, %s; fixture %s" % (
+            self.matched,
+            listed or "no changes",
+            "can be reused" if self.fixture_reusable else "needs changes",
+        )
+
+    def write(self, paths: list) -> list:
+        """
+        Write the changes to every path, format by extension.
+        """
+        out = MultiWriter(paths).open(self.columns)
+        try:
+            out.write(self.records)
+        finally:
+            out.close()
+        return out.paths
+
+
+def _match_by_position(old: TestPointTable, new: TestPointTable, old_left: np.ndarray,
+                       new_left: np.ndarray, tolerance: float) -> list[tuple]:
+    """
+    Pairs (old index, new index) of unmatched points on the same side within
+    the tolerance, closest first.
+    """
+    if tolerance <= 0 or not len(old_left) or not len(new_left):
+        return []
+    old_side = np.asarray(old.column("side"), dtype=object)
+    new_side = np.asarray(new.column("side"), dtype=object)
+    cells = {}
+    for i in old_left.tolist():
+        key = (old_side[i], floor(old.x[i] / tolerance), floor(old.y[i] / tolerance))
+        cells.setdefault(key, []).append(i)
+
+    candidates = []
+    for j in new_left.tolist():
+        x, y = new.x[j], new.y[j]
+        cx, cy = floor(x / tolerance), floor(y / tolerance)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for i in cells.get((new_side[j], cx + dx, cy + dy), ()):
+                    d = float(np.hypot(old.x[i] - x, old.y[i] - y))
+                    if d <= tolerance:
+                        candidates.append((d, i, j))
+    candidates.sort()
+    used_old, used_new, pairs = set(), set(), []
+    for _, i, j in candidates:
+        if i not in used_old and j not in used_new:
+            used_old.add(i)
+            used_new.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+def _name(table: TestPointTable, i: int) -> str:
+    return f"{table.ref_des[i]}-{table.pad_number[i]}"
+
+
+def _match_by_name(old: TestPointTable, new: TestPointTable) -> np.ndarray:
+    """
+    Old index of every new point with the same ref des and pad, -1 where
+    there is none. Pads sharing a number, like several MP pads, are paired
+    within the part closest first.
+    """
+    groups = {}
+    for i, key in enumerate(zip(old.ref_des, old.pad_number)):
+        groups.setdefault(key, ([], []))[0].append(i)
+    for j, key in enumerate(zip(new.ref_des, new.pad_number)):
+        if key in groups:
+            groups[key][1].append(j)
+
+    new_index = np.full(len(new), -1, dtype=np.intp)
+    for old_rows, new_rows in groups.values():
+        if len(old_rows) == 1 and len(new_rows) == 1:
+            new_index[new_rows[0]] = old_rows[0]
+            continue
+        candidates = sorted(
+            (float(np.hypot(old.x[i] - new.x[j], old.y[i] - new.y[j])), i, j)
+            for i in old_rows for j in new_rows
+        )
+        used_old = set()
+        for _, i, j in candidates:
+            if i not in used_old and new_index[j] < 0:
+                used_old.add(i)
+                new_index[j] = i
+    return new_index
+
+
+def diff_reports(old, new, tolerance: float = default_tolerance) -> ReportDiff:
+    """
+    Changes from the old report to the new one. Reports can be
+    TestPointTables, report rows, DataFrames or paths of report files.
+    tolerance is in mm, both for calling a matched probe moved and for
+    matching renamed probes by position.
+    """
+    old, new = _table(old), _table(new)
+    new_index = _match_by_name(old, new)
+    found = new_index >= 0
+    old_matched = np.zeros(len(old), dtype=bool)
+    old_matched[new_index[found]] = True
+
+    pairs = [(new_index[found], np.flatnonzero(found), False)]
+    renamed = _match_by_position(
+        old, new, np.flatnonzero(~old_matched), np.flatnonzero(~found), tolerance)
+    if renamed:
+        i, j = np.array(renamed, dtype=np.intp).T
+        pairs.append((i, j, True))
+        old_matched[i] = True
+        found[j] = True
+
+    old_net, new_net = old.column("net"), new.column("net")
+    old_side, new_side = old.column("side"), new.column("side")
+    records = []
+    matched = 0
+    for i, j, by_position in pairs:
+        matched += len(i)
+        distance = np.hypot(old.x[i] - new.x[j], old.y[i] - new.y[j])
+        moved = distance > tolerance
+        net_changed = np.fromiter(
+            (old_net[a] != new_net[b] for a, b in zip(i.tolist(), j.tolist())),
+            dtype=bool, count=len(i),
+        )
+        side_changed = np.fromiter(
+            (old_side[a] != new_side[b] for a, b in zip(i.tolist(), j.tolist())),
+            dtype=bool, count=len(i),
+        )
+        flags = (
+            ("renamed", np.full(len(i), by_position)),
+            ("moved", moved),
+            ("side", side_changed),
+            ("net", net_changed),
+        )
+        for change, mask in flags:
+            for k in np.flatnonzero(mask).tolist():
+                a, b = int(i[k]), int(j[k])
+                records.append((
+                    change, _name(old, a), _name(new, b), old_net[a], new_net[b], new_side[b],
+                    float(old.x[a]), float(old.y[a]), float(new.x[b]), float(new.y[b]),
+                    float(distance[k]),
+                ))
+
+    for b in np.flatnonzero(~found).tolist():
+        records.append((
+            "added", "", _name(new, b), "", new_net[b], new_side[b],
+            None, None, float(new.x[b]), float(new.y[b]), None,
+        ))
+    for a in np.flatnonzero(~old_matched).tolist():
+        records.append((
+            "removed", _name(old, a), "", old_net[a], "", old_side[a],
+            float(old.x[a]), float(old.y[a]), None, None, None,
+        ))
+    records.sort(key=lambda r: changes.index(r[0]))
+    diff = ReportDiff(records, matched, tolerance)
+    _log.debug("Report diff: %s", diff.summary())
+    return diff
+
+
+def load_report(path: Path, backend: str = "pcbnew", use_aux_origin: bool = True) -> TestPointTable:
+    """
+    Report of a board file, built with the given backend, or a report file
+    read back.
+    """
+    path = Path(path)
+    if path.suffix.lower() != ".kicad_pcb":
+        return read_report(path)
+    from batch import load_snapshot
+
+    return TestPointTable.from_snapshot(load_snapshot(path, backend), Settings(use_aux_origin))
+
+
+def cli(argv=None):
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(
+        prog="kicadtestpoints diff",
+        description="List the test points added, removed, moved or changed between two revisions",
+    )
+    parser.add_argument("old", help="Old board or report (.kicad_pcb, .csv, .jsonl, .tpb, ...)")
+    parser.add_argument("new", help="New board or report")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=default_tolerance,
+        help="Distance in mm a probe may move before it counts as moved",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("pcbnew", "file"),
+        default="pcbnew",
+        help="Load boards with pcbnew or read the .kicad_pcb file directly",
+    )
+    parser.add_argument(
+        "--absolute-origin",
+        action="store_true",
+        help="Reference boards to the absolute origin instead of the file/drill origin",
+    )
+    parser.add_argument(
+        "-o", "--output", action="append", help="Write the changes here, format by extension"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        old, new = (
+            load_report(p, args.backend, not args.absolute_origin) for p in (args.old, args.new)
+        )
+        diff = diff_reports(old, new, args.tolerance)
+    except (UserWarning, OSError) as e:
+        _log.error("%s", e)
+        return 2
+    for row in diff.rows():
+        print("%-8s %-16s %-16s %s" % (
+            row["change"], row["old probe"], row["new probe"],
+            f"{row['old net']} -> {row['new net']}" if row["change"] == "net"
+            else "" if row["distance"] is None else f"{row['distance']:.3f} mm",
+        ))
+    print(diff.summary())
+    if args.output:
+        diff.write(args.output)
+    return 0 if diff.fixture_reusable else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,158 @@
+"""
+report_job
+Report generation split into short steps.
+
+The dialog runs one step at a time from the wx event loop so pcbnew stays
+responsive and the run can be cancelled. Every step runs on the caller's
+thread, keeping all pcbnew access on the main thread.
+"""
+
+import logging
+import time
+from pathlib import Path
+
+from pad_snapshot import SnapshotBuilder, TEST_POINT_PROPERTY, concat
+from net_coverage import net_coverage
+from probe_order import ProbeOrderer
+from report_cache import ReportCache, cache_path
+from report_writers import MultiWriter, report_chunks
+from via_targets import via_snapshot
+
+_log = logging.getLogger("kicad_testpoints-pcm")
+
+
+class ReportJob:
+    """
+    Reads the test point pads, or the pads picked by a PadQuery, builds the
+    report and writes it to file_path and any extra outputs, format by
+    extension. With order_time set the rows are put in visiting order for a
+    flying probe tester first, spending up to that many seconds. With
+    ViaRules vias that qualify are reported with the pads. Call step()
+    until it returns True, checking stage, done and total for progress.
+    """
+
+    reading = "Reading pads"
+    building = "Building report"
+    ordering = "Ordering probes"
+    writing = "Writing report"
+    finished = "Done"
+    cancelled = "Cancelled"
+
+    def __init__(self, board, file_path: Path, settings, chunk_size: int = 500,
+                 outputs: list = (), query=None, order_time: float = None, vias=None):
+        self.file_path = Path(file_path)
+        self.outputs = [Path(p) for p in outputs]
+        self.settings = settings
+        self.chunk_size = chunk_size
+        self.order_time = order_time
+        self.query = query
+        self.vias = vias
+        if query is None:
+            self.builder = SnapshotBuilder(board, pad_property=TEST_POINT_PROPERTY)
+        else:
+            self.builder = SnapshotBuilder(board, query=query)
+        self.stage = self.reading
+        self.snapshot = None
+        self.cache = None
+        # TestPointTable once built
+        self.data = None
+        self.orderer = None
+        # ProbeOrder when ordered
+        self.order = None
+        self.writer = None
+        self.chunks = None
+        self.written = 0
+
+    @property
+    def done(self) -> int:
+        if self.stage == self.writing:
+            return self.written
+        if self.stage == self.ordering:
+            return self.orderer.done
+        return self.builder.done
+
+    @property
+    def total(self) -> int:
+        if self.stage in (self.writing, self.ordering):
+            return len(self.data)
+        return self.builder.total
+
+    @property
+    def running(self) -> bool:
+        return self.stage not in (self.finished, self.cancelled)
+
+    def cancel(self):
+        if self.running:
+            _log.debug("Report cancelled during: %s", self.stage)
+            if self.writer:
+                self.writer.close()
+            self.stage = self.cancelled
+
+    def step(self, budget: float = 0.05) -> bool:
+        """
+        Work for about budget seconds, at least one chunk. Returns True when
+        the job has stopped, either finished or cancelled.
+        """
+        end = time.perf_counter() + budget
+        while self.running:
+            if self.stage == self.reading:
+                if self.builder.step(self.chunk_size):
+                    self.snapshot = self.builder.snapshot()
+                    if self.vias is not None:
+                        self.add_vias()
+                    self.stage = self.building
+            elif self.stage == self.building:
+                self.cache = ReportCache.load(cache_path(self.file_path))
+                self.data = self.cache.build_table(self.snapshot, settings=self.settings)
+                if not len(self.data):
+                    self.stage = self.finished
+                elif self.order_time is not None:
+                    self.orderer = ProbeOrderer(self.data, self.order_time)
+                    self.stage = self.ordering
+                else:
+                    self.start_writing()
+            elif self.stage == self.ordering:
+                if self.orderer.step(max(end - time.perf_counter(), 0)):
+                    self.order = self.orderer.result()
+                    self.data = self.order.apply(self.data)
+                    self.start_writing()
+            elif self.stage == self.writing:
+                records = next(self.chunks, None)
+                if records is not None:
+                    self.writer.write(records)
+                    self.written += len(records)
+                else:
+                    self.writer.close()
+                    try:
+                        self.cache.save()
+                    except OSError as e:
+                        _log.warning("Could not save report cache: %s", e)
+                    self.stage = self.finished
+            if time.perf_counter() >= end:
+                break
+        return not self.running
+
+    def add_vias(self):
+        vias = via_snapshot(self.builder.board, self.vias)
+        # Vias are test points named VIA to the pad filter
+        if self.query is not None:
+            vias = self.query.select(vias)
+        self.snapshot = concat([self.snapshot, vias])
+
+    def start_writing(self):
+        self.writer = MultiWriter([self.file_path, *self.outputs]).open()
+        self.chunks = report_chunks(self.data, self.chunk_size)
+        self.stage = self.writing
+
+    def net_coverage(self):
+        """
+        NetCoverage of the board by the report once the job is finished.
+        """
+        return net_coverage(self.snapshot, self.data)
+
+    def coverage(self) -> tuple[int, int]:
+        """
+        (covered nets, total nets) once the job is finished.
+        """
+        coverage = self.net_coverage()
+        return coverage.covered, coverage.total
@@ -0,0 +1,385 @@
+"""
+report_reader
+Read columns of existing report files without loading the whole report.
+
+The file is memory mapped. CSV reports get an index of where every row
+starts, found with one numpy pass over the newlines outside quotes and saved
+next to the report as <report>.index.npz, so opening it again costs a stat
+and a small load. Packed (.tpb) reports need no index: their blocks are
+located from the block headers and float columns are read straight from the
+map.
+
+Only the columns asked for are parsed. x and y become float arrays, the rest
+categorical codes with their distinct values. Filters by side, net or ref
+des parse their one column, and the other columns are then read only for the
+matching rows:
+
+    with ReportReader("panel-testpoints.csv") as report:
+        rows = report.where(side="TOP", net="GND")
+        df = report.to_pandas(rows)
+"""
+
+import csv
+import fnmatch
+import io
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from report_writers import PackedWriter
+from testpoint_table import TestPointTable, _factorize
+
+_log = logging.getLogger("kicad_testpoints")
+
+float_columns = ("x", "y")
+
+# Rows parsed at a time when reading a whole CSV column
+chunk_rows = 65536
+
+# Bumped when the layout of the index changes
+_index_format = 1
+
+
+def index_path(path: Path) -> Path:
+    """
+    The row index lives next to the report it is for.
+    """
+    path = Path(path)
+    return path.with_name(path.name + ".index.npz")
+
+
+def _row_offsets(buf) -> np.ndarray:
+    """
+    Start of every line outside quoted fields, then the end of the file.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord("\n"))
+    quotes = np.flatnonzero(data == ord('"'))
+    if len(quotes):
+        # Escaped quotes come in pairs so parity still tells inside from outside
+        newlines = newlines[np.searchsorted(quotes, newlines) % 2 == 0]
+    size = len(data)
+    del data
+    offsets = np.concatenate(([0], newlines + 1)).astype(np.int64)
+    if offsets[-1] != size:
+        offsets = np.append(offsets, size)
+    return offsets
+
+
+def _matches(categories: list, values) -> np.ndarray:
+    """
+    Codes of the categories equal to one of values, or matching it as a glob.
+    """
+    if isinstance(values, str):
+        values = [values]
+    values = [str(v) for v in values]
+    patterns = [v for v in values if any(c in v for c in "*?[")]
+    exact = set(values)
+    return np.array([
+        i for i, c in enumerate(categories)
+        if c in exact or any(fnmatch.fnmatchcase(c, p) for p in patterns)
+    ], dtype=np.int32)
+
+
+def _runs(rows: np.ndarray):
+    """
+    (first, last + 1) of each run of consecutive row numbers.
+    """
+    if not len(rows):
+        return
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(rows)]))
+    for s, e in zip(rows[starts].tolist(), (rows[ends - 1] + 1).tolist()):
+        yield s, e
+
+
+class _CsvSource:
+    def __init__(self, path: Path, buf, cache_index: bool):
+        self.path = path
+        self.buf = buf
+        self.offsets = self._load_index(cache_index)
+        header = bytes(buf[self.offsets[0]:self.offsets[1]]).decode("utf-8-sig")
+        self.columns = tuple(next(csv.reader([header]), []))
+        # Blank trailing lines aren't rows
+        count = len(self.offsets) - 2
+        while count > 0 and not bytes(
+            buf[self.offsets[count]:self.offsets[count + 1]]
+        ).strip():
+            count -= 1
+        self.rows = max(count, 0)
+
+    def _load_index(self, cache_index: bool) -> np.ndarray:
+        stat = os.stat(self.path)
+        signature = np.array([_index_format, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        cached = index_path(self.path)
+        if cache_index and cached.exists():
+            try:
+                with np.load(cached) as index:
+                    if np.array_equal(index["signature"], signature):
+                        return index["offsets"]
+            except (OSError, ValueError, KeyError) as e:
+                _log.debug("Ignoring row index %s: %s", cached, e)
+        offsets = _row_offsets(self.buf) if len(self.buf) else np.zeros(2, dtype=np.int64)
+        if cache_index:
+            try:
+                with cached.open("wb") as f:
+                    np.savez(f, signature=signature, offsets=offsets)
+            except OSError as e:
+                _log.warning("Could not save row index: %s", e)
+        return offsets
+
+    def _values(self, position: int, first: int, last: int) -> list:
+        """
+        Values of one column for rows first to last, counted from the row
+        after the header.
+        """
+        text = bytes(self.buf[self.offsets[first + 1]:self.offsets[last + 1]]).decode("utf-8")
+        return [
+            row[position] if len(row) > position else ""
+            for row in csv.reader(io.StringIO(text, newline=""))
+            if row
+        ]
+
+    def values(self, name: str, rows: np.ndarray = None) -> list:
+        position = self.columns.index(name)
+        if rows is None:
+            runs = ((s, min(s + chunk_rows, self.rows)) for s in range(0, self.rows, chunk_rows))
+        else:
+            runs = _runs(rows)
+        values = []
+        for first, last in runs:
+            values.extend(self._values(position, first, last))
+        return values
+
+    def floats(self, name: str, rows: np.ndarray = None) -> np.ndarray:
+        values = self.values(name, rows)
+        return np.fromiter((float(v) if v else np.nan for v in values), dtype=np.float64,
+                           count=len(values))
+
+    def codes(self, name: str, rows: np.ndarray = None) -> tuple[np.ndarray, list]:
+        return _factorize(self.values(name, rows))
+
+
+class _PackedSource:
+    def __init__(self, path: Path, buf):
+        self.path = path
+        self.buf = buf
+        if bytes(buf[:4]) != PackedWriter.magic:
+            msg = f"{path} is not a packed test point report"
+            raise UserWarning(msg)
+        version, count = struct.unpack_from("<HH", buf, 4)
+        if version != PackedWriter.version:
+            msg = f"Unsupported packed report version {version}"
+            raise UserWarning(msg)
+        offset = 8
+        columns, kinds = [], []
+        for _ in range(count):
+            kind, length = struct.unpack_from("<BH", buf, offset)
+            offset += 3
+            columns.append(bytes(buf[offset:offset + length]).decode())
+            kinds.append(kind)
+            offset += length
+        self.columns = tuple(columns)
+        self.kinds = kinds
+        # Per column: (offset, rows) of each block's values or codes
+        self.blocks = [[] for _ in columns]
+        self.dictionaries = [[] for _ in columns]
+        self.rows = 0
+        while offset < len(buf):
+            (rows,) = struct.unpack_from("<I", buf, offset)
+            offset += 4
+            for i, kind in enumerate(kinds):
+                if kind:
+                    (new,) = struct.unpack_from("<I", buf, offset)
+                    offset += 4
+                    for _ in range(new):
+                        (length,) = struct.unpack_from("<I", buf, offset)
+                        offset += 4
+                        self.dictionaries[i].append(bytes(buf[offset:offset + length]).decode())
+                        offset += length
+                self.blocks[i].append((offset, rows))
+                offset += rows * (4 if kind else 8)
+            self.rows += rows
+
+    def _array(self, name: str, dtype: str) -> np.ndarray:
+        i = self.columns.index(name)
+        parts = [
+            np.frombuffer(self.buf, dtype=dtype, count=rows, offset=offset)
+            for offset, rows in self.blocks[i]
+        ]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    def floats(self, name: str, rows: np.ndarray = None) -> np.ndarray:
+        values = self._array(name, "<f8")
+        return values.astype(np.float64) if rows is None else values[rows].astype(np.float64)
+
+    def codes(self, name: str, rows: np.ndarray = None) -> tuple[np.ndarray, list]:
+        codes = self._array(name, "<i4")
+        codes = codes.astype(np.int32) if rows is None else codes[rows].astype(np.int32)
+        return codes, self.dictionaries[self.columns.index(name)]
+
+    def values(self, name: str, rows: np.ndarray = None) -> list:
+        codes, categories = self.codes(name, rows)
+        return [categories[c] for c in codes.tolist()]
+
+
+class ReportReader:
+    """
+    Memory mapped report file, CSV or packed. Columns are parsed on first
+    use and kept; rows are numbered from 0 after the header. cache_index
+    saves the CSV row index next to the file.
+    """
+
+    def __init__(self, path: Path, cache_index: bool = True):
+        self.path = Path(path)
+        self._file = self.path.open("rb")
+        self._buf = b""
+        self._cache = {}
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            extension = self.path.suffix.lower()
+            if extension == PackedWriter.extension:
+                self._source = _PackedSource(self.path, self._buf)
+            elif extension == ".csv":
+                self._source = _CsvSource(self.path, self._buf, cache_index)
+            else:
+                msg = f"Can't map {self.path.suffix!r} reports, use .csv or {PackedWriter.extension}"
+                raise UserWarning(msg)
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self._source.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        # Views into the map keep it open, so drop them first
+        self._cache = {}
+        self._source = None
+        if isinstance(self._buf, mmap.mmap):
+            try:
+                self._buf.close()
+            except BufferError:
+                # Arrays handed out still point into the map, it closes with them
+                pass
+        self._file.close()
+
+    @property
+    def columns(self) -> tuple:
+        return self._source.columns
+
+    def _check(self, name: str):
+        if name not in self.columns:
+            msg = f"{self.path} has no {name!r} column"
+            raise UserWarning(msg)
+
+    def floats(self, name: str, rows=None) -> np.ndarray:
+        """
+        A numeric column as float64, for all rows or the ones given.
+        """
+        self._check(name)
+        if rows is None:
+            key = ("floats", name)
+            if key not in self._cache:
+                self._cache[key] = self._source.floats(name)
+            return self._cache[key]
+        if ("floats", name) in self._cache:
+            return self._cache[("floats", name)][np.asarray(rows, dtype=np.intp)]
+        return self._source.floats(name, np.asarray(rows, dtype=np.intp))
+
+    def codes(self, name: str, rows=None) -> tuple[np.ndarray, list]:
+        """
+        A text column as (int32 codes, distinct values).
+        """
+        self._check(name)
+        if rows is None:
+            key = ("codes", name)
+            if key not in self._cache:
+                self._cache[key] = self._source.codes(name)
+            return self._cache[key]
+        if ("codes", name) in self._cache:
+            codes, categories = self._cache[("codes", name)]
+            return codes[np.asarray(rows, dtype=np.intp)], categories
+        return self._source.codes(name, np.asarray(rows, dtype=np.intp))
+
+    def column(self, name: str, rows=None):
+        """
+        Decoded values: a float array for x and y, a list of strings otherwise.
+        """
+        if name in float_columns:
+            return self.floats(name, rows)
+        codes, categories = self.codes(name, rows)
+        return [categories[c] for c in codes.tolist()]
+
+    def where(self, side=None, net=None, ref_des=None) -> np.ndarray:
+        """
+        Rows matching every filter given. Each filter is a value or a list of
+        values, which may be globs like "TP*". Only the filtered columns are
+        parsed.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, values in (("side", side), ("net", net), ("source ref des", ref_des)):
+            if values is None:
+                continue
+            codes, categories = self.codes(name)
+            mask &= np.isin(codes, _matches(categories, values))
+        return np.flatnonzero(mask)
+
+    def table(self, rows=None, columns: tuple = None) -> TestPointTable:
+        """
+        TestPointTable of the rows, all by default. Only the columns given
+        are read, the others are left empty.
+        """
+        count = len(self) if rows is None else len(rows)
+        wanted = [c for c in (columns or TestPointTable.columns) if c in self.columns]
+        values = {c: self.column(c, rows) for c in wanted}
+        codes, categories = {}, {}
+        for name in TestPointTable.categorical:
+            if name in values:
+                codes[name], categories[name] = _factorize(values[name])
+            else:
+                codes[name], categories[name] = np.zeros(count, dtype=np.int32), [""]
+        return TestPointTable(
+            ref_des=list(values.get("source ref des", [""] * count)),
+            pad_number=list(values.get("source pad", [""] * count)),
+            x=values.get("x", np.zeros(count)),
+            y=values.get("y", np.zeros(count)),
+            codes=codes,
+            categories=categories,
+        )
+
+    def to_pandas(self, rows=None, columns: tuple = None):
+        """
+        DataFrame of the rows and columns, all by default, with float x and y
+        and categorical text columns.
+        """
+        import pandas as pd
+
+        data = {}
+        for name in columns or self.columns:
+            self._check(name)
+            if name in float_columns:
+                data[name] = self.floats(name, rows)
+            else:
+                codes, categories = self.codes(name, rows)
+                data[name] = pd.Categorical.from_codes(
+                    codes, categories=pd.Index(categories, dtype=object))
+        return pd.DataFrame(data, copy=False)
+
+
+def open_report(path: Path, cache_index: bool = True) -> ReportReader:
+    return ReportReader(path, cache_index)
@@ -0,0 +1,458 @@
+"""
+report_server
+Long running report service for tools that would otherwise run the command
+line once per request.
+
+Boards are loaded once and kept in a least recently used cache keyed by path
+and content hash, so an edited board is loaded again while repeated requests
+for the same revision are answered from memory. Reports, coverage and probe
+indexes are built on first use and kept with the board; the cache evicts the
+oldest boards once their estimated size passes the memory limit.
+
+Requests are plain HTTP GETs answered with JSON, served on localhost only or
+a Unix socket, one thread per request. Any local board can be named unless
+the service is given a root directory:
+
+    /report?board=PATH[&origin=absolute][&format=csv]
+    /coverage?board=PATH
+    /distance?board=PATH&probe=TP1-1     distances from one probe
+    /distance?board=PATH&k=1             nearest probes of every probe
+    /distance?board=PATH&pitch=2.54      probe pairs closer than pitch
+    /stats
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from batch import load_snapshot
+from net_coverage import net_coverage
+from pad_snapshot import PadSnapshot, Settings
+from probe_spacing import ProbeIndex
+from testpoint_table import TestPointTable
+
+_log = logging.getLogger("kicad_testpoints-pcm")
+
+# Default memory limit of the board cache
+max_cache_mb = 512
+
+# Rough python overhead of one string in a list, on top of its characters
+_string_overhead = 57
+
+
+def _size_of(value) -> int:
+    """
+    Estimated memory held by a cached value, in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value) + _string_overhead
+    if isinstance(value, list):
+        return 8 * len(value) + sum(_size_of(v) for v in value[:100]) * len(value) // max(
+            min(len(value), 100), 1)
+    if isinstance(value, dict):
+        return sum(_size_of(v) for v in value.values())
+    if isinstance(value, PadSnapshot):
+        return sum(_size_of(getattr(value, name)) for name in (
+            "ref_des", "pad_number", "net", "net_class", "has_hole", "bottom",
+            "footprint_bottom", "pad_property", "center", "size", "nets"))
+    if isinstance(value, TestPointTable):
+        return (_size_of(value.ref_des) + _size_of(value.pad_number) + value.x.nbytes
+                + value.y.nbytes + _size_of(value.codes) + _size_of(value.categories))
+    if isinstance(value, ProbeIndex):
+        return value.xy.nbytes * 3 + _size_of(value.names)
+    return 0
+
+
+class BoardEntry:
+    """
+    A loaded board and everything built from it so far.
+    """
+
+    def __init__(self, path: Path, digest: str, snapshot: PadSnapshot, load_time: float):
+        self.path = path
+        self.digest = digest
+        self.snapshot = snapshot
+        self.load_time = load_time
+        self.derived = {}
+        # Reentrant, values are built from other cached values
+        self.lock = threading.RLock()
+        self.size = _size_of(snapshot)
+
+    def get(self, key: tuple, build):
+        """
+        Value built once by build() and kept under key. Returns (value, added
+        bytes).
+        """
+        with self.lock:
+            if key in self.derived:
+                return self.derived[key], 0
+            value = build()
+            self.derived[key] = value
+            added = _size_of(value)
+            self.size += added
+            return value, added
+
+    def table(self, use_aux_origin: bool) -> TestPointTable:
+        table, _ = self.get(
+            ("table", use_aux_origin),
+            lambda: TestPointTable.from_snapshot(self.snapshot, Settings(use_aux_origin)),
+        )
+        return table
+
+
+class BoardCache:
+    """
+    Boards by (path, content hash), least recently used first out once the
+    estimated size passes max_bytes. The most recent board is always kept.
+    """
+
+    def __init__(self, backend: str = "pcbnew", max_bytes: int = max_cache_mb * 2**20,
+                 loader=load_snapshot):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Key -> lock held while that board loads, so it is only loaded once
+        self._loading = {}
+        # pcbnew isn't thread safe, boards load one at a time
+        self._load_lock = threading.Lock()
+        # Path -> (mtime, size, digest), hashing only changed files
+        self._digests = {}
+
+    def digest(self, path: Path) -> str:
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        known = self._digests.get(path)
+        if known and known[0] == signature:
+            return known[1]
+        h = hashlib.blake2b(digest_size=16)
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self._digests[path] = (signature, digest)
+        return digest
+
+    def get(self, board_path) -> BoardEntry:
+        path = Path(board_path).resolve()
+        if not path.is_file():
+            msg = f"Board {board_path} not found"
+            raise FileNotFoundError(msg)
+        key = (str(path), self.digest(path))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        try:
+            with loading:
+                with self._lock:
+                    entry = self.entries.get(key)
+                    if entry is not None:
+                        self.hits += 1
+                        return entry
+                with self._load_lock:
+                    start = time.perf_counter()
+                    snapshot = self.loader(path, self.backend)
+                    load_time = time.perf_counter() - start
+                entry = BoardEntry(path, key[1], snapshot, load_time)
+                _log.info("Loaded %s in %.2f s, %d test points", path, load_time, len(snapshot))
+                with self._lock:
+                    # Drop older revisions of the same board
+                    for old in [k for k in self.entries if k[0] == key[0]]:
+                        self._evict(old)
+                    self.entries[key] = entry
+                    self.size += entry.size
+                    self.loads += 1
+                    self.shrink()
+        finally:
+            # Also when the load failed, so failed paths don't pile up
+            with self._lock:
+                self._loading.pop(key, None)
+        return entry
+
+    def grew(self, added: int):
+        """
+        Account for values built on an entry after it was cached.
+        """
+        if added:
+            with self._lock:
+                self.size += added
+                self.shrink()
+
+    def _evict(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        self.evictions += 1
+        _log.debug("Evicted %s", entry.path)
+
+    def shrink(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self._evict(next(iter(self.entries)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "boards": [
+                    {"path": e.path.as_posix(), "hash": e.digest, "size mb": e.size / 2**20,
+                     "load time": e.load_time}
+                    for e in self.entries.values()
+                ],
+                "size mb": self.size / 2**20,
+                "max mb": self.max_bytes / 2**20,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+def _csv_bytes(table: TestPointTable) -> bytes:
+    out = io.StringIO(newline="")
+    writer = csv.writer(out)
+    writer.writerow(table.columns)
+    writer.writerows(table.records())
+    return out.getvalue().encode()
+
+
+class ReportService:
+    """
+    Answers queries from the board cache. Each method returns (content type,
+    body bytes). With a root only boards under it are served.
+    """
+
+    def __init__(self, cache: BoardCache, root: Path = None):
+        self.cache = cache
+        self.root = None if root is None else Path(root).resolve()
+
+    def _cached(self, entry: BoardEntry, key: tuple, build):
+        value, added = entry.get(key, build)
+        self.cache.grew(added)
+        return value
+
+    def report(self, entry: BoardEntry, use_aux_origin: bool = True, format: str = "json"):
+        if format not in ("json", "csv"):
+            msg = f"Unknown format {format}, use json or csv"
+            raise UserWarning(msg)
+
+        def build():
+            table = entry.table(use_aux_origin)
+            if format == "csv":
+                return _csv_bytes(table)
+            return json.dumps({
+                "board": entry.path.as_posix(),
+                "hash": entry.digest,
+                "rows": list(table.rows()),
+            }).encode()
+
+        body = self._cached(entry, ("report", use_aux_origin, format), build)
+        return ("text/csv" if format == "csv" else "application/json"), body
+
+    def coverage(self, entry: BoardEntry, use_aux_origin: bool = True):
+        def build():
+            coverage = net_coverage(entry.snapshot, entry.table(use_aux_origin))
+            return json.dumps({
+                "board": entry.path.as_posix(),
+                "hash": entry.digest,
+                "nets": coverage.total,
+                "covered": coverage.covered,
+                "uncovered": coverage.uncovered(),
+                "by class": coverage.by_class(),
+                "by kind": coverage.by_kind(),
+                "probed more than once": coverage.multiply_probed(),
+            }).encode()
+
+        return "application/json", self._cached(entry, ("coverage", use_aux_origin), build)
+
+    def distance(self, entry: BoardEntry, use_aux_origin: bool = True, probe: str = None,
+                 k: int = None, pitch: float = None):
+        index = self._cached(
+            entry, ("index", use_aux_origin), lambda: ProbeIndex(entry.table(use_aux_origin))
+        )
+        result = {"board": entry.path.as_posix(), "hash": entry.digest}
+        if probe is not None:
+            distances = index.distances_from(probe)
+            result["distances"] = dict(zip(index.names, distances.tolist()))
+        elif pitch is not None:
+            a, b, dist = index.pairs_within(pitch)
+            result["pairs"] = [
+                {"probe": index.names[i], "neighbor": index.names[j], "distance": d}
+                for i, j, d in zip(a.tolist(), b.tolist(), dist.tolist())
+            ]
+        else:
+            indices, distances = index.nearest(k or 1)
+            result["nearest"] = {
+                name: [
+                    {"neighbor": index.names[j], "distance": d}
+                    for j, d in zip(row, drow) if j >= 0
+                ]
+                for name, row, drow in zip(index.names, indices.tolist(), distances.tolist())
+            }
+        return "application/json", json.dumps(result).encode()
+
+    def handle(self, path: str, params: dict):
+        """
+        Dispatch a request path with its query parameters.
+        """
+        if path == "/stats":
+            return "application/json", json.dumps(self.cache.stats()).encode()
+        if path not in ("/report", "/coverage", "/distance"):
+            raise LookupError(path)
+        board = params.get("board")
+        if not board:
+            msg = "Missing board parameter"
+            raise UserWarning(msg)
+        if self.root is not None and not Path(board).resolve().is_relative_to(self.root):
+            msg = f"Board {board} is outside {self.root}"
+            raise PermissionError(msg)
+        entry = self.cache.get(board)
+        use_aux_origin = params.get("origin", "aux") != "absolute"
+        if path == "/report":
+            return self.report(entry, use_aux_origin, params.get("format", "json"))
+        if path == "/coverage":
+            return self.coverage(entry, use_aux_origin)
+        try:
+            k = int(params["k"]) if "k" in params else None
+            pitch = float(params["pitch"]) if "pitch" in params else None
+        except ValueError as e:
+            raise UserWarning(str(e)) from None
+        return self.distance(entry, use_aux_origin, params.get("probe"), k, pitch)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        start = time.perf_counter()
+        try:
+            content_type, body = self.service.handle(url.path, params)
+            status = 200
+        except LookupError:
+            content_type, body, status = "application/json", b'{"error": "Not found"}', 404
+        except FileNotFoundError as e:
+            content_type, body, status = "application/json", json.dumps({"error": str(e)}).encode(), 404
+        except PermissionError as e:
+            content_type, body, status = "application/json", json.dumps({"error": str(e)}).encode(), 403
+        except UserWarning as e:
+            content_type, body, status = "application/json", json.dumps({"error": str(e)}).encode(), 400
+        except Exception as e:
+            _log.exception("Request failed: %s", self.path)
+            content_type = "application/json"
+            body = json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+            status = 500
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        _log.debug("%s %d %.1f ms", self.path, status, (time.perf_counter() - start) * 1000)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        _log.debug(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def make_server(service: ReportService, port: int = 8765, socket_path: Path = None):
+    """
+    Threaded HTTP server on localhost, or on a Unix socket when socket_path
+    is given.
+    """
+    handler = type("Handler", (RequestHandler,), {"service": service})
+    if socket_path is not None:
+        socket_path = Path(socket_path)
+        if socket_path.exists():
+            socket_path.unlink()
+        return UnixHTTPServer(str(socket_path), handler)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def cli(argv=None):
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(
+        prog="kicadtestpoints serve",
+        description="Serve reports, coverage and probe distances, keeping boards loaded",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765,
+        help="Port to listen on, bound to 127.0.0.1 only so other machines can't connect",
+    )
+    parser.add_argument("--socket", metavar="PATH", help="Listen on this Unix socket instead")
+    parser.add_argument(
+        "--backend",
+        choices=("pcbnew", "file"),
+        default="pcbnew",
+        help="Load boards with pcbnew or read the .kicad_pcb file directly",
+    )
+    parser.add_argument(
+        "--root", metavar="DIR", help="Only serve boards under this directory, any local path otherwise"
+    )
+    parser.add_argument(
+        "--cache-mb", type=float, default=max_cache_mb, help="Memory kept for loaded boards"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        _log.setLevel(logging.DEBUG)
+    else:
+        _log.setLevel(logging.INFO)
+
+    if args.backend == "pcbnew":
+        # Paid once instead of on every request
+        import pcbnew  # noqa: F401
+
+    cache = BoardCache(args.backend, int(args.cache_mb * 2**20))
+    server = make_server(ReportService(cache, args.root), args.port, args.socket)
+    where = args.socket or "http://127.0.0.1:%d" % args.port
+    print(f"Serving test point reports on {where}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,416 @@
+"""
+report_writers
+Streaming report output in several formats.
+
+A writer is opened with the report columns, fed chunks of records (tuples in
+column order) as they are produced and closed at the end. write_report feeds
+the same chunks to any number of writers so one pass over a report can write
+every format. The format is picked from the file extension:
+
+    .csv      same layout as write_csv
+    .jsonl    one JSON object per row
+    .tpb      packed binary, see PackedWriter, no extra dependencies
+    .parquet  Parquet, needs pyarrow
+    .arrow    Arrow IPC file, needs pyarrow
+"""
+
+import csv
+import json
+import logging
+import struct
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+
+from stage_trace import stage
+from testpoint_table import TestPointTable
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+_log = logging.getLogger("kicad_testpoints")
+
+# Rows handed to the writers at a time
+chunk_size = 4096
+
+
+class ReportWriter(ABC):
+    """
+    Base writer. Subclasses implement write, and open and close when they
+    hold a file.
+    """
+
+    extension = None
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.columns = None
+        self.rows = 0
+
+    def open(self, columns: tuple):
+        self.columns = tuple(columns)
+
+    @abstractmethod
+    def write(self, records: list):
+        """
+        Write a chunk of records, tuples in column order.
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class CsvWriter(ReportWriter):
+    extension = ".csv"
+
+    def open(self, columns):
+        super().open(columns)
+        self.file = self.path.open("w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+
+    def write(self, records):
+        self.writer.writerows(records)
+        self.rows += len(records)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesWriter(ReportWriter):
+    extension = ".jsonl"
+
+    def open(self, columns):
+        super().open(columns)
+        self.file = self.path.open("w")
+
+    def write(self, records):
+        columns = self.columns
+        self.file.writelines(json.dumps(dict(zip(columns, r))) + "\n" for r in records)
+        self.rows += len(records)
+
+    def close(self):
+        self.file.close()
+
+
+class PackedWriter(ReportWriter):
+    """
+    Dependency free columnar binary format, little endian throughout.
+
+    Header: magic b"KTPB", u16 version, u16 column count, then per column a
+    u8 kind (0 float64, 1 string) and a u16 length prefixed UTF-8 name.
+
+    Then blocks until the end of the file: u32 row count, then per column
+    either row count float64 values or the block's new dictionary entries
+    (u32 count, each a u32 length prefixed UTF-8 string) followed by row count
+    int32 codes into the dictionary built up over all blocks so far.
+    """
+
+    extension = ".tpb"
+    magic = b"KTPB"
+    version = 1
+    float_columns = ("x", "y")
+
+    def open(self, columns):
+        super().open(columns)
+        self.file = self.path.open("wb")
+        self.dictionaries = [None if c in self.float_columns else {} for c in self.columns]
+        header = [self.magic, struct.pack("<HH", self.version, len(self.columns))]
+        for column, dictionary in zip(self.columns, self.dictionaries):
+            name = column.encode()
+            header.append(struct.pack("<BH", dictionary is not None, len(name)) + name)
+        self.file.write(b"".join(header))
+
+    def write(self, records):
+        if not records:
+            return
+        block = [struct.pack("<I", len(records))]
+        for values, dictionary in zip(zip(*records), self.dictionaries):
+            if dictionary is None:
+                block.append(np.asarray(values, dtype="<f8").tobytes())
+                continue
+            known = len(dictionary)
+            codes = np.fromiter(
+                (dictionary.setdefault(v, len(dictionary)) for v in values),
+                dtype="<i4",
+                count=len(values),
+            )
+            new = list(dictionary)[known:]
+            block.append(struct.pack("<I", len(new)))
+            for value in new:
+                data = str(value).encode()
+                block.append(struct.pack("<I", len(data)) + data)
+            block.append(codes.tobytes())
+        self.file.write(b"".join(block))
+        self.rows += len(records)
+
+    def close(self):
+        self.file.close()
+
+
+def read_packed(path: Path) -> TestPointTable:
+    """
+    Read a whole .tpb file back into a table.
+    """
+    data = Path(path).read_bytes()
+    if data[:4] != PackedWriter.magic:
+        msg = f"{path} is not a packed test point report"
+        raise UserWarning(msg)
+    version, count = struct.unpack_from("<HH", data, 4)
+    if version != PackedWriter.version:
+        msg = f"Unsupported packed report version {version}"
+        raise UserWarning(msg)
+    offset = 8
+    columns, kinds = [], []
+    for _ in range(count):
+        kind, length = struct.unpack_from("<BH", data, offset)
+        offset += 3
+        columns.append(data[offset:offset + length].decode())
+        kinds.append(kind)
+        offset += length
+
+    dictionaries = [[] for _ in columns]
+    parts = [[] for _ in columns]
+    while offset < len(data):
+        (rows,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        for i, kind in enumerate(kinds):
+            if not kind:
+                parts[i].append(np.frombuffer(data, dtype="<f8", count=rows, offset=offset))
+                offset += rows * 8
+                continue
+            (new,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            for _ in range(new):
+                (length,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                dictionaries[i].append(data[offset:offset + length].decode())
+                offset += length
+            parts[i].append(np.frombuffer(data, dtype="<i4", count=rows, offset=offset))
+            offset += rows * 4
+
+    values = {}
+    for column, kind, dictionary, chunks in zip(columns, kinds, dictionaries, parts):
+        array = np.concatenate(chunks) if chunks else np.zeros(0, dtype="<f8" if not kind else "<i4")
+        values[column] = array.tolist() if not kind else [dictionary[c] for c in array.tolist()]
+    return TestPointTable.from_records(list(zip(*(values[c] for c in TestPointTable.columns))))
+
+
+def _table_from_columns(values: dict, path: Path) -> TestPointTable:
+    """
+    Table from decoded columns. Columns missing from reports of older
+    versions are left empty.
+    """
+    count = len(next(iter(values.values()), ()))
+    for name in ("source ref des", "source pad", "x", "y"):
+        if name not in values:
+            msg = f"{path} has no {name!r} column"
+            raise UserWarning(msg)
+    columns = [values.get(c, [""] * count) for c in TestPointTable.columns]
+    try:
+        return TestPointTable.from_records(list(zip(*columns)))
+    except ValueError as e:
+        msg = f"{path}: {e}"
+        raise UserWarning(msg) from None
+
+
+def read_report(path: Path) -> TestPointTable:
+    """
+    Read a report written in any of the formats back into a table.
+    """
+    path = Path(path)
+    extension = path.suffix.lower()
+    if extension == PackedWriter.extension:
+        return read_packed(path)
+    if extension in (ParquetWriter.extension, ArrowWriter.extension):
+        if pyarrow is None:
+            msg = f"pyarrow is needed to read {extension} files"
+            raise UserWarning(msg)
+        if extension == ParquetWriter.extension:
+            import pyarrow.parquet
+
+            values = pyarrow.parquet.read_table(str(path)).to_pydict()
+        else:
+            import pyarrow.ipc
+
+            with pyarrow.ipc.open_file(str(path)) as f:
+                values = f.read_all().to_pydict()
+        return _table_from_columns(values, path)
+    if extension == JsonLinesWriter.extension:
+        with path.open() as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        names = dict.fromkeys(c for row in rows for c in row)
+        return _table_from_columns({c: [row.get(c, "") for row in rows] for c in names}, path)
+    if extension == CsvWriter.extension:
+        with path.open(newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = list(zip(*reader)) or [()] * len(header)
+        return _table_from_columns(dict(zip(header, columns)), path)
+    msg = f"Unknown report format {path.suffix!r}, use one of: {', '.join(writers)}"
+    raise UserWarning(msg)
+
+
+class _ArrowWriter(ReportWriter):
+    """
+    Writes one record batch per chunk. Parquet dictionary encodes the string
+    columns on its own.
+    """
+
+    float_columns = ("x", "y")
+
+    def open(self, columns):
+        if pyarrow is None:
+            msg = f"pyarrow is needed to write {self.extension} files"
+            raise UserWarning(msg)
+        super().open(columns)
+        self.schema = pyarrow.schema([
+            (c, pyarrow.float64() if c in self.float_columns else pyarrow.string())
+            for c in self.columns
+        ])
+        self.writer = self.make_writer()
+
+    def write(self, records):
+        if not records:
+            return
+        arrays = [
+            pyarrow.array(values, type=field.type) if column in self.float_columns
+            else pyarrow.array([str(v) for v in values], type=field.type)
+            for column, field, values in zip(self.columns, self.schema, zip(*records))
+        ]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows += len(records)
+
+    @abstractmethod
+    def make_writer(self):
+        """
+        pyarrow writer for the file, given self.schema.
+        """
+
+    def close(self):
+        self.writer.close()
+
+
+class ParquetWriter(_ArrowWriter):
+    extension = ".parquet"
+
+    def make_writer(self):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(str(self.path), self.schema)
+
+
+class ArrowWriter(_ArrowWriter):
+    extension = ".arrow"
+
+    def make_writer(self):
+        import pyarrow.ipc
+
+        return pyarrow.ipc.new_file(str(self.path), self.schema)
+
+
+writers = {
+    w.extension: w
+    for w in (CsvWriter, JsonLinesWriter, PackedWriter, ParquetWriter, ArrowWriter)
+}
+
+
+def available_formats() -> list[str]:
+    """
+    Extensions that can be written with the installed packages.
+    """
+    return [
+        ext for ext, w in writers.items()
+        if pyarrow is not None or not issubclass(w, _ArrowWriter)
+    ]
+
+
+def writer_for(path: Path) -> ReportWriter:
+    path = Path(path)
+    try:
+        return writers[path.suffix.lower()](path)
+    except KeyError:
+        msg = f"Unknown report format {path.suffix!r}, use one of: {', '.join(writers)}"
+        raise UserWarning(msg) from None
+
+
+def report_chunks(report, size: int = None):
+    """
+    Lists of records from a TestPointTable, a list of report dicts or an
+    iterable of either, size records at a time.
+    """
+    size = size or chunk_size
+    if isinstance(report, TestPointTable):
+        records = report.records()
+    else:
+        records = (
+            tuple(r[c] for c in TestPointTable.columns) if isinstance(r, dict) else tuple(r)
+            for r in report
+        )
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MultiWriter:
+    """
+    Writes the same records to several files at once.
+    """
+
+    def __init__(self, paths: list):
+        self.writers = [w if isinstance(w, ReportWriter) else writer_for(w) for w in paths]
+        self.rows = 0
+
+    def open(self, columns: tuple = TestPointTable.columns):
+        opened = []
+        try:
+            for writer in self.writers:
+                writer.open(columns)
+                opened.append(writer)
+        except Exception:
+            for writer in opened:
+                writer.close()
+            raise
+        return self
+
+    @stage("writing", lambda done, out, records: {"rows": len(records), "files": len(out.writers)})
+    def write(self, records: list):
+        for writer in self.writers:
+            writer.write(records)
+        self.rows += len(records)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    @property
+    def paths(self) -> list[Path]:
+        return [w.path for w in self.writers]
+
+
+def write_report(report, paths: list, size: int = None) -> list[Path]:
+    """
+    Stream a report to every path in one pass, format by extension.
+    """
+    out = MultiWriter(paths).open()
+    try:
+        for records in report_chunks(report, size):
+            out.write(records)
+    finally:
+        out.close()
+    _log.debug("Wrote %d rows to %s", out.rows, ", ".join(str(p) for p in out.paths))
+    return out.paths
@@ -0,0 +1,293 @@
+"""
+stage_trace
+Timing spans around the stages of report generation.
+
+Tracing is off unless enable() is called, and span() then only costs a
+global lookup. When on, every span records its duration, the pad and net
+counts the stage reports, the calls made into pcbnew objects wrapped with
+traced() and the peak memory allocated while it ran. Spans are exported in
+the Chrome trace event format, readable by chrome://tracing and Perfetto.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+_log = logging.getLogger("kicad_testpoints")
+
+_tracer = None
+
+# Results returned as they are instead of being wrapped by traced()
+_plain = (str, bytes, int, float, bool, type(None), dict)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.peak = 0
+
+    def set(self, **args):
+        """
+        Add counts known only once the stage has run.
+        """
+        self.args.update(args)
+
+    def __enter__(self):
+        tracer = self.tracer
+        if tracer.memory:
+            tracer.fold_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        tracer.stack.append(self)
+        self.calls_start = tracer.calls
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        end = time.perf_counter()
+        tracer = self.tracer
+        tracer.stack.pop()
+        args = dict(self.args)
+        if tracer.count_calls:
+            args["swig calls"] = tracer.calls - self.calls_start
+        if tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(self.peak, peak)
+            tracemalloc.reset_peak()
+            args["peak memory kb"] = round((peak - self.memory_start) / 1024, 1)
+            if tracer.stack:
+                parent = tracer.stack[-1]
+                parent.peak = max(parent.peak, peak)
+        tracer.events.append({
+            "name": self.name,
+            "cat": "stage",
+            "ph": "X",
+            "ts": round((self.start - tracer.origin) * 1e6, 1),
+            "dur": round((end - self.start) * 1e6, 1),
+            "pid": tracer.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+        return False
+
+
+class Tracer:
+    """
+    Collects spans as Chrome trace complete ("X") events.
+    """
+
+    def __init__(self, memory: bool = True, count_calls: bool = True):
+        self.memory = memory
+        self.count_calls = count_calls
+        self.events = []
+        self.stack = []
+        self.calls = 0
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        # Wall clock of the origin so traces from several processes line up
+        self.epoch = time.time()
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def fold_peak(self):
+        """
+        Hand the peak so far to the open span before the peak is reset.
+        """
+        if self.stack:
+            parent = self.stack[-1]
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def span(self, name: str, **args) -> Span:
+        return Span(self, name, args)
+
+    def shifted_events(self) -> list[dict]:
+        """
+        Events with timestamps from the wall clock, for merging traces.
+        """
+        offset = self.epoch * 1e6
+        return [{**e, "ts": round(e["ts"] + offset, 1)} for e in self.events]
+
+    def totals(self) -> dict:
+        """
+        Span name -> (count, total seconds).
+        """
+        totals = {}
+        for e in self.events:
+            count, seconds = totals.get(e["name"], (0, 0.0))
+            totals[e["name"]] = (count + 1, seconds + e["dur"] / 1e6)
+        return totals
+
+    def summary(self) -> str:
+        return "\n".join(
+            "%-20s %5d x %9.1f ms" % (name, count, seconds * 1000)
+            for name, (count, seconds) in self.totals().items()
+        )
+
+
+def enable(memory: bool = True, count_calls: bool = True) -> Tracer:
+    """
+    Start recording spans in this process. Memory tracking slows python
+    code down noticeably, so it can be left off.
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(memory, count_calls)
+    _tracer.start()
+    return _tracer
+
+
+def disable() -> Tracer:
+    """
+    Stop recording and return the tracer that was active, if any.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.stop()
+    return tracer
+
+
+def active() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **args):
+    """
+    Context manager timing a stage. args are counts to record with it; more
+    can be added with set() on the returned span.
+    """
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, **args)
+
+
+def stage(name: str, counts=None):
+    """
+    Decorator timing every call of a function as a span. counts(result,
+    *args) returns the counts to record with it, args being the positional
+    arguments of the call.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name) as s:
+                result = function(*args, **kwargs)
+                if counts is not None:
+                    s.set(**counts(result, *args))
+            return result
+        return wrapper
+    return decorate
+
+
+class _Counted:
+    """
+    Wraps a pcbnew object and counts every method called on it, and on the
+    objects those calls return.
+    """
+
+    __slots__ = ("_target", "_tracer")
+
+    def __init__(self, target, tracer: Tracer):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_tracer", tracer)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        tracer = self._tracer
+
+        def call(*args, **kwargs):
+            tracer.calls += 1
+            return _wrap(value(*args, **kwargs), tracer)
+
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __iter__(self):
+        return (_wrap(v, self._tracer) for v in self._target)
+
+    def __len__(self):
+        return len(self._target)
+
+    def __getitem__(self, key):
+        return _wrap(self._target[key], self._tracer)
+
+    def __eq__(self, other):
+        if isinstance(other, _Counted):
+            other = other._target
+        return self._target == other
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __bool__(self):
+        return bool(self._target)
+
+    def __repr__(self):
+        return repr(self._target)
+
+
+def _wrap(value, tracer: Tracer):
+    if isinstance(value, _plain):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(_wrap(v, tracer) for v in value)
+    return _Counted(value, tracer)
+
+
+def traced(board):
+    """
+    The board wrapped to count pcbnew calls when tracing with call counts,
+    otherwise the board itself.
+    """
+    if _tracer is None or not _tracer.count_calls or board is None:
+        return board
+    return _Counted(board, _tracer)
+
+
+def write_trace(path: Path, events: list = None) -> Path:
+    """
+    Save spans as a Chrome trace JSON file. events defaults to the active
+    tracer's; pass shifted_events() of several tracers to merge processes.
+    """
+    if events is None:
+        events = _tracer.events if _tracer is not None else []
+    path = Path(path)
+    path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+    _log.debug("Trace with %d spans saved to %s", len(events), path)
+    return path
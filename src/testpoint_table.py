@@ -0,0 +1,209 @@
+"""
+testpoint_table
+Columnar test point report.
+
+Positions are float arrays, the net, net class, side and pad type columns are
+categorical codes and the ref des and pad strings are interned. rows() yields
+the same dicts as build_test_point_report for code that still wants them.
+"""
+
+import sys
+
+import numpy as np
+
+from pad_snapshot import PadSnapshot, pad_positions, resolve_origin
+from stage_trace import stage
+
+sides = ("TOP", "BOTTOM")
+pad_types = ("SMT", "THRU")
+
+
+def _factorize(values) -> tuple[np.ndarray, list]:
+    """
+    Codes for each value and the list of distinct values in first seen order.
+    """
+    lookup = {}
+    codes = np.fromiter(
+        (lookup.setdefault(v, len(lookup)) for v in values), dtype=np.int32, count=len(values)
+    )
+    return codes, [sys.intern(str(v)) for v in lookup]
+
+
+class TestPointTable:
+    """
+    One entry per test point in each column.
+    """
+
+    __test__ = False
+
+    columns = (
+        "source ref des",
+        "source pad",
+        "net",
+        "net class",
+        "side",
+        "x",
+        "y",
+        "pad type",
+        "footprint side",
+    )
+    categorical = ("net", "net class", "side", "pad type", "footprint side")
+
+    def __init__(self, ref_des: list, pad_number: list, x: np.ndarray, y: np.ndarray,
+                 codes: dict, categories: dict):
+        self.ref_des = ref_des
+        self.pad_number = pad_number
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    @stage("report assembly", lambda t, *_: {"pads": len(t), "nets": len(t.categories["net"])})
+    def from_snapshot(cls, snapshot: PadSnapshot, settings) -> "TestPointTable":
+        origin = resolve_origin(snapshot, settings)
+        positions = pad_positions(snapshot.center, origin)
+        net_codes, nets = _factorize(snapshot.net)
+        class_codes, net_classes = _factorize(snapshot.net_class)
+        return cls(
+            ref_des=[sys.intern(str(v)) for v in snapshot.ref_des],
+            pad_number=[sys.intern(str(v)) for v in snapshot.pad_number],
+            x=positions[:, 0],
+            y=positions[:, 1],
+            codes={
+                "net": net_codes,
+                "net class": class_codes,
+                "side": snapshot.bottom.astype(np.int8),
+                "pad type": snapshot.has_hole.astype(np.int8),
+                "footprint side": snapshot.footprint_bottom.astype(np.int8),
+            },
+            categories={
+                "net": nets,
+                "net class": net_classes,
+                "side": list(sides),
+                "pad type": list(pad_types),
+                "footprint side": list(sides),
+            },
+        )
+
+    @classmethod
+    def from_records(cls, records: list) -> "TestPointTable":
+        """
+        Build from tuples in column order.
+        """
+        columns = list(zip(*records)) if records else [()] * len(cls.columns)
+        values = dict(zip(cls.columns, columns))
+        codes, categories = {}, {}
+        for name in cls.categorical:
+            codes[name], categories[name] = _factorize(values[name])
+        return cls(
+            ref_des=[sys.intern(str(v)) for v in values["source ref des"]],
+            pad_number=[sys.intern(str(v)) for v in values["source pad"]],
+            x=np.array(values["x"], dtype=np.float64),
+            y=np.array(values["y"], dtype=np.float64),
+            codes=codes,
+            categories=categories,
+        )
+
+    @classmethod
+    def from_rows(cls, rows: list[dict]) -> "TestPointTable":
+        """
+        Build from report dicts like build_test_point_report returns.
+        """
+        return cls.from_records([tuple(row[c] for c in cls.columns) for row in rows])
+
+    def __len__(self):
+        return len(self.ref_des)
+
+    def __iter__(self):
+        return self.rows()
+
+    def column(self, name: str):
+        """
+        Decoded values of a column: a list of strings or a float array.
+        """
+        if name == "source ref des":
+            return self.ref_des
+        if name == "source pad":
+            return self.pad_number
+        if name == "x":
+            return self.x
+        if name == "y":
+            return self.y
+        categories = self.categories[name]
+        return [categories[c] for c in self.codes[name].tolist()]
+
+    def records(self):
+        """
+        Rows as tuples in column order.
+        """
+        return zip(*(
+            self.x.tolist() if name == "x" else self.y.tolist() if name == "y" else self.column(name)
+            for name in self.columns
+        ))
+
+    def rows(self):
+        """
+        Rows as the dicts build_test_point_report returns.
+        """
+        columns = self.columns
+        return (dict(zip(columns, record)) for record in self.records())
+
+    def select(self, which) -> "TestPointTable":
+        """
+        New table with the rows picked by a boolean mask or index array.
+        Categories are shared with this table.
+        """
+        which = np.asarray(which)
+        if which.dtype == bool:
+            which = np.flatnonzero(which)
+        return TestPointTable(
+            ref_des=[self.ref_des[i] for i in which],
+            pad_number=[self.pad_number[i] for i in which],
+            x=self.x[which],
+            y=self.y[which],
+            codes={name: codes[which] for name, codes in self.codes.items()},
+            categories=self.categories,
+        )
+
+    def used(self, name: str) -> list:
+        """
+        Categories of a column that appear in at least one row.
+        """
+        counts = np.bincount(self.codes[name], minlength=len(self.categories[name]))
+        return [c for c, n in zip(self.categories[name], counts.tolist()) if n]
+
+    def xy(self) -> np.ndarray:
+        return np.column_stack((self.x, self.y))
+
+    def to_numpy(self) -> dict:
+        """
+        Columns as arrays. x, y and the categorical codes are the table's own
+        arrays, not copies.
+        """
+        out = {
+            "source ref des": np.array(self.ref_des, dtype=object),
+            "source pad": np.array(self.pad_number, dtype=object),
+            "x": self.x,
+            "y": self.y,
+        }
+        out.update(self.codes)
+        return out
+
+    def to_pandas(self):
+        """
+        DataFrame with categorical columns built on the table's codes.
+        """
+        import pandas as pd
+
+        data = {}
+        for name in self.columns:
+            if name in self.codes:
+                data[name] = pd.Categorical.from_codes(
+                    self.codes[name], categories=pd.Index(self.categories[name], dtype=object)
+                )
+            elif name in ("x", "y"):
+                data[name] = self.column(name)
+            else:
+                data[name] = np.array(self.column(name), dtype=object)
+        return pd.DataFrame(data, copy=False)
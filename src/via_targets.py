@@ -0,0 +1,161 @@
+"""
+via_targets
+Vias that can be probed, for boards with no room left for test pads.
+
+One sweep over the board's tracks keeps the vias whose annular ring is wide
+enough for a probe and whose copper is open on an outer side, solder mask
+tenting allowing. Segments cost a single GetClass call and rejected vias
+stop before their net is looked up.
+
+Vias go into a PadSnapshot with the same fields as pads, so they end up in
+the report like any test point: ref des "VIA", numbered in board order over
+all vias so a via keeps its name when the rules change, and on the top side
+when it can be probed from both.
+"""
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+from pad_snapshot import IU_PER_MM, TEST_POINT_PROPERTY, PadSnapshot, _xy
+from stage_trace import stage
+
+_log = logging.getLogger("kicad_testpoints")
+
+# GetClass() of vias, KiCad 6 and later then KiCad 5
+_via_classes = ("PCB_VIA", "VIA")
+
+via_ref_des = "VIA"
+
+
+@dataclass
+class ViaRules:
+    """
+    Which vias count as probe targets. min_annular_ring is in mm. Tented vias
+    are covered by solder mask and left out unless tented is set.
+    """
+    min_annular_ring: float = 0.1
+    tented: bool = False
+
+    def qualifies(self, width: int, drill: int) -> bool:
+        """
+        Whether a via of this width and drill, in internal units, has a wide
+        enough ring.
+        """
+        return (width - drill) / 2 >= self.min_annular_ring * IU_PER_MM
+
+
+class ViaFields:
+    """
+    Collects vias one at a time in the snapshot's per pad fields.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.pad_number, self.net, self.net_class = [], [], []
+        self.bottom, self.center, self.size = [], [], []
+
+    def add(self, number: int, net: str, net_class: str, center: tuple, width: int,
+            top_open: bool, bottom_open: bool):
+        self.count += 1
+        self.pad_number.append(str(number))
+        self.net.append(net)
+        self.net_class.append(net_class)
+        self.bottom.append(not top_open)
+        self.center.append(center)
+        self.size.append((width, width))
+
+    def snapshot(self, aux_origin: tuple = None, nets: list = (), net_classes: dict = None) -> PadSnapshot:
+        bottom = np.array(self.bottom, dtype=bool)
+        return PadSnapshot(
+            ref_des=[via_ref_des] * self.count,
+            pad_number=self.pad_number,
+            net=self.net,
+            net_class=self.net_class,
+            has_hole=np.ones(self.count, dtype=bool),
+            bottom=bottom,
+            footprint_bottom=bottom.copy(),
+            # Vias that pass the rules count as test points
+            pad_property=np.full(self.count, TEST_POINT_PROPERTY, dtype=np.int32),
+            center=np.array(self.center, dtype=np.int64).reshape(-1, 2),
+            size=np.array(self.size, dtype=np.int64).reshape(-1, 2),
+            aux_origin=aux_origin,
+            nets=list(nets),
+            net_classes=dict(net_classes or {}),
+        )
+
+
+def _copper_layers(board) -> tuple[int, int]:
+    """
+    Layer ids of F.Cu and B.Cu, which changed in KiCad 9.
+    """
+    try:
+        return board.GetLayerID("F.Cu"), board.GetLayerID("B.Cu")
+    except AttributeError:
+        return 0, 31
+
+
+def board_tenting(board) -> tuple[bool, bool]:
+    """
+    Whether vias are tented on the front and back by default. KiCad 8 keeps
+    this in the design settings, older versions in the plot options.
+    """
+    settings = board.GetDesignSettings()
+    if hasattr(settings, "m_TentViasFront"):
+        return bool(settings.m_TentViasFront), bool(settings.m_TentViasBack)
+    try:
+        tented = not board.GetPlotOptions().GetPlotViaOnMaskLayer()
+    except AttributeError:
+        tented = True
+    return tented, tented
+
+
+def _via_width(via, layer: int) -> int:
+    try:
+        return via.GetWidth()
+    except TypeError:
+        # KiCad 9 vias have a width per layer
+        return via.GetWidth(layer)
+
+
+@stage("via discovery", lambda s, *_: {"vias": len(s)})
+def via_snapshot(board, rules: ViaRules = None) -> PadSnapshot:
+    """
+    Vias of the board that qualify as probe targets under rules.
+    """
+    rules = rules or ViaRules()
+    front, back = _copper_layers(board)
+    tented_front, tented_back = board_tenting(board)
+    per_via_tenting = None
+    fields = ViaFields()
+    number = 0
+    for track in board.GetTracks():
+        if track.GetClass() not in _via_classes:
+            continue
+        number += 1
+        width = _via_width(track, front)
+        if not rules.qualifies(width, track.GetDrillValue()):
+            continue
+        top_open = track.TopLayer() == front
+        bottom_open = track.BottomLayer() == back
+        if not rules.tented:
+            if per_via_tenting is None:
+                # KiCad 9 tents each via on its own
+                per_via_tenting = hasattr(track, "IsTented")
+            if per_via_tenting:
+                top_open = top_open and not track.IsTented(front)
+                bottom_open = bottom_open and not track.IsTented(back)
+            else:
+                top_open = top_open and not tented_front
+                bottom_open = bottom_open and not tented_back
+        if not (top_open or bottom_open):
+            continue
+        fields.add(
+            number, track.GetNetname(), track.GetNetClassName(), _xy(track.GetPosition()),
+            width, top_open, bottom_open,
+        )
+    _log.debug("%d of %d vias are probe targets", fields.count, number)
+
+    aux_origin = board.GetDesignSettings().GetAuxOrigin()
+    return fields.snapshot(None if aux_origin is None else _xy(aux_origin))
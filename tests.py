@@ -1,8 +1,42 @@
+import json
+from math import hypot
+import pickle
+import subprocess
+import sys
+import tempfile
 import unittest
-from unittest.mock import MagicMock
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+import numpy as np
 import pandas as pd
 from kicad_testpoints import kicad_testpoints
 
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+sys.path.insert(0, str(Path(__file__).parent / "benchmarks"))
+
+import batch
+import kicad_pcb_reader
+import net_coverage
+import pad_index
+import pad_query
+import pad_snapshot
+import panel
+import probe_drc
+import probe_order
+import probe_plate
+import probe_select
+import probe_spacing
+import report_diff
+import report_cache
+import report_job
+import report_reader
+import report_server
+import report_writers
+import stage_trace
+import synthetic_board
+import testpoint_table
+import via_targets
+
 class PAD:
     pass
 
@@ -149,5 +183,1325 @@ class TestPadPosition(unittest.TestCase):
         self.assertIn(pad1, pads)
         self.assertNotIn(pad2, pads)
 
+
+class TestProbeSpacing(unittest.TestCase):
+    report = [
+        {"source ref des": "TP1", "source pad": "1", "x": 0, "y": 0},
+        {"source ref des": "TP2", "source pad": "1", "x": 3, "y": 4},
+        {"source ref des": "TP3", "source pad": "1", "x": 3, "y": 5},
+        {"source ref des": "TP4", "source pad": "1", "x": -10, "y": 2.5},
+    ]
+
+    def test_calc_probe_distances_matches_scalar(self):
+        distances = probe_spacing.calc_probe_distances("TP1-1", self.report)
+        for row in self.report:
+            expected = kicad_testpoints.calc_probe_distance(self.report[0], row)
+            self.assertEqual(distances[probe_spacing.probe_name(row)], expected)
+
+    def test_min_spacing_table(self):
+        table = probe_spacing.min_spacing_table(pd.DataFrame(self.report))
+        by_name = {row["probe"]: row for row in table}
+        self.assertEqual(by_name["TP2-1"]["neighbor"], "TP3-1")
+        self.assertAlmostEqual(by_name["TP2-1"]["distance"], 1.0)
+        self.assertAlmostEqual(by_name["TP1-1"]["distance"], 5.0)
+
+    def test_probes_within(self):
+        pairs = probe_spacing.probes_within(self.report, 5.5)
+        found = [(p["probe"], p["neighbor"]) for p in pairs]
+        self.assertEqual(found, [("TP2-1", "TP3-1"), ("TP1-1", "TP2-1")])
+
+    def test_grid_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        report = [
+            {"source ref des": f"TP{i}", "source pad": "1", "x": x, "y": y}
+            for i, (x, y) in enumerate(rng.uniform(0, 50, size=(300, 2)))
+        ]
+        index = probe_spacing.ProbeIndex(report)
+        a, b = index._grid_pairs(2.0)
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        close = index._distance(a, b) < 2.0
+        found = set(zip(a[close].tolist(), b[close].tolist()))
+        expected = set()
+        for i in range(len(report)):
+            for j in range(i + 1, len(report)):
+                if kicad_testpoints.calc_probe_distance(report[i], report[j]) < 2.0:
+                    expected.add((i, j))
+        self.assertEqual(found, expected)
+
+    def test_grid_nearest_matches_brute_force(self):
+        rng = np.random.default_rng(2)
+        xy = np.concatenate((
+            rng.uniform(0, 50, size=(300, 2)),
+            np.repeat(rng.uniform(0, 5, size=(20, 2)), 3, axis=0),
+            [[5000.0, 5000.0], [-2000.0, 10.0]],
+        ))
+        report = [
+            {"source ref des": f"TP{i}", "source pad": "1", "x": x, "y": y}
+            for i, (x, y) in enumerate(xy)
+        ]
+        with patch.object(probe_spacing, "cKDTree", None):
+            index = probe_spacing.ProbeIndex(report)
+            _, distances = index.nearest(k=4)
+        expected = np.sort([
+            [kicad_testpoints.calc_probe_distance(a, b) for b in report] for a in report
+        ], axis=1)[:, 1:5]
+        np.testing.assert_allclose(distances, expected)
+
+    def test_nearest_k(self):
+        indices, distances = probe_spacing.ProbeIndex(self.report).nearest(k=5)
+        self.assertEqual(indices.shape, (4, 5))
+        self.assertEqual(indices[0, :3].tolist(), [1, 2, 3])
+        self.assertEqual(indices[0, 3], -1)
+        self.assertTrue(np.isinf(distances[0, 3]))
+
+
+def make_pad(ref_des="U1", number="1", net="NET1", center=(0, 0), side=0, layer=0,
+             has_hole=False, pad_property=4, size=(1_000_000, 1_000_000), net_class="Default"):
+    pad = MagicMock()
+    pad.GetParentFootprint.return_value.GetReferenceAsString.return_value = ref_des
+    pad.GetParentFootprint.return_value.GetSide.return_value = side
+    pad.GetNumber.return_value = number
+    pad.GetNetname.return_value = net
+    pad.GetNetClassName.return_value = net_class
+    pad.HasHole.return_value = has_hole
+    pad.GetLayer.return_value = layer
+    pad.GetCenter.return_value = center
+    pad.GetSize.return_value = size
+    pad.GetProperty.return_value = pad_property
+    return pad
+
+
+def make_board(pads, aux_origin=(0, 0), nets=("", "NET1", "NET2")):
+    board = MagicMock()
+    board.GetPads.return_value = pads
+    board.GetDesignSettings.return_value.GetAuxOrigin.return_value = aux_origin
+    board.GetNetsByName.return_value = list(nets)
+    return board
+
+
+class TestPadSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.pads = [
+            make_pad("TP1", center=(2_000_000, 3_000_000)),
+            make_pad("U1", "7", net="NET2", side=1, has_hole=True, pad_property=0),
+        ]
+        self.board = make_board(self.pads, aux_origin=(1_000_000, 1_000_000))
+
+    def test_snapshot(self):
+        snapshot = pad_snapshot.take_snapshot(self.board)
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(snapshot.ref_des, ["TP1", "U1"])
+        self.assertEqual(snapshot.center.tolist(), [[2_000_000, 3_000_000], [0, 0]])
+        self.assertEqual(snapshot.bottom.tolist(), [False, True])
+        self.assertEqual(snapshot.nets, ["", "NET1", "NET2"])
+        self.assertEqual(snapshot.test_points().ref_des, ["TP1"])
+
+    def test_snapshot_by_property(self):
+        snapshot = pad_snapshot.take_snapshot(
+            self.board, pad_property=pad_snapshot.TEST_POINT_PROPERTY)
+        self.assertEqual(snapshot.ref_des, ["TP1"])
+        self.pads[1].GetCenter.assert_not_called()
+
+    def test_snapshot_pickles(self):
+        snapshot = pad_snapshot.take_snapshot(self.board)
+        copy = pickle.loads(pickle.dumps(snapshot))
+        self.assertEqual(copy.net, snapshot.net)
+        self.assertEqual(copy.center.tolist(), snapshot.center.tolist())
+
+    def test_build_report(self):
+        snapshot = pad_snapshot.take_snapshot(self.board)
+        settings = kicad_testpoints.Settings()
+        settings.use_aux_origin = True
+        report = pad_snapshot.build_report(snapshot, settings)
+        self.assertEqual(list(report[0]), [
+            "source ref des", "source pad", "net", "net class", "side",
+            "x", "y", "pad type", "footprint side"])
+        self.assertEqual((report[0]["x"], report[0]["y"]), (1.0, -2.0))
+        self.assertEqual(report[1]["pad type"], "THRU")
+        self.assertEqual(report[1]["footprint side"], "BOTTOM")
+
+    def test_build_report_no_aux_origin(self):
+        self.board.GetDesignSettings.return_value.GetAuxOrigin.return_value = None
+        snapshot = pad_snapshot.take_snapshot(self.board)
+        settings = kicad_testpoints.Settings()
+        settings.use_aux_origin = True
+        report = pad_snapshot.build_report(snapshot, settings)
+        self.assertEqual((report[0]["x"], report[0]["y"]), (2.0, -3.0))
+        self.assertFalse(settings.use_aux_origin)
+
+    def test_pad_positions(self):
+        centers = np.array([[1_000_000, 1_000_000], [12_345_678, -5_000_000]])
+        positions = pad_snapshot.pad_positions(centers, (1_000_000, 2_000_000))
+        self.assertEqual(positions.tolist(), [[0.0, 1.0], [11.3457, 7.0]])
+        for center, position in zip(centers, positions):
+            expected = kicad_testpoints.calc_pad_position(
+                [round(pt / 1e6, 4) for pt in center], (1.0, 2.0))
+            self.assertEqual(position.tolist(), [round(pt, 4) for pt in expected])
+
+
+class TestPadQuery(unittest.TestCase):
+    def setUp(self):
+        self.pads = [
+            make_pad("TP1", pad_property=0, size=(800_000, 800_000)),
+            make_pad("TP2", net="GND", side=1, has_hole=True, pad_property=0),
+            make_pad("U1", "7", net="VCC", net_class="Power", size=(300_000, 1_000_000)),
+            make_pad("J1", net="GND", pad_property=0),
+        ]
+        self.board = make_board(self.pads)
+
+    def refs(self, text):
+        query = pad_query.PadQuery(text)
+        matched = [p.GetParentFootprint().GetReferenceAsString()
+                   for p in self.pads if query.predicate(p)]
+        snapshot = pad_snapshot.take_snapshot(self.board)
+        self.assertEqual(query.select(snapshot).ref_des, matched)
+        return matched
+
+    def test_terms(self):
+        self.assertEqual(self.refs("property:testpoint"), ["U1"])
+        self.assertEqual(self.refs("ref:TP*"), ["TP1", "TP2"])
+        self.assertEqual(self.refs("net:GND"), ["TP2", "J1"])
+        self.assertEqual(self.refs("netclass:Pow.*"), ["U1"])
+        self.assertEqual(self.refs("layer:bottom"), ["TP2"])
+        self.assertEqual(self.refs("hole"), ["TP2"])
+        self.assertEqual(self.refs("size>=0.8"), ["TP1", "TP2", "J1"])
+
+    def test_combined(self):
+        self.assertEqual(self.refs("ref:TP* or property:testpoint"), ["TP1", "TP2", "U1"])
+        self.assertEqual(self.refs("net:GND and not (ref:J* or hole)"), [])
+        self.assertEqual(self.refs("smd size<0.9"), ["TP1", "U1"])
+
+    def test_brackets_in_values(self):
+        self.pads[3].GetNetname.return_value = "Net-(J1-Pad2)"
+        self.assertEqual(self.refs("net:Net-(J1-Pad2)"), ["J1"])
+        self.assertEqual(self.refs("(net:Net-(J1-Pad2) or ref:TP1)"), ["TP1", "J1"])
+        self.assertEqual(self.refs("net:(GND|VCC)"), ["TP2", "U1"])
+        self.assertEqual(self.refs("not (net:(GND|VCC))"), ["TP1", "J1"])
+
+    def test_quoted_values(self):
+        self.pads[0].GetNetname.return_value = "A B"
+        self.assertEqual(self.refs('net:"A B"'), ["TP1"])
+        self.assertEqual(self.refs("net:'Net-(J1-Pad2)' or net:'A B'"), ["TP1"])
+        with self.assertRaises(UserWarning):
+            pad_query.compile_query('net:"A B')
+
+    def test_snapshot_by_query(self):
+        snapshot = pad_snapshot.take_snapshot(
+            self.board, query=pad_query.PadQuery("ref:TP* smd"))
+        self.assertEqual(snapshot.ref_des, ["TP1"])
+        self.assertEqual(snapshot.size.tolist(), [[800_000, 800_000]])
+        self.pads[2].GetCenter.assert_not_called()
+
+    def test_required_property(self):
+        self.assertEqual(pad_query.PadQuery("property:testpoint net:GND").property(), 4)
+        self.assertIsNone(pad_query.PadQuery("property:testpoint or net:GND").property())
+
+    def test_bad_queries(self):
+        for text in ("", "ref:TP* or", "(hole", "colour:red", "layer:inner", "net:("):
+            with self.assertRaises(UserWarning):
+                pad_query.PadQuery(text)
+
+
+class TestPadIndex(unittest.TestCase):
+    def setUp(self):
+        self.board = MagicMock()
+        footprints = []
+        for ref_des, numbers in (("U1", ("1", "2")), ("TP1", ("1",)), ("U1", ("3",))):
+            fp = MagicMock()
+            fp.GetReferenceAsString.return_value = ref_des
+            pads = []
+            for number in numbers:
+                pad = MagicMock()
+                pad.GetNumber.return_value = number
+                pads.append(pad)
+            fp.Pads.return_value = pads
+            footprints.append(fp)
+        self.board.GetFootprints.return_value = footprints
+
+    def test_resolve(self):
+        pads = pad_index.get_pads((("U1", 2), ("TP1", "1")), self.board)
+        self.assertEqual([p.GetNumber() for p in pads], ["2", "1"])
+        self.board.FindFootprintByReference.assert_not_called()
+
+    def test_first_footprint_wins(self):
+        index = pad_index.PadIndex(self.board)
+        self.assertIsNone(index.get("U1", 3))
+
+    def test_reports_all_missing(self):
+        index = pad_index.PadIndex(self.board)
+        with self.assertRaises(UserWarning) as err:
+            index.resolve((("U9", 1), ("U1", 5), ("TP2", 1), ("TP1", 1)))
+        msg = str(err.exception)
+        self.assertIn("U9, TP2", msg)
+        self.assertIn("Pad 5 not found in module U1", msg)
+
+
+class TestBatch(unittest.TestCase):
+    def test_expand_paths(self):
+        with tempfile.TemporaryDirectory() as d:
+            root = Path(d)
+            (root / "sub").mkdir()
+            for name in ("a.kicad_pcb", "sub/b.kicad_pcb", "sub/c.kicad_pro"):
+                (root / name).touch()
+            paths = batch.expand_paths([str(root / "*.kicad_pcb"), d, str(root / "x.kicad_pcb")])
+        self.assertEqual(
+            [p.relative_to(root).as_posix() for p in paths],
+            ["a.kicad_pcb", "sub/b.kicad_pcb", "x.kicad_pcb"])
+
+    def test_run_batch_inline(self):
+        pcbnew = MagicMock()
+        pcbnew.LoadBoard.return_value = make_board([make_pad("TP1"), make_pad("TP2", net="NET2")])
+        with tempfile.TemporaryDirectory() as d, patch.dict(sys.modules, {"pcbnew": pcbnew}):
+            board_path = Path(d) / "board.kicad_pcb"
+            results = list(batch.run_batch([board_path], jobs=1, coverage=True))
+            self.assertTrue(batch.report_path(board_path).exists())
+            self.assertTrue(batch.report_path(board_path, kind="coverage").exists())
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(results[0]["test points"], 2)
+        self.assertEqual((results[0]["covered nets"], results[0]["nets"]), (2, 2))
+
+    def test_run_batch_error(self):
+        pcbnew = MagicMock()
+        pcbnew.LoadBoard.side_effect = OSError("bad board")
+        with patch.dict(sys.modules, {"pcbnew": pcbnew}):
+            results = list(batch.run_batch([Path("missing.kicad_pcb")], jobs=1))
+        self.assertIn("bad board", results[0]["error"])
+        self.assertIn("FAILED", batch.format_result(results[0]))
+
+    def test_file_backend_without_pcbnew(self):
+        script = (
+            "import sys; sys.modules['pcbnew'] = None; sys.argv[0] = 'plugin.py'; "
+            "sys.path.insert(0, sys.argv.pop(1)); import plugin; plugin.cli()"
+        )
+        with tempfile.TemporaryDirectory() as d:
+            board_path = write_test_board(d)
+            src = str(Path(__file__).parent / "src")
+            for args in (["batch", str(board_path), "--backend", "file"],
+                         ["diff", str(board_path), str(board_path), "--backend", "file"]):
+                result = subprocess.run(
+                    [sys.executable, "-c", script, src, *args], capture_output=True, text=True)
+                self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertTrue(batch.report_path(board_path).exists())
+
+
+test_board = """(kicad_pcb (version 20221018) (generator pcbnew)
+  (layers (0 "F.Cu" signal) (31 "B.Cu" signal))
+  (setup (pad_to_mask_clearance 0) (aux_axis_origin 100 150))
+  (net 0 "")
+  (net 1 "GND")
+  (net 2 "/SDA")
+  (net 3 "Net-(J1-Pad2)")
+  (gr_text "quoted \\"(\\" text" (at 0 0) (layer "F.SilkS"))
+  (footprint "TestPoint:TestPoint_Pad_D1.0mm" (layer "F.Cu") (at 110 140 90)
+    (fp_text reference "TP1" (at 0 -1.5 90) (layer "F.SilkS") (effects (font (size 1 1))))
+    (fp_line (start 0 0) (end 1 1) (layer "F.SilkS") (width 0.12))
+    (pad "1" smd circle (at 1 0 90) (size 1 1) (layers "F.Cu" "F.Mask") (net 1 "GND")
+      (property pad_prop_testpoint))
+  )
+  (footprint "Conn:Header" (layer "B.Cu") (at 120.5 130.25 180)
+    (property "Reference" "J1" (at 0 0) (effects (font (size 1 1)) (justify mirror)))
+    (pad "1" thru_hole rect (at 0 0 180) (size 1.7 1.7) (drill 1.0) (layers "*.Cu" "*.Mask")
+      (net 2 "/SDA") (property pad_prop_testpoint))
+    (pad "2" thru_hole oval (at 0 2.54 180) (size 1.7 1.7) (drill 1.0) (layers "*.Cu" "*.Mask")
+      (net 3 "Net-(J1-Pad2)"))
+  )
+  (segment (start 1 1) (end 2 2) (width 0.25) (layer "F.Cu") (net 1))
+  (via (at 115 145) (size 0.8) (drill 0.4) (layers "F.Cu" "B.Cu") (net 1))
+  (via (at 116 145) (size 0.5) (drill 0.4) (layers "F.Cu" "B.Cu") (net 2))
+  (via blind (at 117 145) (size 0.8) (drill 0.4) (layers "In1.Cu" "B.Cu")
+    (tenting (front no) (back no)) (net 2))
+  (zone (net 1) (net_name "GND") (polygon (pts (xy 0 0) (xy 1 0) (xy 1 1))))
+)
+"""
+
+test_project = {
+    "net_settings": {
+        "classes": [{"name": "Default"}],
+        "netclass_assignments": None,
+        "netclass_patterns": [{"netclass": "I2C", "pattern": "/S*"}],
+    }
+}
+
+
+def write_test_board(directory: str) -> Path:
+    board_path = Path(directory) / "test.kicad_pcb"
+    board_path.write_text(test_board)
+    board_path.with_suffix(".kicad_pro").write_text(json.dumps(test_project))
+    return board_path
+
+
+class TestKicadPcbReader(unittest.TestCase):
+    def test_read_board(self):
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = kicad_pcb_reader.read_board(write_test_board(d))
+        self.assertEqual(snapshot.ref_des, ["TP1", "J1", "J1"])
+        self.assertEqual(snapshot.pad_number, ["1", "1", "2"])
+        self.assertEqual(snapshot.net, ["GND", "/SDA", "Net-(J1-Pad2)"])
+        self.assertEqual(snapshot.net_class, ["Default", "I2C", "Default"])
+        self.assertEqual(snapshot.center.tolist(), [
+            [110_000_000, 139_000_000], [120_500_000, 130_250_000], [120_500_000, 127_710_000]])
+        self.assertEqual(snapshot.aux_origin, (100_000_000, 150_000_000))
+        self.assertEqual(snapshot.nets, ["", "GND", "/SDA", "Net-(J1-Pad2)"])
+
+    def test_report(self):
+        # A pad whose shape is offset from its hole, reported at the shape's
+        # center like pcbnew's GetCenter
+        offset_pad = """  (footprint "TestPoint:Offset" (layer "F.Cu") (at 130 140 90)
+    (fp_text reference "TP2" (at 0 0) (layer "F.SilkS"))
+    (pad "1" thru_hole oval (at 0 0 90) (size 1 2) (drill 0.8 (offset 0 0.5))
+      (layers "*.Cu" "*.Mask") (net 1 "GND") (property pad_prop_testpoint))
+  )
+  (segment"""
+        with tempfile.TemporaryDirectory() as d:
+            path = write_test_board(d)
+            path.write_text(test_board.replace("  (segment", offset_pad, 1))
+            snapshot = kicad_pcb_reader.read_board(
+                path, pad_property=pad_snapshot.TEST_POINT_PROPERTY)
+        settings = kicad_testpoints.Settings()
+        settings.use_aux_origin = True
+        report = pad_snapshot.build_report(snapshot, settings)
+        self.assertEqual(report, [
+            {"source ref des": "TP1", "source pad": "1", "net": "GND", "net class": "Default",
+             "side": "TOP", "x": 10.0, "y": 11.0, "pad type": "SMT", "footprint side": "TOP"},
+            {"source ref des": "J1", "source pad": "1", "net": "/SDA", "net class": "I2C",
+             "side": "BOTTOM", "x": 20.5, "y": 19.75, "pad type": "THRU",
+             "footprint side": "BOTTOM"},
+            {"source ref des": "TP2", "source pad": "1", "net": "GND", "net class": "Default",
+             "side": "TOP", "x": 30.5, "y": 10.0, "pad type": "THRU", "footprint side": "TOP"},
+        ])
+
+    def test_rotate(self):
+        self.assertEqual(kicad_pcb_reader._rotate(1000, 0, 90), (0, -1000))
+        self.assertEqual(kicad_pcb_reader._rotate(1000, 0, 45), (707, -707))
+
+    def test_not_a_board(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "bad.kicad_pcb"
+            path.write_text("(kicad_sch (version 1))")
+            with self.assertRaises(UserWarning):
+                kicad_pcb_reader.read_board(path)
+
+
+class TestReportCache(unittest.TestCase):
+    def setUp(self):
+        self.pads = [
+            make_pad("TP1", center=(1_000_000, 2_000_000)),
+            make_pad("TP2", center=(3_000_000, 4_000_000)),
+            make_pad("TP2", "2", center=(3_000_000, 5_000_000)),
+        ]
+        self.settings = kicad_testpoints.Settings()
+        self.settings.use_aux_origin = True
+
+    def build(self, path, **kwargs):
+        snapshot = pad_snapshot.take_snapshot(make_board(self.pads))
+        cache = report_cache.ReportCache.load(path, **kwargs)
+        report = cache.build_report(snapshot, self.settings)
+        self.assertEqual(report, pad_snapshot.build_report(snapshot, self.settings))
+        cache.save()
+        return cache
+
+    def test_only_changed_footprints_rebuilt(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = report_cache.cache_path(Path(d) / "board-testpoints.csv")
+            self.assertEqual(self.build(path).misses, 2)
+            self.pads[2].GetCenter.return_value = (3_000_000, 6_000_000)
+            cache = self.build(path)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_origin_change_invalidates(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "cache"
+            self.build(path)
+            self.settings.use_aux_origin = False
+            cache = self.build(path)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_size_bound(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "cache"
+            self.build(path, max_entries=1)
+            self.assertEqual(len(report_cache.ReportCache.load(path).entries), 1)
+
+    def test_unreadable_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "cache"
+            path.write_text("not json")
+            self.assertEqual(self.build(path).misses, 2)
+
+
+class TestReportJob(unittest.TestCase):
+    def setUp(self):
+        pads = [make_pad(f"TP{i}", net=f"NET{i % 2 + 1}", center=(i, i)) for i in range(10)]
+        pads.append(make_pad("U1", pad_property=0))
+        self.board = make_board(pads)
+
+    def test_steps(self):
+        with tempfile.TemporaryDirectory() as d:
+            file_path = Path(d) / "board-testpoints.csv"
+            job = report_job.ReportJob(
+                self.board, file_path, kicad_testpoints.Settings(), chunk_size=3)
+            stages = set()
+            while not job.step(budget=0):
+                stages.add(job.stage)
+            self.assertEqual(job.stage, job.finished)
+            self.assertTrue(file_path.exists())
+            self.assertTrue(report_cache.cache_path(file_path).exists())
+        self.assertIn(job.reading, stages)
+        self.assertEqual((job.done, job.total), (11, 11))
+        self.assertEqual(len(job.data), 10)
+        self.assertEqual(job.coverage(), (2, 2))
+
+    def test_cancel(self):
+        with tempfile.TemporaryDirectory() as d:
+            file_path = Path(d) / "board-testpoints.csv"
+            job = report_job.ReportJob(
+                self.board, file_path, kicad_testpoints.Settings(), chunk_size=3)
+            job.step(budget=0)
+            job.cancel()
+            self.assertTrue(job.step())
+            self.assertEqual(job.stage, job.cancelled)
+            self.assertLess(job.done, job.total)
+            self.assertFalse(file_path.exists())
+
+    def test_order(self):
+        with tempfile.TemporaryDirectory() as d:
+            file_path = Path(d) / "board-testpoints.csv"
+            job = report_job.ReportJob(
+                self.board, file_path, kicad_testpoints.Settings(), order_time=1)
+            while not job.step():
+                pass
+        self.assertEqual(job.stage, job.finished)
+        self.assertEqual(sorted(job.data.ref_des), sorted(f"TP{i}" for i in range(10)))
+        self.assertLessEqual(job.order.length_after, job.order.length_before)
+
+
+class TestTestPointTable(unittest.TestCase):
+    def setUp(self):
+        pads = [
+            make_pad("TP1", net="NET1", center=(1_000_000, 2_000_000)),
+            make_pad("TP2", net="NET2", center=(3_000_000, 4_000_000), has_hole=True),
+            make_pad("TP3", net="NET1", center=(5_000_000, 6_000_000), layer=1),
+        ]
+        self.snapshot = pad_snapshot.take_snapshot(make_board(pads))
+        self.settings = kicad_testpoints.Settings()
+        self.settings.use_aux_origin = True
+        self.table = testpoint_table.TestPointTable.from_snapshot(self.snapshot, self.settings)
+
+    def test_rows_match_report(self):
+        report = pad_snapshot.build_report(self.snapshot, self.settings)
+        self.assertEqual(list(self.table.rows()), report)
+        table = testpoint_table.TestPointTable.from_rows(report)
+        self.assertEqual(list(table.rows()), report)
+
+    def test_used(self):
+        self.assertEqual(self.table.used("net"), ["NET1", "NET2"])
+        self.assertEqual(self.table.select([0, 2]).used("net"), ["NET1"])
+        self.assertEqual(self.table.select(self.table.codes["pad type"] == 1).ref_des, ["TP2"])
+
+    def test_to_pandas(self):
+        df = self.table.to_pandas()
+        self.assertEqual(list(df.columns), list(self.table.columns))
+        self.assertEqual(df["net"].dtype, "category")
+        self.assertEqual(df.to_dict("records"), list(self.table.rows()))
+
+    def test_probe_index(self):
+        index = probe_spacing.ProbeIndex(self.table)
+        self.assertEqual(index.names, ["TP1-1", "TP2-1", "TP3-1"])
+        np.testing.assert_array_equal(index.xy, self.table.xy())
+
+
+class TestNetCoverage(unittest.TestCase):
+    def setUp(self):
+        pads = [
+            make_pad("TP1", net="/Sheet/+3V3"),
+            make_pad("TP2", net="/Sheet/+3V3"),
+            make_pad("TP3", net="GND"),
+            make_pad("TP4", net=""),
+            make_pad("U1", net="SDA", pad_property=0),
+        ]
+        board = make_board(pads, nets=("", "/Sheet/+3V3", "GND", "SDA", "SCL"))
+        self.snapshot = pad_snapshot.take_snapshot(board)
+        self.snapshot.net_classes = {"SDA": "I2C", "SCL": "I2C"}
+        self.coverage = net_coverage.net_coverage(self.snapshot)
+
+    def test_coverage(self):
+        c = self.coverage
+        self.assertEqual((c.covered, c.total), (2, 4))
+        self.assertEqual(c.uncovered(), ["SDA", "SCL"])
+        self.assertEqual(c.multiply_probed(), {"/Sheet/+3V3": 2})
+        self.assertEqual(c.unmatched, 1)
+        self.assertEqual(c.by_class(), {"Default": (2, 2), "I2C": (0, 2)})
+        self.assertEqual(c.by_kind(), {"signal": (0, 2), "power": (1, 1), "ground": (1, 1)})
+        self.assertIn("Coverage: 2 / 4 nets", c.summary())
+
+    def test_same_from_report(self):
+        table = testpoint_table.TestPointTable.from_snapshot(
+            self.snapshot.test_points(), kicad_testpoints.Settings())
+        coverage = net_coverage.net_coverage(self.snapshot, table)
+        self.assertEqual(list(coverage.rows()), list(self.coverage.rows()))
+
+    def test_net_kind(self):
+        self.assertEqual(net_coverage.normalize_net("/Power/+3v3"), "+3V3")
+        for name in ("GND", "AGND", "/a/DGND", "VSS", "GND_SENSE"):
+            self.assertEqual(net_coverage.net_kind(name), "ground", name)
+        for name in ("VCC", "+5V", "3V3", "VBUS", "-12V", "VDD_CORE", "VEE"):
+            self.assertEqual(net_coverage.net_kind(name), "power", name)
+        for name in ("SDA", "Net-(U1-Pad3)", "PGOOD", "DEFAULT"):
+            self.assertEqual(net_coverage.net_kind(name), "signal", name)
+        self.assertEqual(net_coverage.net_kind("MOTOR_A", "Power"), "power")
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "coverage.csv"
+            net_coverage.write_coverage(self.coverage, [path])
+            df = pd.read_csv(path, keep_default_na=False)
+        self.assertEqual(list(df.columns), list(net_coverage.NetCoverage.columns))
+        self.assertEqual(df["probes"].tolist(), [2, 1, 0, 0])
+
+
+class TestProbeDrc(unittest.TestCase):
+    def setUp(self):
+        records = [
+            ("TP1", "1", "N1", "Default", "TOP", 10.0, 10.0, "SMT", "TOP"),
+            ("TP2", "1", "N2", "Default", "TOP", 11.0, 10.0, "SMT", "TOP"),
+            # Same place as TP1 but probed from below
+            ("TP3", "1", "N3", "Default", "BOTTOM", 10.0, 10.0, "SMT", "BOTTOM"),
+            ("TP4", "1", "N4", "Default", "TOP", 1.0, 20.0, "SMT", "TOP"),
+            ("TP5", "1", "N5", "Default", "TOP", 60.0, 20.0, "SMT", "TOP"),
+            ("TP6", "1", "N6", "Default", "TOP", 30.0, 20.0, "SMT", "TOP"),
+            ("TP7", "1", "N7", "Default", "TOP", 30.0, 27.0, "SMT", "TOP"),
+            ("J1", "1", "N8", "Default", "TOP", 40.0, 20.0, "THRU", "TOP"),
+        ]
+        self.table = testpoint_table.TestPointTable.from_records(records)
+
+        def square(x, y, size):
+            return [np.array([(x, y), (x + size, y), (x + size, y + size), (x, y + size)])]
+
+        self.geometry = probe_drc.BoardGeometry(
+            outline=square(0, 0, 50),
+            courtyards=[
+                probe_drc.Courtyard("U1", False, square(28, 18, 4), height=1.0),
+                probe_drc.Courtyard("U2", False, square(28, 28, 4), height=10.0),
+                probe_drc.Courtyard("U3", True, square(28, 18, 4), height=10.0),
+                probe_drc.Courtyard("J1", False, square(38, 18, 4), height=10.0),
+            ],
+        )
+
+    def test_violations(self):
+        drc = probe_drc.check_clearances(self.table, self.geometry, "100mil")
+        found = {(row["rule"], row["probe"], row["other"]) for row in drc.rows()}
+        self.assertEqual(found, {
+            ("probe spacing", "TP1-1", "TP2-1"),
+            ("board edge", "TP4-1", "Edge.Cuts"),
+            ("off board", "TP5-1", "Edge.Cuts"),
+            ("under component", "TP6-1", "U1"),
+            ("component clearance", "TP7-1", "U2"),
+        })
+        self.assertIn("5 violations", drc.summary())
+
+    def test_off_board_with_cutout(self):
+        t = np.linspace(0, 2 * np.pi, 400, endpoint=False)
+        radius = 20 + 5 * np.sin(5 * t)
+        outline = [np.column_stack((radius * np.cos(t), radius * np.sin(t))),
+                   np.column_stack((3 * np.cos(t[::8]), 3 * np.sin(t[::8])))]
+        xy = np.random.default_rng(3).uniform(-30, 30, size=(500, 2))
+        found = {}
+        probe_drc._check_edge(xy, np.zeros(len(xy)), outline, lambda rule, i, *_: found.update({i: rule}))
+        a, b = probe_drc._segments(outline)
+        expected = [
+            i for i, p in enumerate(xy)
+            if probe_drc._crosses(np.tile(p, (len(a), 1)), a, b).sum() % 2 == 0
+        ]
+        self.assertEqual(sorted(found), expected)
+
+    def test_probe_classes(self):
+        drc = probe_drc.check_clearances(self.table, probe_class="39mil")
+        self.assertEqual(len(drc), 0)
+        with self.assertRaises(UserWarning):
+            probe_drc.check_clearances(self.table, probe_class="1mil")
+
+    def test_markers_replace_the_marker_layer(self):
+        pcbnew = MagicMock(User_9=9)
+        old_marker, note = MagicMock(), MagicMock()
+        old_marker.GetLayer.return_value = 9
+        note.GetLayer.return_value = 1
+        board = MagicMock()
+        board.GetDrawings.return_value = [old_marker, note]
+        board.Groups.return_value = []
+        drc = probe_drc.check_clearances(self.table, self.geometry, "100mil")
+        self.assertTrue(len(drc))
+        with patch.dict(sys.modules, {"pcbnew": pcbnew}):
+            probe_drc.draw_markers(board, drc, (0, 0))
+        removed = [c.args[0] for c in board.Remove.call_args_list]
+        self.assertEqual(removed, [old_marker])
+        shapes = [c.args[0] for c in board.Add.call_args_list[1:]]
+        self.assertEqual(len(shapes), len(drc))
+        pcbnew.PCB_SHAPE.return_value.SetLayer.assert_called_with(9)
+
+    def test_report_coordinates(self):
+        origin = (1_000_000, 2_000_000)
+        points = np.array([[3_000_000, 500_000], [-250_000, 7_000_000]])
+        report = probe_drc.to_report(points, origin)
+        np.testing.assert_allclose(report, [[2.0, 1.5], [-1.25, -5.0]])
+        np.testing.assert_array_equal(probe_drc.from_report(report, origin), points)
+
+
+class TestPanel(unittest.TestCase):
+    def setUp(self):
+        pads = [
+            make_pad("TP1", center=(1_000_000, 2_000_000)),
+            make_pad("TP2", net="NET2", center=(-3_000_000, 500_000)),
+            make_pad("TP3", center=(2_000_000, -4_000_000), layer=1),
+        ]
+        self.unit = pad_snapshot.take_snapshot(make_board(pads))
+        self.placements = [
+            panel.Placement(100_000_000, 50_000_000),
+            panel.Placement(120_000_000, 50_000_000, rotation=90),
+            panel.Placement(140_000_000, 50_000_000, mirror=True),
+            panel.Placement(160_000_000, 50_000_000, rotation=30, suffix="-B"),
+        ]
+
+    def test_replicate(self):
+        snapshot = panel.replicate(self.unit, self.placements)
+        self.assertEqual(len(snapshot), 12)
+        self.assertEqual(snapshot.ref_des[:4], ["TP1_1", "TP2_1", "TP3_1", "TP1_2"])
+        self.assertEqual(snapshot.ref_des[-1], "TP3-B")
+        np.testing.assert_array_equal(snapshot.center[:6], [
+            (101_000_000, 52_000_000), (97_000_000, 50_500_000), (102_000_000, 46_000_000),
+            (122_000_000, 49_000_000), (120_500_000, 53_000_000), (116_000_000, 48_000_000),
+        ])
+        # Mirrored copy flips x and the sides
+        np.testing.assert_array_equal(snapshot.center[6], (139_000_000, 52_000_000))
+        self.assertEqual(snapshot.bottom.tolist()[6:9], [True, True, False])
+        self.assertEqual(snapshot.footprint_bottom.tolist()[6:9], [True, True, True])
+        # Same rotation as the file reader, which matches pcbnew
+        expected = kicad_pcb_reader._rotate(1_000_000, 2_000_000, 30)
+        np.testing.assert_array_equal(
+            snapshot.center[9], (160_000_000 + expected[0], 50_000_000 + expected[1]))
+
+    def test_detect(self):
+        snapshot = panel.replicate(self.unit, self.placements[:3])
+        for refs in (snapshot.ref_des, [r.split("_")[0] for r in snapshot.ref_des]):
+            panel_snapshot = snapshot.select(np.arange(len(snapshot))[::-1])
+            panel_snapshot.ref_des = list(refs)[::-1]
+            found = panel.detect_panel(panel_snapshot)
+            self.assertEqual(len(found.placements), 3)
+            self.assertEqual(sorted(found.unit.ref_des), ["TP1", "TP2", "TP3"])
+            self.assertEqual(len(found.extra), 0)
+            self.assertEqual(
+                sorted(map(tuple, found.snapshot().center.tolist())),
+                sorted(map(tuple, snapshot.center.tolist())))
+
+    def test_detect_keeps_suffixes(self):
+        placements = [
+            panel.Placement(100_000_000 + 20_000_000 * k, 50_000_000, suffix=suffix)
+            for k, suffix in enumerate(("_3", "_1", "_2"))
+        ]
+        snapshot = panel.replicate(self.unit, placements)
+        found = panel.detect_panel(snapshot)
+        self.assertEqual([p.suffix for p in found.placements], ["_3", "_1", "_2"])
+        detected = found.snapshot()
+        self.assertEqual(
+            sorted(zip(detected.ref_des, map(tuple, detected.center.tolist()))),
+            sorted(zip(snapshot.ref_des, map(tuple, snapshot.center.tolist()))))
+
+    def test_detect_not_a_panel(self):
+        with self.assertRaises(UserWarning):
+            panel.detect_panel(self.unit)
+
+    def test_read_placements(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "placements.csv"
+            path.write_text("x,y,rotation,mirror,suffix\n10,20.5,90,1,_A\n30,0,,,\n")
+            placements = panel.read_placements(path)
+        self.assertEqual(placements, [
+            panel.Placement(10_000_000, 20_500_000, 90.0, True, "_A"),
+            panel.Placement(30_000_000, 0, 0.0, False, None),
+        ])
+
+
+class TestProbeOrder(unittest.TestCase):
+    def setUp(self):
+        # Two rows of probes on top listed in a zig-zag, and one on the bottom
+        self.report = [
+            {"source ref des": f"TP{i}", "x": float(i // 2), "y": 10.0 * (i % 2), "side": "TOP"}
+            for i in range(10)
+        ]
+        self.report.append({"source ref des": "TP10", "x": 0.0, "y": 0.0, "side": "BOTTOM"})
+
+    def test_order(self):
+        order = probe_order.order_probes(self.report, time_budget=5)
+        rows = order.apply(self.report)
+        self.assertEqual(sorted(r["source ref des"] for r in rows),
+                         sorted(r["source ref des"] for r in self.report))
+        self.assertEqual([r["side"] for r in rows], ["TOP"] * 10 + ["BOTTOM"])
+        self.assertEqual(rows[0]["source ref des"], "TP0")
+        self.assertAlmostEqual(order.sides["TOP"][0], 5 * 10 + 4 * hypot(1, 10))
+        # Along one row and back along the other
+        self.assertAlmostEqual(order.length_after, 4 + 10 + 4)
+        top = np.array([(r["x"], r["y"]) for r in rows[:10]])
+        self.assertAlmostEqual(probe_order.path_length(top), order.length_after)
+
+    def test_improves_random(self):
+        rng = np.random.default_rng(0)
+        xy = rng.uniform(0, 100, (500, 2))
+        report = [{"x": x, "y": y, "side": "TOP"} for x, y in xy.tolist()]
+        orderer = probe_order.ProbeOrderer(report, time_budget=5)
+        while not orderer.step(budget=0.01):
+            pass
+        order = orderer.result()
+        self.assertEqual(sorted(order.order.tolist()), list(range(500)))
+        self.assertAlmostEqual(probe_order.path_length(xy[order.order]), order.length_after)
+        self.assertLess(order.length_after, order.length_before / 5)
+
+    def test_table(self):
+        table = testpoint_table.TestPointTable.from_rows([
+            {"source ref des": f"TP{i}", "source pad": "1", "net": "GND", "net class": "Default",
+             "side": "TOP", "x": float(x), "y": 0.0, "pad type": "SMT", "footprint side": "TOP"}
+            for i, x in enumerate((0, 3, 1, 2))
+        ])
+        ordered, order = probe_order.order_report(table)
+        self.assertEqual(ordered.ref_des, ["TP0", "TP2", "TP3", "TP1"])
+        self.assertEqual((order.length_before, order.length_after), (6.0, 3.0))
+
+    def test_grid_snapped(self):
+        # Probes on a 10 mm grid, where x // cell and floor(x / cell) can
+        # pick different cells
+        xy = [(10.0 * (i % 11), 10.0 * (i // 11)) for i in range(90)]
+        report = [{"x": x, "y": y, "side": "TOP"} for x, y in xy]
+        order = probe_order.order_probes(report, time_budget=1)
+        self.assertEqual(sorted(order.order.tolist()), list(range(90)))
+
+
+def probe_row(ref_des, net, x, y=0.0, side="TOP"):
+    return {"source ref des": ref_des, "source pad": "1", "net": net, "x": x, "y": y, "side": side}
+
+
+class TestProbeSelect(unittest.TestCase):
+    def test_one_per_net(self):
+        report = [
+            probe_row("TP1", "A", 0.0), probe_row("TP2", "A", 10.0),
+            probe_row("TP3", "B", 20.0, side="BOTTOM"), probe_row("TP4", "B", 30.0),
+            probe_row("TP5", "", 40.0),
+        ]
+        rows = probe_select.select_probes(report, "100mil")
+        self.assertEqual([r["source ref des"] for r in rows], ["TP1", "TP4"])
+
+    def test_spacing(self):
+        # A's only pad sits next to B's top pad, so B moves to the bottom
+        report = [
+            probe_row("TP1", "B", 0.0), probe_row("TP2", "B", 0.0, side="BOTTOM"),
+            probe_row("TP3", "A", 1.0),
+        ]
+        greedy = probe_select.ProbeSelector(report, 2.54, time_budget=0)
+        self.assertEqual(greedy.uncovered_nets(), [])
+        self.assertEqual([r["source ref des"] for r in greedy.selected_rows()], ["TP2", "TP3"])
+
+    def test_local_search(self):
+        # Greedy covers B first with its top pad, blocking A
+        report = [
+            probe_row("TP1", "A", 0.0), probe_row("TP2", "A", 1.0), probe_row("TP3", "A", 1.5),
+            probe_row("TP4", "B", 0.5), probe_row("TP5", "B", 20.0, side="BOTTOM"),
+        ]
+        greedy = probe_select.ProbeSelector(report, 2.54, time_budget=0)
+        self.assertEqual(greedy.uncovered_nets(), ["A"])
+        solved = probe_select.ProbeSelector(report, 2.54)
+        self.assertEqual(solved.uncovered_nets(), [])
+        self.assertEqual([r["source ref des"] for r in solved.selected_rows()], ["TP1", "TP5"])
+
+    def test_incremental(self):
+        selector = probe_select.ProbeSelector([probe_row("TP1", "A", 0.0)], "100mil")
+        selector.add([probe_row("TP2", "B", 1.0), probe_row("TP3", "B", 10.0)])
+        self.assertEqual([r["source ref des"] for r in selector.selected_rows()], ["TP1", "TP3"])
+        self.assertEqual(selector.remove(["TP1-1"]), 1)
+        self.assertEqual([r["source ref des"] for r in selector.selected_rows()], ["TP3"])
+        self.assertEqual(selector.uncovered_nets(), [])
+        selector.remove(["TP3-1"])
+        self.assertEqual([r["source ref des"] for r in selector.selected_rows()], ["TP2"])
+
+    def test_random_is_valid(self):
+        rng = np.random.default_rng(0)
+        report = [
+            probe_row(f"TP{i}", f"N{rng.integers(0, 300)}", x, y, ("TOP", "BOTTOM")[i % 2])
+            for i, (x, y) in enumerate(rng.uniform(0, 50, (1000, 2)).tolist())
+        ]
+        selector = probe_select.ProbeSelector(report, "100mil")
+        rows = selector.selected_rows()
+        self.assertEqual(len({r["net"] for r in rows}), len(rows))
+        self.assertEqual(len(rows) + len(selector.uncovered_nets()), len({r["net"] for r in report}))
+        index = probe_spacing.ProbeIndex(rows)
+        a, b, _ = index.pairs_within(2.54)
+        self.assertFalse(any(rows[i]["side"] == rows[j]["side"] for i, j in zip(a, b)))
+
+
+class TestSyntheticBoard(unittest.TestCase):
+    def test_board(self):
+        board = synthetic_board.make_board(1000, test_point_fraction=0.2, seed=1)
+        self.assertEqual(len(board.GetPads()), 1000)
+        snapshot = pad_snapshot.take_snapshot(
+            board, pad_property=pad_snapshot.TEST_POINT_PROPERTY)
+        self.assertEqual(len(snapshot), 200)
+        self.assertEqual(set(snapshot.nets), set(board.GetNetsByName()))
+        self.assertTrue(snapshot.bottom.any() and not snapshot.bottom.all())
+        pads = pad_index.get_pads(list(zip(snapshot.ref_des, snapshot.pad_number)), board)
+        self.assertEqual([p.GetCenter().x for p in pads], snapshot.center[:, 0].tolist())
+
+    def test_repeatable(self):
+        a, b = (synthetic_board.make_board(300, seed=2) for _ in range(2))
+        self.assertEqual(
+            [(p.GetNetname(), p.GetCenter().x) for p in a.GetPads()],
+            [(p.GetNetname(), p.GetCenter().x) for p in b.GetPads()])
+
+    def test_write_kicad_pcb(self):
+        board = synthetic_board.make_board(500, seed=3)
+        snapshot = pad_snapshot.take_snapshot(board)
+        with tempfile.TemporaryDirectory() as d:
+            path = synthetic_board.write_kicad_pcb(board, Path(d) / "board.kicad_pcb")
+            read = kicad_pcb_reader.read_board(path)
+        for field in ("ref_des", "pad_number", "net", "has_hole", "bottom", "pad_property",
+                      "center", "size"):
+            self.assertEqual(np.asarray(getattr(read, field)).tolist(),
+                             np.asarray(getattr(snapshot, field)).tolist(), field)
+        named = np.asarray(snapshot.net) != ""
+        self.assertEqual(np.asarray(read.net_class)[named].tolist(),
+                         np.asarray(snapshot.net_class)[named].tolist())
+        self.assertEqual(read.aux_origin, snapshot.aux_origin)
+
+
+class TestStageTrace(unittest.TestCase):
+    def tearDown(self):
+        stage_trace.disable()
+
+    def test_disabled(self):
+        self.assertIsNone(stage_trace.active())
+        with stage_trace.span("nothing") as span:
+            span.set(pads=1)
+        board = make_board([make_pad()])
+        self.assertIs(stage_trace.traced(board), board)
+
+    def test_spans(self):
+        board = synthetic_board.make_board(500)
+        tracer = stage_trace.enable()
+        snapshot = pad_snapshot.take_snapshot(
+            stage_trace.traced(board), pad_property=pad_snapshot.TEST_POINT_PROPERTY)
+        with stage_trace.span("outer", board="synthetic") as span:
+            table = testpoint_table.TestPointTable.from_snapshot(snapshot, kicad_testpoints.Settings())
+            big = [0] * 100_000
+            span.set(size=len(big))
+            del big
+        net_coverage.net_coverage(snapshot, table)
+        stage_trace.disable()
+
+        events = {e["name"]: e for e in tracer.events}
+        self.assertEqual(
+            list(events),
+            ["pad discovery", "net lookup", "position transform", "report assembly", "outer",
+             "net coverage"])
+        discovery = events["pad discovery"]["args"]
+        self.assertEqual(discovery["pads read"], 500)
+        # GetPads, then one GetProperty call per pad and more for each test point
+        self.assertGreater(discovery["swig calls"], 500)
+        self.assertEqual(events["net lookup"]["args"]["nets"], len(board.GetNetsByName()))
+        self.assertEqual(events["outer"]["args"]["board"], "synthetic")
+        self.assertGreater(events["outer"]["args"]["peak memory kb"], 700)
+        outer, inner = events["outer"], events["report assembly"]
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_write_trace(self):
+        tracer = stage_trace.enable(memory=False)
+        with stage_trace.span("stage"):
+            pass
+        with tempfile.TemporaryDirectory() as d:
+            path = stage_trace.write_trace(Path(d) / "trace.json")
+            trace = json.loads(path.read_text())
+        self.assertEqual([e["name"] for e in trace["traceEvents"]], ["stage"])
+        self.assertEqual(trace["traceEvents"][0]["ph"], "X")
+        self.assertIn("stage", tracer.summary())
+
+    def test_batch_trace(self):
+        pcbnew = MagicMock()
+        pcbnew.LoadBoard.return_value = make_board([make_pad("TP1")])
+        with tempfile.TemporaryDirectory() as d, patch.dict(sys.modules, {"pcbnew": pcbnew}):
+            results = list(batch.run_batch([Path(d) / "board.kicad_pcb"], jobs=1, trace=True))
+        names = [e["name"] for e in results[0]["trace"]]
+        self.assertEqual(names[0], "load board")
+        self.assertIn("writing", names)
+        self.assertIsNone(stage_trace.active())
+
+
+class TestReportServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.board = write_test_board(self.dir.name)
+        self.cache = report_server.BoardCache("file")
+        self.service = report_server.ReportService(self.cache)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def get(self, path, **params):
+        content_type, body = self.service.handle(path, {"board": str(self.board), **params})
+        return json.loads(body) if content_type == "application/json" else body.decode()
+
+    def test_cached(self):
+        report = self.get("/report")
+        self.assertEqual([r["source ref des"] for r in report["rows"]], ["TP1", "J1"])
+        self.assertEqual(self.get("/report"), report)
+        self.assertEqual(self.get("/coverage")["uncovered"], ["Net-(J1-Pad2)"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["loads"], stats["hits"]), (1, 2))
+        self.assertGreater(stats["size mb"], 0)
+
+    def test_reloads_edited_board(self):
+        first = self.get("/report")
+        self.board.write_text(self.board.read_text().replace("(at 110 140 90)", "(at 111 140 90)"))
+        second = self.get("/report")
+        self.assertNotEqual(first["hash"], second["hash"])
+        self.assertEqual(len(self.cache.entries), 1)
+        self.assertEqual(self.cache.stats()["loads"], 2)
+
+    def test_distance(self):
+        distances = self.get("/distance", probe="TP1-1")["distances"]
+        self.assertEqual(distances["TP1-1"], 0.0)
+        self.assertAlmostEqual(distances["J1-1"], hypot(10.5, 8.75))
+        nearest = self.get("/distance", k="1")["nearest"]
+        self.assertEqual(nearest["TP1-1"][0]["neighbor"], "J1-1")
+        self.assertEqual(self.get("/distance", pitch="1")["pairs"], [])
+        csv_text = self.get("/report", format="csv", origin="absolute")
+        self.assertTrue(csv_text.startswith("source ref des,"))
+
+    def test_errors(self):
+        with self.assertRaises(UserWarning):
+            self.get("/distance", probe="TP9-1")
+        with self.assertRaises(FileNotFoundError):
+            self.service.handle("/report", {"board": str(Path(self.dir.name) / "missing.kicad_pcb")})
+        with self.assertRaises(LookupError):
+            self.service.handle("/nothing", {})
+
+    def test_failed_load(self):
+        cache = report_server.BoardCache("file", loader=MagicMock(side_effect=OSError("bad board")))
+        with self.assertRaises(OSError):
+            cache.get(self.board)
+        self.assertEqual(cache._loading, {})
+
+    def test_root(self):
+        service = report_server.ReportService(self.cache, root=Path(self.dir.name) / "boards")
+        with self.assertRaises(PermissionError):
+            service.handle("/report", {"board": str(self.board)})
+        service = report_server.ReportService(self.cache, root=self.dir.name)
+        self.assertEqual(service.handle("/report", {"board": str(self.board)})[0], "application/json")
+
+    def test_eviction(self):
+        cache = report_server.BoardCache("file", max_bytes=1)
+        paths = []
+        for name in ("a", "b"):
+            Path(self.dir.name, name).mkdir()
+            paths.append(write_test_board(str(Path(self.dir.name, name))))
+        for path in paths:
+            cache.get(path)
+        self.assertEqual([Path(k[0]) for k in cache.entries], [paths[1].resolve()])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_http(self):
+        import threading
+        import urllib.request
+        from urllib.parse import quote
+
+        server = report_server.make_server(self.service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            with urllib.request.urlopen(f"{url}/coverage?board={quote(str(self.board))}") as r:
+                self.assertEqual(json.loads(r.read())["covered"], 2)
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(f"{url}/report")
+            self.assertEqual(e.exception.code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestReportDiff(unittest.TestCase):
+    def setUp(self):
+        self.old = [
+            {**row, "net class": "Default", "pad type": "SMT", "footprint side": "TOP"}
+            for row in (
+                probe_row("TP1", "GND", 0.0), probe_row("TP2", "VCC", 5.0),
+                probe_row("TP3", "SDA", 10.0), probe_row("TP4", "SCL", 15.0),
+                probe_row("TP5", "RST", 20.0),
+            )
+        ]
+
+    def test_changes(self):
+        new = [
+            probe_row("TP1", "GND", 0.05),
+            probe_row("TP2", "VCC", 6.0),
+            probe_row("TP3", "SDA2", 10.0),
+            probe_row("TP40", "SCL", 15.02),
+            probe_row("TP6", "INT", 30.0),
+        ]
+        diff = report_diff.diff_reports(self.old, new)
+        self.assertEqual(
+            [(r["change"], r["old probe"], r["new probe"]) for r in diff.rows()],
+            [("added", "", "TP6-1"), ("removed", "TP5-1", ""), ("moved", "TP2-1", "TP2-1"),
+             ("net", "TP3-1", "TP3-1"), ("renamed", "TP4-1", "TP40-1")],
+        )
+        self.assertEqual(diff.matched, 4)
+        self.assertAlmostEqual(diff.of("moved")[0]["distance"], 1.0)
+        self.assertFalse(diff.fixture_reusable)
+
+    def test_reusable(self):
+        new = [dict(row) for row in self.old[:4]]
+        new[0]["side"] = "TOP"
+        new[1]["net"] = "3V3"
+        diff = report_diff.diff_reports(testpoint_table.TestPointTable.from_rows(self.old), new)
+        self.assertEqual(diff.counts()["removed"], 1)
+        self.assertEqual(diff.counts()["net"], 1)
+        self.assertTrue(diff.fixture_reusable)
+        self.assertIn("fixture can be reused", diff.summary())
+        new[2]["side"] = "BOTTOM"
+        self.assertEqual(len(report_diff.diff_reports(self.old, new).of("side")), 1)
+
+    def test_repeated_pad_numbers(self):
+        old = [{**probe_row("J1", "GND", x), "source pad": "MP"} for x in (0.0, 10.0, 20.0)]
+        new = [dict(row) for row in old[::-1]]
+        self.assertEqual(len(report_diff.diff_reports(old, new)), 0)
+        new[0]["x"] = 25.0
+        diff = report_diff.diff_reports(old, new)
+        self.assertEqual([(r["change"], r["old x"]) for r in diff.rows()], [("moved", 20.0)])
+        self.assertEqual(diff.matched, 3)
+
+    def test_report_files(self):
+        table = testpoint_table.TestPointTable.from_rows(self.old)
+        with tempfile.TemporaryDirectory() as d:
+            paths = report_writers.write_report(
+                table, [Path(d) / f"report{ext}" for ext in (".csv", ".jsonl", ".tpb")])
+            for path in paths:
+                self.assertEqual(len(report_diff.diff_reports(table, path)), 0)
+            diff = report_diff.diff_reports(paths[0], self.old[1:])
+            written = diff.write([Path(d) / "diff.csv"])[0].read_text().splitlines()
+        self.assertEqual(written[1].split(",")[:3], ["removed", "TP1-1", ""])
+
+
+class TestViaTargets(unittest.TestCase):
+    def make_board(self):
+        board = synthetic_board.Board()
+        gnd = board.nets["GND"] = synthetic_board.NetInfo("GND", "Power")
+        vias = [
+            synthetic_board.Via(gnd, synthetic_board.Vector(1_000_000, 2_000_000), 800_000, 400_000),
+            # Ring of 0.05 mm
+            synthetic_board.Via(gnd, synthetic_board.Vector(2_000_000, 0), 400_000, 300_000),
+            # Blind from the bottom
+            synthetic_board.Via(gnd, synthetic_board.Vector(3_000_000, 0), 800_000, 400_000,
+                                top=1),
+        ]
+        track = synthetic_board.Track(gnd, vias[0].position, vias[1].position, 200_000, 0)
+        board.tracks = [vias[0], track, vias[1], vias[2]]
+        return board
+
+    def test_sweep(self):
+        board = self.make_board()
+        snapshot = via_targets.via_snapshot(board)
+        self.assertEqual(snapshot.pad_number, ["1", "3"])
+        self.assertEqual(snapshot.bottom.tolist(), [False, True])
+        self.assertEqual(snapshot.net_class, ["Power", "Power"])
+        self.assertEqual(len(via_targets.via_snapshot(board, via_targets.ViaRules(0.05))), 3)
+
+        board.design_settings.m_TentViasFront = True
+        self.assertEqual(via_targets.via_snapshot(board).bottom.tolist(), [True, True])
+        board.design_settings.m_TentViasBack = True
+        self.assertEqual(len(via_targets.via_snapshot(board)), 0)
+        tented = via_targets.ViaRules(tented=True)
+        self.assertEqual(len(via_targets.via_snapshot(board, tented)), 2)
+
+    def test_report(self):
+        pads = pad_snapshot.take_snapshot(make_board([make_pad("TP1")]))
+        snapshot = pad_snapshot.concat([pads, via_targets.via_snapshot(self.make_board())])
+        rows = pad_snapshot.build_report(snapshot, kicad_testpoints.Settings())
+        self.assertEqual([probe_spacing.probe_name(r) for r in rows], ["TP1-1", "VIA-1", "VIA-3"])
+        self.assertEqual(rows[1]["pad type"], "THRU")
+        self.assertEqual(rows[2]["side"], "BOTTOM")
+        self.assertEqual(len(snapshot.test_points()), 3)
+
+    def test_read_board(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = write_test_board(d)
+            snapshot = kicad_pcb_reader.read_board(
+                path, pad_property=pad_snapshot.TEST_POINT_PROPERTY, vias=via_targets.ViaRules())
+            self.assertEqual(list(zip(snapshot.ref_des, snapshot.pad_number)),
+                             [("TP1", "1"), ("J1", "1"), ("VIA", "3")])
+            self.assertEqual(snapshot.center[2].tolist(), [117_000_000, 145_000_000])
+            self.assertTrue(snapshot.bottom[2])
+            self.assertEqual(snapshot.net[2], "/SDA")
+
+            rules = via_targets.ViaRules(tented=True)
+            snapshot = batch.load_snapshot(path, "file", vias=rules)
+            self.assertEqual(snapshot.pad_number[2:], ["1", "3"])
+            self.assertFalse(snapshot.bottom[2])
+            snapshot = batch.load_snapshot(
+                path, "file", "property:testpoint and not ref:VIA", vias=rules)
+            self.assertEqual(snapshot.ref_des, ["TP1", "J1"])
+
+    def test_report_job(self):
+        with tempfile.TemporaryDirectory() as d:
+            job = report_job.ReportJob(
+                self.make_board(), Path(d) / "board-testpoints.csv", kicad_testpoints.Settings(),
+                vias=via_targets.ViaRules())
+            while not job.step():
+                pass
+        self.assertEqual(job.data.column("source pad"), ["1", "3"])
+
+
+class TestProbePlate(unittest.TestCase):
+    def setUp(self):
+        rows = [
+            probe_row("TP1", "A", 1.0, 2.0),
+            probe_row("TP2", "B", 3.0, 4.0, side="BOTTOM"),
+            probe_row("J1", "C", 5.0, 6.0),
+        ]
+        for row, pad_type in zip(rows, ("SMT", "SMT", "THRU")):
+            row.update({"net class": "Default", "pad type": pad_type, "footprint side": row["side"]})
+        self.table = testpoint_table.TestPointTable.from_rows(rows)
+        self.sizes = {("TP1", "1"): 1.2, ("TP2", "1"): 0.5, ("J1", "1"): 1.2}
+
+    def test_classes_by_size(self):
+        index, ordered = probe_plate.classes_by_size(
+            np.array([0.5, 0.8, 1.2, 2.0, 1.2, np.nan]), np.array([0, 0, 0, 0, 1, 0]))
+        self.assertEqual(
+            [ordered[i].name for i in index],
+            ["39mil", "50mil", "75mil", "100mil", "100mil", "100mil"])
+
+    def test_holes(self):
+        top, bottom = probe_plate.plate_holes(self.table, pad_sizes=self.sizes)
+        self.assertEqual(top.names, ["TP1-1", "J1-1"])
+        self.assertEqual(top.diameter.tolist(), [1.35, 1.7])
+        self.assertEqual(bottom.x.tolist(), [-3.0])
+        self.assertEqual(bottom.counts(), {"39mil": 1})
+        top, _ = probe_plate.plate_holes(self.table, "50mil")
+        self.assertEqual(top.diameter.tolist(), [0.9, 0.9])
+
+    def test_write(self):
+        outline = [np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0]])]
+        with tempfile.TemporaryDirectory() as d:
+            paths = probe_plate.write_plates(
+                self.table, Path(d) / "board.kicad_pcb", pad_sizes=self.sizes, outline=outline)
+            self.assertEqual(
+                [p.name for p in paths],
+                ["board-plate-top.drl", "board-plate-top.dxf", "board-plate-bottom.drl",
+                 "board-plate-bottom.dxf"])
+            drill = paths[0].read_text().splitlines()
+            dxf = paths[3].read_text().splitlines()
+        self.assertEqual(drill[4:6], ["T1C1.350", "T2C1.700"])
+        self.assertEqual(drill[9:], ["T1", "X1.0000Y2.0000", "T2", "X5.0000Y6.0000", "M30"])
+        self.assertEqual(dxf.count("CIRCLE"), 1)
+        self.assertEqual(dxf.count("LINE"), 3)
+        self.assertIn("-10.0000", dxf)
+        self.assertEqual(dxf[-1], "EOF")
+        with self.assertRaises(UserWarning):
+            probe_plate.write_plates(self.table, Path("board"), extensions=(".gbr",))
+
+
+class TestReportReader(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        columns = testpoint_table.TestPointTable.columns
+        records = [
+            (f"TP{i}", "1", "GND" if i % 2 else f"NET{i}", "Default",
+             "BOTTOM" if i % 3 == 0 else "TOP", float(i), -0.5 * i, "SMD", "TOP")
+            for i in range(10)
+        ]
+        records[4] = ("J1", "2", 'SIG,"A"', "Default", "TOP", 4.0, -2.0, "THRU", "TOP")
+        self.rows = [dict(zip(columns, r)) for r in records]
+        self.csv = Path(self.dir.name) / "report.csv"
+        self.tpb = Path(self.dir.name) / "report.tpb"
+        report_writers.write_report(self.rows, [self.csv, self.tpb], size=4)
+
+    def test_columns_and_quoted_values(self):
+        with report_reader.ReportReader(self.csv) as report:
+            self.assertEqual(len(report), 10)
+            self.assertEqual(report.columns, testpoint_table.TestPointTable.columns)
+            self.assertEqual(report.column("net")[4], 'SIG,"A"')
+            np.testing.assert_array_equal(report.column("x"), np.arange(10.0))
+
+    def test_index_cached_next_to_file(self):
+        cached = report_reader.index_path(self.csv)
+        report_reader.ReportReader(self.csv).close()
+        self.assertTrue(cached.exists())
+        with patch.object(report_reader, "_row_offsets", side_effect=AssertionError):
+            with report_reader.ReportReader(self.csv) as report:
+                self.assertEqual(report.column("source ref des")[9], "TP9")
+        report_reader.ReportReader(self.csv, cache_index=False).close()
+
+    def test_filters(self):
+        for path in (self.csv, self.tpb):
+            with report_reader.ReportReader(path) as report:
+                rows = report.where(side="TOP", net="GND")
+                self.assertEqual(rows.tolist(), [1, 5, 7])
+                self.assertEqual(report.where(ref_des=["J*", "TP0"]).tolist(), [0, 4])
+                self.assertEqual(report.column("source ref des", rows), ["TP1", "TP5", "TP7"])
+
+    def test_formats_agree(self):
+        with report_reader.ReportReader(self.csv) as a, report_reader.ReportReader(self.tpb) as b:
+            self.assertEqual(list(a.table().rows()), self.rows)
+            self.assertEqual(list(b.table().rows()), self.rows)
+
+    def test_to_pandas_for_distances(self):
+        with report_reader.ReportReader(self.csv) as report:
+            df = report.to_pandas(report.where(side="TOP"))
+        self.assertEqual(df["x"].dtype, np.float64)
+        self.assertEqual(df["net"].dtype, "category")
+        distances = probe_spacing.calc_probe_distances("TP1-1", df)
+        self.assertAlmostEqual(distances["J1-2"], hypot(3.0, 1.5))
+
+    def test_unknown_format(self):
+        path = Path(self.dir.name) / "report.jsonl"
+        path.write_text("")
+        with self.assertRaises(UserWarning):
+            report_reader.ReportReader(path)
+
+
+class TestReportWriters(unittest.TestCase):
+    def setUp(self):
+        pads = [
+            make_pad(f"TP{i}", net=f"NET{i % 3}", center=(i * 100_000, -i * 50_000), has_hole=i % 2)
+            for i in range(7)
+        ]
+        settings = kicad_testpoints.Settings()
+        self.report = pad_snapshot.build_report(
+            pad_snapshot.take_snapshot(make_board(pads)), settings)
+
+    def test_formats_in_one_pass(self):
+        with tempfile.TemporaryDirectory() as d:
+            paths = [Path(d) / f"report{ext}" for ext in (".csv", ".jsonl", ".tpb")]
+            report_writers.write_report(self.report, paths, size=3)
+            reference = Path(d) / "reference.csv"
+            kicad_testpoints.write_csv(self.report, filename=reference)
+            self.assertEqual(paths[0].read_text(), reference.read_text())
+            with paths[1].open() as f:
+                self.assertEqual([json.loads(line) for line in f], self.report)
+            table = report_writers.read_packed(paths[2])
+            self.assertEqual(list(table.rows()), self.report)
+
+    def test_table_source(self):
+        table = testpoint_table.TestPointTable.from_rows(self.report)
+        chunks = list(report_writers.report_chunks(table, 3))
+        self.assertEqual([len(c) for c in chunks], [3, 3, 1])
+        self.assertEqual(sum(chunks, []), list(table.records()))
+
+    def test_unknown_format(self):
+        with self.assertRaises(UserWarning):
+            report_writers.writer_for("report.xlsx")
+
+    def test_incomplete_writer(self):
+        class NoWrite(report_writers.ReportWriter):
+            extension = ".txt"
+
+        with self.assertRaises(TypeError):
+            NoWrite("report.txt")
+
+
 if __name__ == "__main__":
     unittest.main()